@@ -33,8 +33,12 @@ class TuiuiuPagination(BasePagination):
         stop = offset + limit
 
         self.view = view
+
+        # Fetch the page before counting, as search results get the total
+        # count along with the page and don't need to query it separately
+        results = list(queryset[start:stop])
         self.total_count = queryset.count()
-        return queryset[start:stop]
+        return results
 
     def get_paginated_response(self, data):
         data = OrderedDict([
@@ -1,36 +1,152 @@
 from __future__ import absolute_import, unicode_literals
 
 import logging
+import threading
 import uuid
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import requests
 from django.core.exceptions import ImproperlyConfigured
-from django.utils.six.moves.urllib.error import HTTPError, URLError
 from django.utils.six.moves.urllib.parse import urlparse, urlunparse
-from django.utils.six.moves.urllib.request import Request, urlopen
 
 from tuiuiu import __version__
 
 logger = logging.getLogger('tuiuiu.frontendcache')
 
 
-class PurgeRequest(Request):
-    def get_method(self):
-        return 'PURGE'
+class PurgeError(Exception):
+    """
+    Raised by `purge_batch` when some URLs couldn't be purged because of an
+    error that may go away if they are tried again later, such as a network
+    failure. `urls` lists the URLs that should be retried.
+    """
+    def __init__(self, message, urls):
+        super(PurgeError, self).__init__(message)
+        self.urls = urls
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(location, pool_size=1):
+    """
+    Return the requests session shared by all the backends purging from
+    `location` (a scheme and host), so that they reuse keep-alive connections
+    rather than opening a new one for every request. The session keeps up to
+    `pool_size` connections open.
+    """
+    key = (location, pool_size)
+
+    with _sessions_lock:
+        if key not in _sessions:
+            session = requests.Session()
+            session.headers['User-Agent'] = 'Tuiuiu-frontendcache/' + __version__
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount(location, adapter)
+            _sessions[key] = session
+
+        return _sessions[key]
 
 
 class BaseBackend(object):
+    # Whether the backend can purge responses by their cache tags. Those that
+    # can't purge the URLs recorded for the tags instead.
+    supports_tags = False
+
+    # How many requests the backend may make to the cache at the same time
+    concurrency = 1
+
     def purge(self, url):
         raise NotImplementedError
 
+    def purge_batch(self, urls):
+        """
+        Purge a list of URLs, making as few requests as the cache allows. Raises
+        PurgeError for the URLs that failed and can be retried.
+
+        `purge` may return False to signal that the URL couldn't be purged but
+        can be retried.
+        """
+        results = self.map_concurrently(self.purge, urls)
+        failed_urls = [url for url, result in zip(urls, results) if result is False]
+
+        if failed_urls:
+            raise PurgeError("Couldn't connect to the cache", failed_urls)
+
+    def map_concurrently(self, func, items):
+        """
+        Call `func` on each item, on up to `concurrency` threads at once, and
+        return the results in order
+        """
+        concurrency = min(self.concurrency, len(items))
+        if concurrency <= 1:
+            return [func(item) for item in items]
+
+        pool = ThreadPool(concurrency)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+
+    def purge_tags(self, tags):
+        """
+        Purge the responses with any of the given cache tags
+        """
+        from tuiuiu.contrib.frontendcache.utils import get_urls_for_tags
+
+        self.purge_batch(get_urls_for_tags(tags))
+
 
 class HTTPBackend(BaseBackend):
+    supports_tags = True
+
     def __init__(self, params):
         location_url_parsed = urlparse(params.pop('LOCATION'))
         self.cache_scheme = location_url_parsed.scheme
         self.cache_netloc = location_url_parsed.netloc
+        self.tags_header = params.pop('TAGS_HEADER', 'Surrogate-Key')
+        self.concurrency = params.pop('CONCURRENCY', 1)
+        self.timeout = params.pop('TIMEOUT', 10)
+
+        self.session = get_session(
+            urlunparse([self.cache_scheme, self.cache_netloc, '', '', '', '']),
+            pool_size=self.concurrency
+        )
 
     def purge(self, url):
+        try:
+            self._purge_url(url)
+        except requests.exceptions.HTTPError as e:
+            logger.error(
+                "Couldn't purge '%s' from HTTP cache. HTTPError: %d %s",
+                url, e.response.status_code, e.response.reason)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            logger.error("Couldn't purge '%s' from HTTP cache. URLError: %s", url, e)
+            return False
+        except requests.exceptions.RequestException as e:
+            logger.error("Couldn't purge '%s' from HTTP cache. %s", url, e)
+
+    def purge_tags(self, tags):
+        try:
+            self._send_purge_request(
+                urlunparse([self.cache_scheme, self.cache_netloc, '/', '', '', '']),
+                {self.tags_header: ' '.join(tags)}
+            )
+        except requests.exceptions.HTTPError as e:
+            logger.error(
+                "Couldn't purge tags from HTTP cache. HTTPError: %d %s",
+                e.response.status_code, e.response.reason)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            raise PurgeError("Couldn't purge tags from HTTP cache. URLError: %s" % e, tags)
+
+    def _send_purge_request(self, url, headers):
+        response = self.session.request(
+            'PURGE', url, headers=headers, timeout=self.timeout, allow_redirects=False)
+        response.raise_for_status()
+
+    def _purge_url(self, url):
         url_parsed = urlparse(url)
         host = url_parsed.hostname
 
@@ -38,8 +154,8 @@ class HTTPBackend(BaseBackend):
         if url_parsed.port:
             host += (':' + str(url_parsed.port))
 
-        request = PurgeRequest(
-            url=urlunparse([
+        self._send_purge_request(
+            urlunparse([
                 self.cache_scheme,
                 self.cache_netloc,
                 url_parsed.path,
@@ -47,27 +163,55 @@ class HTTPBackend(BaseBackend):
                 url_parsed.query,
                 url_parsed.fragment
             ]),
-            headers={
-                'Host': host,
-                'User-Agent': 'Tuiuiu-frontendcache/' + __version__
-            }
+            {'Host': host}
         )
 
-        try:
-            urlopen(request)
-        except HTTPError as e:
-            logger.error("Couldn't purge '%s' from HTTP cache. HTTPError: %d %s", url, e.code, e.reason)
-        except URLError as e:
-            logger.error("Couldn't purge '%s' from HTTP cache. URLError: %s", url, e.reason)
-
 
 class CloudflareBackend(BaseBackend):
+    # Purging by tag requires an Enterprise plan
+    supports_tags = True
+
+    # The most files (or tags) Cloudflare accepts in one purge request
+    batch_size = 30
+
     def __init__(self, params):
         self.cloudflare_email = params.pop('EMAIL')
         self.cloudflare_token = params.pop('TOKEN')
         self.cloudflare_zoneid = params.pop('ZONEID')
+        self.concurrency = params.pop('CONCURRENCY', 1)
+        self.timeout = params.pop('TIMEOUT', 10)
+
+        self.session = get_session('https://api.cloudflare.com', pool_size=self.concurrency)
 
     def purge(self, url):
+        try:
+            self.purge_batch([url])
+        except PurgeError as e:
+            logger.error("Couldn't purge '%s' from Cloudflare. %s", url, e)
+
+    def purge_batch(self, urls):
+        self._purge_in_batches('files', urls)
+
+    def purge_tags(self, tags):
+        self._purge_in_batches('tags', tags)
+
+    def _purge_in_batches(self, kind, items):
+        def purge_batch(batch):
+            try:
+                self._purge(kind, batch)
+            except PurgeError as e:
+                return e.urls
+            return []
+
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        failed_items = [item for failed_batch in self.map_concurrently(purge_batch, batches) for item in failed_batch]
+
+        if failed_items:
+            raise PurgeError("Couldn't connect to Cloudflare", failed_items)
+
+    def _purge(self, kind, items):
+        items_display = "', '".join(items)
+
         try:
             purge_url = 'https://api.cloudflare.com/client/v4/zones/{0}/purge_cache'.format(self.cloudflare_zoneid)
 
@@ -77,32 +221,40 @@ class CloudflareBackend(BaseBackend):
                 "Content-Type": "application/json",
             }
 
-            data = {"files": [url]}
+            data = {kind: items}
 
-            response = requests.delete(
+            response = self.session.delete(
                 purge_url,
                 json=data,
                 headers=headers,
+                timeout=self.timeout,
             )
 
+            if response.status_code >= 500:
+                # Cloudflare is having trouble; try again later
+                raise PurgeError("Cloudflare responded with %d" % response.status_code, items)
+
             try:
                 response_json = response.json()
             except ValueError:
                 if response.status_code != 200:
                     response.raise_for_status()
                 else:
-                    logger.error("Couldn't purge '%s' from Cloudflare. Unexpected JSON parse error.", url)
+                    logger.error("Couldn't purge '%s' from Cloudflare. Unexpected JSON parse error.", items_display)
+                return
 
         except requests.exceptions.HTTPError as e:
-            logger.error("Couldn't purge '%s' from Cloudflare. HTTPError: %d %s", url, e.response.status_code, e.message)
+            logger.error("Couldn't purge '%s' from Cloudflare. HTTPError: %d %s", items_display, e.response.status_code, e)
             return
         except requests.exceptions.InvalidURL as e:
-            logger.error("Couldn't purge '%s' from Cloudflare. URLError: %s", url, e.message)
+            logger.error("Couldn't purge '%s' from Cloudflare. URLError: %s", items_display, e)
             return
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            raise PurgeError(str(e), items)
 
         if response_json['success'] is False:
             error_messages = ', '.join([str(err['message']) for err in response_json['errors']])
-            logger.error("Couldn't purge '%s' from Cloudflare. Cloudflare errors '%s'", url, error_messages)
+            logger.error("Couldn't purge '%s' from Cloudflare. Cloudflare errors '%s'", items_display, error_messages)
             return
 
 
@@ -118,26 +270,53 @@ class CloudfrontBackend(BaseBackend):
                 "The setting 'FRONTENDCACHE' requires the object 'DISTRIBUTION_ID'."
             )
 
+    # The most paths CloudFront accepts in one invalidation
+    batch_size = 3000
+
+    # Errors that mean CloudFront can't take any more invalidations right now
+    retry_error_codes = ['Throttling', 'TooManyInvalidationsInProgress', 'ServiceUnavailable']
+
     def purge(self, url):
-        url_parsed = urlparse(url)
-        distribution_id = None
+        try:
+            self.purge_batch([url])
+        except PurgeError as e:
+            logger.error("Couldn't purge '%s' from CloudFront. %s", url, e)
 
+    def get_distribution_id(self, url):
         if isinstance(self.cloudfront_distribution_id, dict):
-            host = url_parsed.hostname
+            host = urlparse(url).hostname
             if host in self.cloudfront_distribution_id:
-                distribution_id = self.cloudfront_distribution_id.get(host)
+                return self.cloudfront_distribution_id.get(host)
             else:
                 logger.info(
                     "Couldn't purge '%s' from CloudFront. Hostname '%s' not found in the DISTRIBUTION_ID mapping",
                     url, host)
         else:
-            distribution_id = self.cloudfront_distribution_id
+            return self.cloudfront_distribution_id
+
+    def purge_batch(self, urls):
+        # Invalidate all the paths of each distribution together
+        urls_by_distribution = OrderedDict()
+        for url in urls:
+            distribution_id = self.get_distribution_id(url)
+            if distribution_id:
+                urls_by_distribution.setdefault(distribution_id, []).append(url)
 
-        if distribution_id:
-            path = url_parsed.path
-            self._create_invalidation(distribution_id, path)
+        failed_urls = []
+        for distribution_id, distribution_urls in urls_by_distribution.items():
+            for i in range(0, len(distribution_urls), self.batch_size):
+                batch_urls = distribution_urls[i:i + self.batch_size]
+                paths = [urlparse(url).path for url in batch_urls]
 
-    def _create_invalidation(self, distribution_id, path):
+                try:
+                    self._create_invalidation(distribution_id, paths)
+                except PurgeError:
+                    failed_urls.extend(batch_urls)
+
+        if failed_urls:
+            raise PurgeError("CloudFront is not accepting invalidations", failed_urls)
+
+    def _create_invalidation(self, distribution_id, paths):
         import botocore
 
         try:
@@ -145,15 +324,16 @@ class CloudfrontBackend(BaseBackend):
                 DistributionId=distribution_id,
                 InvalidationBatch={
                     'Paths': {
-                        'Quantity': 1,
-                        'Items': [
-                            path,
-                        ]
+                        'Quantity': len(paths),
+                        'Items': paths,
                     },
                     'CallerReference': str(uuid.uuid4())
                 }
             )
         except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in self.retry_error_codes:
+                raise PurgeError(e.response['Error']['Message'], paths)
+
             logger.error(
-                "Couldn't purge '%s' from CloudFront. ClientError: %s %s", path, e.response['Error']['Code'],
-                e.response['Error']['Message'])
+                "Couldn't purge '%s' from CloudFront. ClientError: %s %s", "', '".join(paths),
+                e.response['Error']['Code'], e.response['Error']['Message'])
@@ -0,0 +1,68 @@
+from __future__ import absolute_import, unicode_literals
+
+from collections import defaultdict
+
+import django
+from django.conf import settings
+
+from tuiuiu.contrib.frontendcache.utils import (
+    add_url_to_tag_index, get_backends, get_catch_all_cache_tag)
+from tuiuiu.tuiuiucore.cache_tags import (
+    activate_cache_tag_tracker, deactivate_cache_tag_tracker, get_cache_tag_tracker)
+
+if django.VERSION >= (1, 10):
+    from django.utils.deprecation import MiddlewareMixin
+else:
+    MiddlewareMixin = object
+
+
+class CacheTagMiddleware(MiddlewareMixin):
+    """
+    Tag each response with the pages, images, documents and snippets used to
+    build it, in Cache-Tag and Surrogate-Key headers, so that the frontend
+    cache can purge all the responses depending on an object when it changes.
+
+    Responses depending on more than FRONTENDCACHE_MAX_TAGS_PER_MODEL objects
+    of a model are given that model's catch-all tag (e.g. 'tuiuiucore.page-all')
+    instead, which is purged along with every object of the model.
+    """
+    def process_request(self, request):
+        activate_cache_tag_tracker()
+
+    def process_response(self, request, response):
+        tracker = get_cache_tag_tracker()
+        deactivate_cache_tag_tracker()
+
+        if tracker is None or not tracker.tags:
+            return response
+
+        tags = self.collapse_tags(tracker.tags)
+
+        header_names = getattr(settings, 'FRONTENDCACHE_TAG_HEADERS', ['Cache-Tag', 'Surrogate-Key'])
+        for header_name in header_names:
+            # Cloudflare expects a comma separated list, others a space separated one
+            separator = ',' if header_name.lower() == 'cache-tag' else ' '
+            response[header_name] = separator.join(tags)
+
+        # Remember the URL of the response for each tag, for backends that can't purge by tag
+        if request.method == 'GET' and response.status_code == 200:
+            if any(not backend.supports_tags for backend in get_backends().values()):
+                add_url_to_tag_index(request.build_absolute_uri(), tags)
+
+        return response
+
+    def collapse_tags(self, tags):
+        max_tags = getattr(settings, 'FRONTENDCACHE_MAX_TAGS_PER_MODEL', 50)
+
+        tags_by_model = defaultdict(list)
+        for tag in tags:
+            tags_by_model[get_catch_all_cache_tag(tag)].append(tag)
+
+        collapsed_tags = []
+        for catch_all_tag, model_tags in tags_by_model.items():
+            if len(model_tags) > max_tags:
+                collapsed_tags.append(catch_all_tag)
+            else:
+                collapsed_tags.extend(model_tags)
+
+        return sorted(collapsed_tags)
@@ -0,0 +1,133 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+
+from tuiuiu.contrib.frontendcache.backends import PurgeError
+from tuiuiu.contrib.frontendcache.utils import expand_cache_tags, get_backends, timed_purge
+from tuiuiu.utils.transaction import CommitBatch
+
+logger = logging.getLogger('tuiuiu.frontendcache')
+
+
+class PurgeQueue(object):
+    """
+    Collects the URLs and cache tags to purge from the frontend caches during a
+    transaction, and purges them once it is committed, in a pool of WORKERS
+    threads (or in the committing thread if WORKERS is 0). Nothing is purged
+    for a transaction that is rolled back.
+
+    Each URL or tag is purged once however many times it was added, and each
+    backend is given all of them at once so that it can purge them in as few
+    requests as possible. Those that fail with a PurgeError are retried up to
+    RETRIES times, waiting RETRY_DELAY seconds (doubling each time) in between.
+    """
+    def __init__(self, params):
+        self.workers = params.get('WORKERS', 1)
+        self.retries = params.get('RETRIES', 3)
+        self.retry_delay = params.get('RETRY_DELAY', 1)
+
+        self._batch = CommitBatch(self.flush)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def add(self, kind, items):
+        if not items:
+            return
+
+        pending = self._batch.get_pending()
+        for item in items:
+            pending[(kind, item)] = True
+
+        self._batch.schedule()
+
+    def add_urls(self, urls):
+        """
+        Queue the URLs to be purged when the current transaction is committed
+        """
+        self.add('urls', urls)
+
+    def add_tags(self, tags):
+        """
+        Queue the cache tags to be purged when the current transaction is committed
+        """
+        self.add('tags', tags)
+
+    def flush(self, pending):
+        """
+        Purge the URLs and tags queued in a transaction that has been committed
+        """
+        urls = [item for kind, item in pending if kind == 'urls']
+        tags = [item for kind, item in pending if kind == 'tags']
+
+        if self.workers:
+            self.get_pool().apply_async(self.purge, (urls, tags))
+        else:
+            self.purge(urls, tags)
+
+    def get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+
+            return self._pool
+
+    def purge(self, urls, tags=()):
+        if tags:
+            tags = expand_cache_tags(tags)
+
+        for backend_name, backend in get_backends().items():
+            try:
+                if urls:
+                    for url in urls:
+                        logger.info("[%s] Purging URL: %s", backend_name, url)
+                    self.purge_with_retries(backend_name, backend.purge_batch, urls)
+
+                if tags:
+                    logger.info("[%s] Purging tags: %s", backend_name, ', '.join(tags))
+                    self.purge_with_retries(backend_name, backend.purge_tags, tags)
+            except Exception:
+                logger.exception("[%s] Failed to purge", backend_name)
+
+    def purge_with_retries(self, backend_name, purge, items):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+                logger.info("[%s] Retrying purge of %d items", backend_name, len(items))
+
+            try:
+                timed_purge(backend_name, purge, items)
+                return
+            except PurgeError as e:
+                items = e.urls
+
+        logger.error(
+            "[%s] Couldn't purge after %d attempts: %s", backend_name, self.retries + 1, ', '.join(items))
+
+
+_queue = None
+_queue_params = None
+_queue_lock = threading.Lock()
+
+
+def get_purge_queue():
+    """
+    Return the purge queue configured by FRONTENDCACHE_QUEUE, or None if
+    pages are purged as soon as they are published (the default)
+    """
+    global _queue, _queue_params
+
+    params = getattr(settings, 'FRONTENDCACHE_QUEUE', None)
+    if not params:
+        return None
+
+    with _queue_lock:
+        if _queue is None or _queue_params != params:
+            _queue = PurgeQueue(params)
+            _queue_params = params
+
+        return _queue
@@ -1,17 +1,73 @@
 from __future__ import absolute_import, unicode_literals
 
 from django.apps import apps
+from django.db.models.signals import post_delete, post_save
 
-from tuiuiu.contrib.frontendcache.utils import purge_page_from_cache
+from tuiuiu.contrib.frontendcache.purge_queue import get_purge_queue
+from tuiuiu.contrib.frontendcache.utils import (
+    cache_tags_enabled, get_page_cache_tags, get_page_cached_urls, purge_page_from_cache,
+    purge_tags_from_cache)
+from tuiuiu.tuiuiucore.cache_tags import get_object_cache_tag
 from tuiuiu.tuiuiucore.signals import page_published, page_unpublished
 
 
+def purge_page(page):
+    tags = get_page_cache_tags(page) if cache_tags_enabled() else []
+
+    queue = get_purge_queue()
+    if queue is not None:
+        queue.add_urls(get_page_cached_urls(page))
+        queue.add_tags(tags)
+    else:
+        purge_page_from_cache(page)
+        purge_tags_from_cache(tags)
+
+
+def purge_object(obj):
+    if not cache_tags_enabled():
+        return
+
+    tags = [get_object_cache_tag(obj)]
+
+    queue = get_purge_queue()
+    if queue is not None:
+        queue.add_tags(tags)
+    else:
+        purge_tags_from_cache(tags)
+
+
 def page_published_signal_handler(instance, **kwargs):
-    purge_page_from_cache(instance)
+    purge_page(instance)
 
 
 def page_unpublished_signal_handler(instance, **kwargs):
-    purge_page_from_cache(instance)
+    purge_page(instance)
+
+
+def object_changed_signal_handler(instance, **kwargs):
+    purge_object(instance)
+
+
+def get_tagged_models():
+    """
+    Return the models other than pages whose objects are recorded in cache
+    tags: images, documents and snippets
+    """
+    models = []
+
+    if apps.is_installed('tuiuiu.tuiuiuimages'):
+        from tuiuiu.tuiuiuimages import get_image_model
+        models.append(get_image_model())
+
+    if apps.is_installed('tuiuiu.tuiuiudocs'):
+        from tuiuiu.tuiuiudocs.models import get_document_model
+        models.append(get_document_model())
+
+    if apps.is_installed('tuiuiu.tuiuiusnippets'):
+        from tuiuiu.tuiuiusnippets.models import get_snippet_models
+        models.extend(get_snippet_models())
+
+    return models
 
 
 def register_signal_handlers():
@@ -23,3 +79,7 @@ def register_signal_handlers():
     for model in indexed_models:
         page_published.connect(page_published_signal_handler, sender=model)
         page_unpublished.connect(page_unpublished_signal_handler, sender=model)
+
+    for model in get_tagged_models():
+        post_save.connect(object_changed_signal_handler, sender=model)
+        post_delete.connect(object_changed_signal_handler, sender=model)
@@ -1,16 +1,24 @@
 from __future__ import absolute_import, unicode_literals
 
 import mock
+import requests
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 from django.test.utils import override_settings
 
 from tuiuiu.contrib.frontendcache.backends import (
-    BaseBackend, CloudflareBackend, CloudfrontBackend, HTTPBackend)
-from tuiuiu.contrib.frontendcache.utils import get_backends
+    BaseBackend, CloudflareBackend, CloudfrontBackend, HTTPBackend, PurgeError)
+from tuiuiu.contrib.frontendcache.purge_queue import get_purge_queue
+from tuiuiu.contrib.frontendcache.utils import (
+    add_url_to_tag_index, expand_cache_tags, get_backends, get_urls_for_tags, purge_tags_from_cache)
 from tuiuiu.tests.testapp.models import EventIndex
 from tuiuiu.tuiuiucore.models import Page
+from tuiuiu.tuiuiuimages.models import Image
+from tuiuiu.tuiuiuimages.tests.utils import get_test_image_file
 
 
 class TestBackendConfiguration(TestCase):
@@ -83,7 +91,115 @@ class TestBackendConfiguration(TestCase):
         backends.get('cloudfront').purge('http://www.tuiuiu.io/home/events/christmas/')
         backends.get('cloudfront').purge('http://torchbox.com/blog/')
 
-        _create_invalidation.assert_called_once_with('frontend', '/home/events/christmas/')
+        _create_invalidation.assert_called_once_with('frontend', ['/home/events/christmas/'])
+
+    @mock.patch('tuiuiu.contrib.frontendcache.backends.CloudfrontBackend._create_invalidation')
+    def test_cloudfront_purge_batch(self, _create_invalidation):
+        backends = get_backends(backend_settings={
+            'cloudfront': {
+                'BACKEND': 'tuiuiu.contrib.frontendcache.backends.CloudfrontBackend',
+                'DISTRIBUTION_ID': {
+                    'www.tuiuiu.io': 'frontend',
+                    'torchbox.com': 'torchbox',
+                }
+            },
+        })
+        backends.get('cloudfront').purge_batch([
+            'http://www.tuiuiu.io/home/events/christmas/',
+            'http://torchbox.com/blog/',
+            'http://www.tuiuiu.io/home/events/',
+        ])
+
+        self.assertEqual(_create_invalidation.call_args_list, [
+            mock.call('frontend', ['/home/events/christmas/', '/home/events/']),
+            mock.call('torchbox', ['/blog/']),
+        ])
+
+    @mock.patch('tuiuiu.contrib.frontendcache.backends.requests.Session.delete')
+    def test_cloudflare_purge_batch(self, delete):
+        delete.return_value.status_code = 200
+        delete.return_value.json.return_value = {'success': True}
+
+        backends = get_backends(backend_settings={
+            'cloudflare': {
+                'BACKEND': 'tuiuiu.contrib.frontendcache.backends.CloudflareBackend',
+                'EMAIL': 'test@test.com',
+                'TOKEN': 'this is the token',
+                'ZONEID': 'this is a zone id',
+            },
+        })
+        urls = ['http://www.tuiuiu.io/%d/' % i for i in range(65)]
+        backends.get('cloudflare').purge_batch(urls)
+
+        # Cloudflare accepts 30 files per request
+        self.assertEqual(
+            [call[1]['json']['files'] for call in delete.call_args_list],
+            [urls[0:30], urls[30:60], urls[60:65]]
+        )
+
+    @mock.patch('tuiuiu.contrib.frontendcache.backends.requests.Session.delete')
+    def test_cloudflare_purge_batch_connection_error(self, delete):
+        delete.side_effect = requests.exceptions.ConnectionError("Connection refused")
+
+        backend = CloudflareBackend({
+            'EMAIL': 'test@test.com',
+            'TOKEN': 'this is the token',
+            'ZONEID': 'this is a zone id',
+        })
+
+        with self.assertRaises(PurgeError) as cm:
+            backend.purge_batch(['http://www.tuiuiu.io/'])
+
+        self.assertEqual(cm.exception.urls, ['http://www.tuiuiu.io/'])
+
+    def test_backends_are_reused(self):
+        backend_settings = {
+            'varnish': {
+                'BACKEND': 'tuiuiu.contrib.frontendcache.backends.HTTPBackend',
+                'LOCATION': 'http://localhost:8000',
+            },
+        }
+
+        self.assertIs(get_backends(backend_settings)['varnish'], get_backends(backend_settings)['varnish'])
+
+    def test_http_backends_share_connections_per_location(self):
+        varnish = HTTPBackend({'LOCATION': 'http://localhost:8000'})
+        varnish_again = HTTPBackend({'LOCATION': 'http://localhost:8000/', 'TAGS_HEADER': 'xkey'})
+        other_varnish = HTTPBackend({'LOCATION': 'http://localhost:8001'})
+
+        self.assertIs(varnish.session, varnish_again.session)
+        self.assertIsNot(varnish.session, other_varnish.session)
+
+    @mock.patch('tuiuiu.contrib.frontendcache.backends.requests.Session.request')
+    def test_http_purge_batch(self, request):
+        request.return_value.status_code = 200
+
+        backend = HTTPBackend({'LOCATION': 'http://localhost:8000', 'CONCURRENCY': 4})
+        urls = ['http://www.tuiuiu.io/%d/' % i for i in range(10)]
+        backend.purge_batch(urls)
+
+        self.assertEqual(
+            sorted(call[0][1] for call in request.call_args_list),
+            sorted('http://localhost:8000/%d/' % i for i in range(10))
+        )
+        for call in request.call_args_list:
+            self.assertEqual(call[0][0], 'PURGE')
+            self.assertEqual(call[1]['headers'], {'Host': 'www.tuiuiu.io'})
+
+    @mock.patch('tuiuiu.contrib.frontendcache.backends.requests.Session.request')
+    def test_http_purge_batch_connection_error(self, request):
+        def purge(method, url, **kwargs):
+            if url.endswith('/2/'):
+                raise requests.exceptions.ConnectionError("Connection refused")
+            return mock.Mock(status_code=200)
+        request.side_effect = purge
+
+        backend = HTTPBackend({'LOCATION': 'http://localhost:8000', 'CONCURRENCY': 2})
+
+        with self.assertRaises(PurgeError) as cm:
+            backend.purge_batch(['http://www.tuiuiu.io/%d/' % i for i in range(4)])
+
+        self.assertEqual(cm.exception.urls, ['http://www.tuiuiu.io/2/'])
 
     def test_multiple(self):
         backends = get_backends(backend_settings={
@@ -128,6 +244,7 @@ class TestBackendConfiguration(TestCase):
 
 
 PURGED_URLS = []
+PURGE_BATCHES = []
 
 
 class MockBackend(BaseBackend):
@@ -138,6 +255,32 @@ class MockBackend(BaseBackend):
         PURGED_URLS.append(url)
 
 
+class MockBatchBackend(BaseBackend):
+    # Fails to purge URLs containing 'unreachable' the first time around
+    failed_urls = set()
+
+    def __init__(self, config):
+        pass
+
+    def purge_batch(self, urls):
+        PURGE_BATCHES.append(urls)
+
+        failed_urls = [url for url in urls if 'unreachable' in url and url not in self.failed_urls]
+        if failed_urls:
+            self.failed_urls.update(failed_urls)
+            raise PurgeError("Cache unreachable", failed_urls)
+
+
+PURGED_TAGS = []
+
+
+class MockTagBackend(MockBackend):
+    supports_tags = True
+
+    def purge_tags(self, tags):
+        PURGED_TAGS.extend(tags)
+
+
 @override_settings(FRONTENDCACHE={
     'varnish': {
         'BACKEND': 'tuiuiu.contrib.frontendcache.tests.MockBackend',
@@ -166,3 +309,207 @@ class TestCachePurging(TestCase):
         root.add_child(instance=page)
         page.save_revision().publish()
         self.assertEqual(PURGED_URLS, [])
+
+
+@override_settings(
+    FRONTENDCACHE={
+        'varnish': {
+            'BACKEND': 'tuiuiu.contrib.frontendcache.tests.MockBatchBackend',
+        },
+    },
+    FRONTENDCACHE_QUEUE={
+        'WORKERS': 0,
+        'RETRY_DELAY': 0,
+    },
+)
+class TestPurgeQueue(TestCase):
+
+    fixtures = ['test.json']
+
+    def setUp(self):
+        PURGE_BATCHES[:] = []
+        MockBatchBackend.failed_urls = set()
+
+        self.on_commit_callbacks = []
+        patcher = mock.patch('tuiuiu.utils.transaction.on_commit', self.on_commit_callbacks.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def commit(self):
+        for callback in self.on_commit_callbacks:
+            callback()
+        self.on_commit_callbacks[:] = []
+
+    def test_purges_are_deferred_and_deduplicated(self):
+        events_page = EventIndex.objects.get(url_path='/home/events/')
+        christmas_page = Page.objects.get(url_path='/home/events/christmas/').specific
+
+        events_page.save_revision().publish()
+        christmas_page.save_revision().publish()
+        events_page.save_revision().publish()
+
+        # Nothing is purged until the transaction is committed
+        self.assertEqual(PURGE_BATCHES, [])
+
+        self.commit()
+        self.assertEqual(PURGE_BATCHES, [['http://localhost/events/', 'http://localhost/events/christmas/']])
+
+    def test_one_purge_scheduled_per_transaction(self):
+        get_purge_queue().add_urls(['http://localhost/events/'])
+        get_purge_queue().add_tags(['tuiuiucore.page-all'])
+
+        self.assertEqual(len(self.on_commit_callbacks), 1)
+
+    def test_failed_urls_are_retried(self):
+        get_purge_queue().add_urls(['http://localhost/events/', 'http://unreachable/events/'])
+        self.commit()
+
+        self.assertEqual(PURGE_BATCHES, [
+            ['http://localhost/events/', 'http://unreachable/events/'],
+            ['http://unreachable/events/'],
+        ])
+
+
+@override_settings(
+    FRONTENDCACHE={
+        'varnish': {
+            'BACKEND': 'tuiuiu.contrib.frontendcache.tests.MockBatchBackend',
+        },
+    },
+    FRONTENDCACHE_QUEUE={
+        'WORKERS': 0,
+    },
+)
+class TestPurgeQueueRollback(TransactionTestCase):
+    def setUp(self):
+        PURGE_BATCHES[:] = []
+        MockBatchBackend.failed_urls = set()
+
+    def test_rolled_back_purges_are_discarded(self):
+        try:
+            with transaction.atomic():
+                get_purge_queue().add_urls(['http://localhost/events/'])
+                raise RuntimeError("Roll back")
+        except RuntimeError:
+            pass
+
+        with transaction.atomic():
+            get_purge_queue().add_urls(['http://localhost/events/christmas/'])
+
+        self.assertEqual(PURGE_BATCHES, [['http://localhost/events/christmas/']])
+
+
+def with_cache_tag_middleware():
+    middleware_setting = 'MIDDLEWARE' if hasattr(settings, 'MIDDLEWARE') else 'MIDDLEWARE_CLASSES'
+    middleware = list(getattr(settings, middleware_setting)) + [
+        'tuiuiu.contrib.frontendcache.middleware.CacheTagMiddleware'
+    ]
+    return override_settings(**{middleware_setting: middleware})
+
+
+@with_cache_tag_middleware()
+@override_settings(FRONTENDCACHE={
+    'varnish': {
+        'BACKEND': 'tuiuiu.contrib.frontendcache.tests.MockTagBackend',
+    },
+})
+class TestCacheTags(TestCase):
+
+    fixtures = ['test.json']
+
+    def setUp(self):
+        PURGED_URLS[:] = []
+        PURGED_TAGS[:] = []
+        self.events_page = EventIndex.objects.get(url_path='/home/events/')
+        self.christmas_page = Page.objects.get(url_path='/home/events/christmas/').specific
+
+    def test_response_is_tagged(self):
+        response = self.client.get('/events/')
+        tags = response['Cache-Tag'].split(',')
+
+        self.assertIn('tuiuiucore.page-%d' % self.events_page.id, tags)
+        self.assertIn('tuiuiucore.page-%d-children' % self.events_page.id, tags)
+        self.assertIn('tuiuiucore.page-%d' % self.christmas_page.id, tags)
+        self.assertEqual(response['Surrogate-Key'].split(' '), tags)
+
+    @override_settings(FRONTENDCACHE_MAX_TAGS_PER_MODEL=2)
+    def test_tags_are_collapsed(self):
+        response = self.client.get('/events/')
+
+        self.assertEqual(response['Cache-Tag'], 'tuiuiucore.page-all')
+
+    def test_purge_tags_on_publish(self):
+        self.christmas_page.save_revision().publish()
+
+        self.assertEqual(PURGED_URLS, ['http://localhost/events/christmas/'])
+        self.assertEqual(PURGED_TAGS, [
+            'tuiuiucore.page-%d' % self.christmas_page.id,
+            'tuiuiucore.page-%d-children' % self.events_page.id,
+            'tuiuiucore.page-1-descendants',
+            'tuiuiucore.page-2-descendants',
+            'tuiuiucore.page-%d-descendants' % self.events_page.id,
+            'tuiuiucore.page-all',
+        ])
+
+    def test_purge_tags_on_image_save(self):
+        image = Image.objects.create(title="Test image", file=get_test_image_file())
+
+        self.assertEqual(PURGED_TAGS, ['tuiuiuimages.image-%d' % image.id, 'tuiuiuimages.image-all'])
+
+    @override_settings(FRONTENDCACHE={
+        'varnish': {
+            'BACKEND': 'tuiuiu.contrib.frontendcache.tests.MockBackend',
+        },
+    })
+    def test_purge_tags_by_url(self):
+        # Backends that can't purge by tag purge the URLs tagged with them instead
+        self.client.get('/events/')
+        self.client.get('/events/christmas/')
+        PURGED_URLS[:] = []
+
+        purge_tags_from_cache(['tuiuiucore.page-%d' % self.christmas_page.id])
+
+        self.assertEqual(PURGED_URLS, ['http://testserver/events/', 'http://testserver/events/christmas/'])
+
+
+class TestTagIndex(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_urls_recorded_once(self):
+        add_url_to_tag_index('http://localhost/events/', ['tuiuiucore.page-1', 'tuiuiucore.page-2'])
+        add_url_to_tag_index('http://localhost/', ['tuiuiucore.page-1'])
+        add_url_to_tag_index('http://localhost/events/', ['tuiuiucore.page-1'])
+
+        self.assertEqual(
+            get_urls_for_tags(['tuiuiucore.page-1']), ['http://localhost/events/', 'http://localhost/'])
+        self.assertEqual(get_urls_for_tags(['tuiuiucore.page-2']), ['http://localhost/events/'])
+
+    def test_concurrent_responses_dont_overwrite_each_other(self):
+        # Both responses look the tag up before either records its URL
+        real_get_many = cache.get_many
+
+        def get_many(keys):
+            result = real_get_many(keys)
+            if not getattr(get_many, 'nested', False):
+                get_many.nested = True
+                add_url_to_tag_index('http://localhost/other/', ['tuiuiucore.page-1'])
+            return result
+
+        with mock.patch.object(cache, 'get_many', get_many):
+            add_url_to_tag_index('http://localhost/events/', ['tuiuiucore.page-1'])
+
+        self.assertEqual(
+            sorted(get_urls_for_tags(['tuiuiucore.page-1'])), ['http://localhost/events/', 'http://localhost/other/'])
+
+    def test_overflow_recorded_under_catch_all_tag(self):
+        for i in range(3):
+            add_url_to_tag_index('http://localhost/%d/' % i, ['tuiuiucore.page-1'], max_urls=2)
+
+        self.assertEqual(get_urls_for_tags(['tuiuiucore.page-1']), ['http://localhost/0/', 'http://localhost/1/'])
+        self.assertEqual(get_urls_for_tags(['tuiuiucore.page-all']), ['http://localhost/2/'])
+
+        # Purging a tag also purges its catch-all tag
+        self.assertEqual(
+            get_urls_for_tags(expand_cache_tags(['tuiuiucore.page-1'])),
+            ['http://localhost/0/', 'http://localhost/1/', 'http://localhost/2/'])
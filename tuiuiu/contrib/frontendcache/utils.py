@@ -1,11 +1,19 @@
 from __future__ import absolute_import, unicode_literals
 
+import copy
+import hashlib
 import logging
+import threading
+import time
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.module_loading import import_string
 
+from tuiuiu.contrib.frontendcache.backends import PurgeError
+from tuiuiu.tuiuiucore.cache_tags import get_cache_tag, get_object_cache_tag
+
 logger = logging.getLogger('tuiuiu.frontendcache')
 
 
@@ -13,6 +21,10 @@ class InvalidFrontendCacheBackendError(ImproperlyConfigured):
     pass
 
 
+_backends_cache = {}
+_backends_cache_lock = threading.Lock()
+
+
 def get_backends(backend_settings=None, backends=None):
     # Get backend settings from FRONTENDCACHE setting
     if backend_settings is None:
@@ -40,34 +52,244 @@ def get_backends(backend_settings=None, backends=None):
         if backends is not None and backend_name not in backends:
             continue
 
-        backend_config = _backend_config.copy()
-        backend = backend_config.pop('BACKEND')
+        backend_objects[backend_name] = get_backend(_backend_config)
 
-        # Try to import the backend
-        try:
-            backend_cls = import_string(backend)
-        except ImportError as e:
-            raise InvalidFrontendCacheBackendError("Could not find backend '%s': %s" % (
-                backend, e))
+    return backend_objects
 
-        backend_objects[backend_name] = backend_cls(backend_config)
 
-    return backend_objects
+def get_backend(backend_config):
+    """
+    Return the backend object for the given configuration, reusing the one
+    created last time it was asked for (so that backends can keep connections
+    and other state between purges).
+    """
+    cache_key = repr(sorted(backend_config.items()))
 
+    with _backends_cache_lock:
+        cached = _backends_cache.get(cache_key)
+        if cached is not None and cached[0] == backend_config:
+            return cached[1]
 
-def purge_url_from_cache(url, backend_settings=None, backends=None):
-    for backend_name, backend in get_backends(backend_settings=backend_settings, backends=backends).items():
-        logger.info("[%s] Purging URL: %s", backend_name, url)
-        backend.purge(url)
+    original_config = copy.deepcopy(backend_config)
+    backend_config = backend_config.copy()
+    backend = backend_config.pop('BACKEND')
 
+    # Try to import the backend
+    try:
+        backend_cls = import_string(backend)
+    except ImportError as e:
+        raise InvalidFrontendCacheBackendError("Could not find backend '%s': %s" % (
+            backend, e))
 
-def purge_page_from_cache(page, backend_settings=None, backends=None):
+    backend_object = backend_cls(backend_config)
+
+    with _backends_cache_lock:
+        _backends_cache[cache_key] = (original_config, backend_object)
+
+    return backend_object
+
+
+def get_page_cached_urls(page):
+    """
+    Return the URLs to purge from the frontend cache for the given page
+    """
     page_url = page.full_url
     if page_url is None:  # nothing to be done if the page has no routable URL
+        return []
+
+    return [page_url + path[1:] for path in page.specific.get_cached_paths()]
+
+
+def timed_purge(backend_name, purge, items):
+    """
+    Call `purge` (a backend's purge_batch or purge_tags method) with `items`,
+    logging how long the batch took
+    """
+    start_time = time.time()
+    try:
+        purge(items)
+    finally:
+        logger.info(
+            "[%s] Purged a batch of %d items in %.1fms",
+            backend_name, len(items), (time.time() - start_time) * 1000)
+
+
+def purge_urls_from_cache(urls, backend_settings=None, backends=None):
+    """
+    Purge a list of URLs from each backend, in as few requests as the backend
+    allows.
+    """
+    if not urls:
+        return
+
+    for backend_name, backend in get_backends(backend_settings=backend_settings, backends=backends).items():
+        for url in urls:
+            logger.info("[%s] Purging URL: %s", backend_name, url)
+
+        try:
+            timed_purge(backend_name, backend.purge_batch, urls)
+        except PurgeError as e:
+            logger.error("[%s] Couldn't purge URLs: %s (%s)", backend_name, ', '.join(e.urls), e)
+
+
+def purge_url_from_cache(url, backend_settings=None, backends=None):
+    purge_urls_from_cache([url], backend_settings=backend_settings, backends=backends)
+
+
+def purge_page_from_cache(page, backend_settings=None, backends=None):
+    purge_urls_from_cache(get_page_cached_urls(page), backend_settings=backend_settings, backends=backends)
+
+
+CACHE_TAG_MIDDLEWARE = 'tuiuiu.contrib.frontendcache.middleware.CacheTagMiddleware'
+
+
+def cache_tags_enabled():
+    """
+    Return True if responses are tagged with the objects they depend on, and
+    so should be purged by tag when those change
+    """
+    middleware = getattr(settings, 'MIDDLEWARE', None)
+    if middleware is None:
+        middleware = getattr(settings, 'MIDDLEWARE_CLASSES', [])
+
+    return CACHE_TAG_MIDDLEWARE in middleware
+
+
+def get_catch_all_cache_tag(tag):
+    """
+    Return the tag that responses depending on too many objects of the same
+    model as `tag` are given instead of their individual tags
+    """
+    return tag.split('-', 1)[0] + '-all'
+
+
+def get_page_cache_tags(page):
+    """
+    Return the tags to purge when the given page is published or unpublished:
+    those of the responses that show the page, that list the children of its
+    parent, and that list the descendants of any of its ancestors.
+    """
+    tags = [get_object_cache_tag(page)]
+
+    # Ordered by path, so the parent comes last
+    ancestor_ids = list(page.get_ancestors().values_list('pk', flat=True))
+    if ancestor_ids:
+        tags.append(get_cache_tag(type(page), ancestor_ids[-1], 'children'))
+        tags.extend(get_cache_tag(type(page), pk, 'descendants') for pk in ancestor_ids)
+
+    return tags
+
+
+TAG_INDEX_CACHE_KEY_PREFIX = 'frontendcache-tag-'
+
+
+def get_tag_index_cache_key(tag, *parts):
+    return TAG_INDEX_CACHE_KEY_PREFIX + ':'.join((tag, ) + parts)
+
+
+def get_url_hash(url):
+    return hashlib.md5(url.encode('utf-8')).hexdigest()
+
+
+def add_url_to_tag_index(url, tags, max_urls=1000):
+    """
+    Record that the response for `url` has the given cache tags, for backends
+    that can only purge by URL.
+
+    Each tag has up to `max_urls` numbered slots, and each URL is given a slot
+    by atomically incrementing the tag's counter, so that responses recorded
+    at the same time can't overwrite each other. Once a tag's slots are used
+    up, its URLs are recorded under the model's catch-all tag instead, which
+    is purged along with it.
+    """
+    url_hash = get_url_hash(url)
+    recorded_keys = dict((get_tag_index_cache_key(tag, 'url', url_hash), tag) for tag in tags)
+
+    # Most responses have been recorded before, which only takes this one lookup
+    recorded = cache.get_many(recorded_keys.keys())
+
+    for recorded_key, tag in recorded_keys.items():
+        if recorded_key not in recorded:
+            add_url_to_tag(url, url_hash, tag, max_urls)
+
+
+def add_url_to_tag(url, url_hash, tag, max_urls):
+    # Only the first response to get here records the URL
+    if not cache.add(get_tag_index_cache_key(tag, 'url', url_hash), True, None):
+        return
+
+    count_key = get_tag_index_cache_key(tag, 'count')
+    cache.add(count_key, 0, None)
+    try:
+        slot = cache.incr(count_key)
+    except ValueError:
+        # The counter was evicted in the meantime
+        cache.add(count_key, 0, None)
+        slot = cache.incr(count_key)
+
+    if slot <= max_urls:
+        cache.set(get_tag_index_cache_key(tag, 'slot', str(slot)), url, None)
+        return
+
+    catch_all_tag = get_catch_all_cache_tag(tag)
+    if catch_all_tag != tag:
+        add_url_to_tag(url, url_hash, catch_all_tag, max_urls)
+    elif slot == max_urls + 1:
+        logger.warning(
+            "More than %d URLs have the cache tag %s, so the rest won't be purged by backends "
+            "that can't purge by tag", max_urls, tag)
+
+
+def get_urls_for_tags(tags):
+    """
+    Return the URLs of the responses recorded as having any of the given tags
+    """
+    counts = cache.get_many([get_tag_index_cache_key(tag, 'count') for tag in tags])
+
+    slot_keys = []
+    for tag in tags:
+        count = counts.get(get_tag_index_cache_key(tag, 'count'), 0)
+        slot_keys.extend(get_tag_index_cache_key(tag, 'slot', str(slot)) for slot in range(1, count + 1))
+
+    slot_urls = cache.get_many(slot_keys)
+
+    urls = []
+    seen_urls = set()
+    for slot_key in slot_keys:
+        url = slot_urls.get(slot_key)
+        if url is not None and url not in seen_urls:
+            urls.append(url)
+            seen_urls.add(url)
+
+    return urls
+
+
+def expand_cache_tags(tags):
+    """
+    Add the catch-all tags that responses depending on any of `tags` may have
+    been given instead
+    """
+    expanded_tags = []
+    for tag in list(tags) + [get_catch_all_cache_tag(tag) for tag in tags]:
+        if tag not in expanded_tags:
+            expanded_tags.append(tag)
+
+    return expanded_tags
+
+
+def purge_tags_from_cache(tags, backend_settings=None, backends=None):
+    """
+    Purge the responses with any of the given cache tags from each backend
+    """
+    if not tags:
         return
 
+    tags = expand_cache_tags(tags)
+
     for backend_name, backend in get_backends(backend_settings=backend_settings, backends=backends).items():
-        # Purge cached paths from cache
-        for path in page.specific.get_cached_paths():
-            logger.info("[%s] Purging URL: %s", backend_name, page_url + path[1:])
-            backend.purge(page_url + path[1:])
+        logger.info("[%s] Purging tags: %s", backend_name, ', '.join(tags))
+
+        try:
+            timed_purge(backend_name, backend.purge_tags, tags)
+        except PurgeError as e:
+            logger.error("[%s] Couldn't purge tags: %s (%s)", backend_name, ', '.join(e.urls), e)
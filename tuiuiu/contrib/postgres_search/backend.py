@@ -6,13 +6,15 @@ from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
 from django.db import DEFAULT_DB_ALIAS, NotSupportedError, connections, transaction
 from django.db.models import F, Manager, TextField, Value
 from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import RawSQL
 from django.db.models.functions import Cast
 from django.utils.encoding import force_text, python_2_unicode_compatible
 from django.utils.six import string_types
 
 from tuiuiu.tuiuiusearch.backends.base import (
     BaseSearchBackend, BaseSearchQuery, BaseSearchResults)
-from tuiuiu.tuiuiusearch.index import RelatedFields, SearchField
+from tuiuiu.tuiuiusearch.index import RelatedFields, SearchField, get_indexed_models
+from tuiuiu.tuiuiusearch.utils import bump_search_results_version
 
 from .models import IndexEntry
 from .utils import (
@@ -22,6 +24,9 @@ from .utils import (
 
 # TODO: Add autocomplete.
 
+# Each search result row carries the total number of matches under this name
+TOTAL_COUNT_ATTNAME = '_total_count_'
+
 
 def get_db_alias(queryset):
     return queryset._db or DEFAULT_DB_ALIAS
@@ -48,6 +53,7 @@ class Index(object):
                 'to use PostgreSQL search.')
         self.db_alias = db_alias
         self.name = model._meta.label
+        self.table = IndexEntry._meta.db_table
         self.search_fields = self.model.get_search_fields()
 
     def add_model(self, model):
@@ -128,7 +134,7 @@ class Index(object):
                 (VALUES %s)
                 ON CONFLICT (content_type_id, object_id)
                 DO UPDATE SET body_search = EXCLUDED.body_search
-                """ % (IndexEntry._meta.db_table, data_sql), data_params)
+                """ % (self.table, data_sql), data_params)
 
     def add_items_update_then_create(self, content_type_pk, objs, config):
         ids_and_objs = {}
@@ -162,6 +168,7 @@ class Index(object):
     def add_items(self, model, objs):
         content_type_pk = get_content_types_pks((model,), self.db_alias)[0]
         config = self.get_config()
+        model.prefetch_indexed_related_objects(objs)
         for obj in objs:
             obj._object_id = force_text(obj.pk)
             obj._body_ = self.prepare_body(obj)
@@ -255,12 +262,12 @@ class PostgresSearchQuery(BaseSearchQuery):
         model_sql, model_params = get_sql(queryset)
         model = queryset.model
         sql = """
-            SELECT obj.*
+            SELECT obj.*, COUNT(*) OVER () AS %s
             FROM (%s) AS index_entry
             INNER JOIN (%s) AS obj ON obj."%s" = index_entry.typed_pk
             ORDER BY index_entry.rank DESC
             OFFSET %%s LIMIT %%s;
-            """ % (index_sql, model_sql, get_pk_column(model))
+            """ % (TOTAL_COUNT_ATTNAME, index_sql, model_sql, get_pk_column(model))
         limits = (start, None if stop is None else stop - start)
         return model._default_manager.using(get_db_alias(queryset)).raw(
             sql, index_params + model_params + limits)
@@ -268,7 +275,8 @@ class PostgresSearchQuery(BaseSearchQuery):
     def search_in_fields(self, queryset, search_query, start, stop):
         return (self.get_in_fields_queryset(queryset, search_query)
                 .annotate(_rank_=SearchRank(F('_search_'), search_query,
-                                            weights=WEIGHTS_VALUES))
+                                            weights=WEIGHTS_VALUES),
+                          **{TOTAL_COUNT_ATTNAME: RawSQL('COUNT(*) OVER ()', ())})
                 .order_by('-_rank_'))[start:stop]
 
     def search(self, config, start, stop):
@@ -288,8 +296,15 @@ class PostgresSearchResult(BaseSearchResults):
             queryset.model, queryset._db).get_config()
 
     def _do_search(self):
-        return list(self.query.search(self.get_config(),
-                                      self.start, self.stop))
+        results = list(self.query.search(self.get_config(),
+                                         self.start, self.stop))
+
+        # Searches return the total number of matches along with each row,
+        # which saves counting them separately to paginate the results
+        if results and hasattr(results[0], TOTAL_COUNT_ATTNAME):
+            self._set_total_count(getattr(results[0], TOTAL_COUNT_ATTNAME))
+
+        return results
 
     def _do_count(self):
         return self.query.search_count(self.get_config())
@@ -308,6 +323,10 @@ class PostgresSearchRebuilder:
 
 
 class PostgresSearchAtomicRebuilder(PostgresSearchRebuilder):
+    # All the objects are added in one transaction, so update_index can't
+    # share them out between processes or resume an interrupted rebuild
+    single_transaction = True
+
     def __init__(self, index):
         super(PostgresSearchAtomicRebuilder, self).__init__(index)
         self.transaction = transaction.atomic(using=index.db_alias)
@@ -329,18 +348,176 @@ class PostgresSearchAtomicRebuilder(PostgresSearchRebuilder):
             self.finish()
 
 
+class ShadowTable(object):
+    """
+    A copy of the index entry table that a shadow rebuild fills while searches
+    keep using the live table. It is created with the live table's columns and
+    its primary key and unique constraints only; its other indexes (such as
+    the GIN index on the search vectors) and foreign keys are built once all
+    of the objects have been added, which is much faster than keeping them up
+    to date row by row. The tables are then swapped in one transaction.
+    """
+    def __init__(self, backend, db_alias):
+        self.backend = backend
+        self.db_alias = db_alias
+        self.connection = connections[db_alias]
+        self.live_name = IndexEntry._meta.db_table
+        self.name = self.live_name + '_rebuild'
+        self.deferred_sql = []
+        self.renames = []
+
+        # The indexes of every indexed model have to be rebuilt before the
+        # tables can be swapped
+        self.pending = {backend.get_index_for_model(model, db_alias).name
+                        for model in get_indexed_models()}
+
+    def quote(self, name):
+        return self.connection.ops.quote_name(name)
+
+    def create(self):
+        pk_column = IndexEntry._meta.pk.column
+
+        with self.connection.cursor() as cursor:
+            # Any staging table left behind by a rebuild that failed
+            cursor.execute('DROP TABLE IF EXISTS %s' % self.quote(self.name))
+            cursor.execute('CREATE TABLE %s (LIKE %s)' % (self.quote(self.name), self.quote(self.live_name)))
+
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [self.live_name, pk_column])
+            live_sequence = cursor.fetchone()[0]
+            sequence = self.name + '_' + pk_column + '_seq'
+            cursor.execute('CREATE SEQUENCE %s OWNED BY %s.%s' % (
+                self.quote(sequence), self.quote(self.name), self.quote(pk_column)))
+            cursor.execute('ALTER TABLE %s ALTER COLUMN %s SET DEFAULT nextval(%%s::regclass)' % (
+                self.quote(self.name), self.quote(pk_column)), [sequence])
+            if live_sequence:
+                self.renames.append(('SEQUENCE', sequence, live_sequence.split('.')[-1].strip('"')))
+
+            # Recreate the constraints and indexes of the live table under
+            # temporary names, and give them their names back after the swap
+            cursor.execute("""
+                SELECT conname, contype, pg_get_constraintdef(oid)
+                FROM pg_constraint
+                WHERE conrelid = %s::regclass
+                ORDER BY conname
+                """, [self.live_name])
+            for i, (name, constraint_type, definition) in enumerate(cursor.fetchall()):
+                new_name = '%s_c%d' % (self.name, i)
+                sql = 'ALTER TABLE %s ADD CONSTRAINT %s %s' % (
+                    self.quote(self.name), self.quote(new_name), definition)
+                if constraint_type in ('p', 'u'):
+                    # Needed by the upserts that fill the table
+                    cursor.execute(sql)
+                else:
+                    self.deferred_sql.append(sql)
+                self.renames.append(('CONSTRAINT', new_name, name))
+
+            cursor.execute("""
+                SELECT index_class.relname, pg_get_indexdef(index_class.oid)
+                FROM pg_index
+                JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+                WHERE pg_index.indrelid = %s::regclass
+                AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = pg_index.indexrelid)
+                ORDER BY index_class.relname
+                """, [self.live_name])
+            for i, (name, definition) in enumerate(cursor.fetchall()):
+                new_name = '%s_i%d' % (self.name, i)
+                self.deferred_sql.append('CREATE %sINDEX %s ON %s USING %s' % (
+                    'UNIQUE ' if definition.startswith('CREATE UNIQUE ') else '',
+                    self.quote(new_name), self.quote(self.name), definition.split(' USING ', 1)[1]))
+                self.renames.append(('INDEX', new_name, name))
+
+    def swap(self):
+        with self.connection.cursor() as cursor:
+            for sql in self.deferred_sql:
+                cursor.execute(sql)
+            cursor.execute('ANALYZE %s' % self.quote(self.name))
+
+            with transaction.atomic(using=self.db_alias):
+                cursor.execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % self.quote(self.live_name))
+                cursor.execute('DROP TABLE %s' % self.quote(self.live_name))
+                cursor.execute('ALTER TABLE %s RENAME TO %s' % (self.quote(self.name), self.quote(self.live_name)))
+
+                for object_type, name, live_name in self.renames:
+                    if object_type == 'CONSTRAINT':
+                        cursor.execute('ALTER TABLE %s RENAME CONSTRAINT %s TO %s' % (
+                            self.quote(self.live_name), self.quote(name), self.quote(live_name)))
+                    else:
+                        cursor.execute('ALTER %s %s RENAME TO %s' % (
+                            object_type, self.quote(name), self.quote(live_name)))
+
+        for model in get_indexed_models():
+            bump_search_results_version(model)
+
+    def finish_index(self, index):
+        """
+        Record that all of the objects of `index` have been added, and swap
+        the tables once that is true of every index
+        """
+        self.pending.discard(index.name)
+        if not self.pending:
+            self.swap()
+            return True
+
+        return False
+
+
+class ShadowIndex(Index):
+    """
+    An Index that adds objects to the staging table of a shadow rebuild
+    instead of the live table
+    """
+    def __init__(self, index, shadow_table):
+        super(ShadowIndex, self).__init__(index.backend, index.model, index.db_alias)
+        self.table = shadow_table.name
+
+    def delete_stale_entries(self):
+        pass  # The staging table only has the objects added to it.
+
+
+class PostgresSearchShadowRebuilder(PostgresSearchRebuilder):
+    # The staging table is shared by the rebuilds of all indexed models and
+    # only swapped in once they have all finished, so update_index can't
+    # share them out between processes or resume an interrupted rebuild
+    single_transaction = True
+
+    def start(self):
+        connection = connections[self.index.db_alias]
+        if connection.pg_version < 90500:
+            raise NotSupportedError(
+                'Shadow rebuilds require PostgreSQL 9.5 or later.')
+
+        shadow_tables = self.index.backend.shadow_tables
+        self.shadow_table = shadow_tables.get(self.index.db_alias)
+        if self.shadow_table is None:
+            self.shadow_table = ShadowTable(self.index.backend, self.index.db_alias)
+            self.shadow_table.create()
+            shadow_tables[self.index.db_alias] = self.shadow_table
+
+        return ShadowIndex(self.index, self.shadow_table)
+
+    def finish(self):
+        if self.shadow_table.finish_index(self.index):
+            del self.index.backend.shadow_tables[self.index.db_alias]
+
+
 class PostgresSearchBackend(BaseSearchBackend):
     query_class = PostgresSearchQuery
     results_class = PostgresSearchResult
     rebuilder_class = PostgresSearchRebuilder
     atomic_rebuilder_class = PostgresSearchAtomicRebuilder
+    shadow_rebuilder_class = PostgresSearchShadowRebuilder
 
     def __init__(self, params):
         super(PostgresSearchBackend, self).__init__(params)
         self.params = params
-        if params.get('ATOMIC_REBUILD', False):
+        if params.get('SHADOW_REBUILD', False):
+            self.rebuilder_class = self.shadow_rebuilder_class
+        elif params.get('ATOMIC_REBUILD', False):
             self.rebuilder_class = self.atomic_rebuilder_class
 
+        # The staging tables of the shadow rebuilds in progress, by database alias
+        self.shadow_tables = {}
+
     def get_index_for_model(self, model, db_alias=None):
         return Index(self, model, db_alias)
 
@@ -367,5 +544,8 @@ class PostgresSearchBackend(BaseSearchBackend):
     def delete(self, obj):
         IndexEntry._default_manager.for_object(obj).delete()
 
+    def delete_stale_entries(self, model):
+        self.get_index_for_model(model).delete_stale_entries()
+
 
 SearchBackend = PostgresSearchBackend
@@ -1,8 +1,10 @@
 # coding: utf-8
 from __future__ import absolute_import, unicode_literals
 
+from django.conf import settings
 from django.core.management import call_command
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
 from django.utils.six import StringIO
 
 from tuiuiu.tests.search.models import SearchTest
@@ -44,6 +46,40 @@ class TestPostgresSearchBackend(BackendTests, TestCase):
         self.assertSetEqual(set(results), {self.testa,
                                            self.testd.searchtest_ptr})
 
+    def test_update_index_command_with_shadow_rebuild(self):
+        # The app is only installed when testing against PostgreSQL
+        from ..models import IndexEntry
+
+        backends = {name: dict(params, SHADOW_REBUILD=True)
+                    for name, params in settings.TUIUIUSEARCH_BACKENDS.items()}
+        table = IndexEntry._meta.db_table
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [table])
+            index_names = {row[0] for row in cursor.fetchall()}
+
+        self.backend.reset_index()
+
+        with override_settings(TUIUIUSEARCH_BACKENDS=backends):
+            with self.ignore_deprecation_warnings():
+                call_command('update_index', backend_name=self.backend_name,
+                             interactive=False, stdout=StringIO())
+
+        results = self.backend.search('hello', SearchTest)
+        self.assertSetEqual(set(results), {self.testa, self.testb,
+                                           self.testc.searchtest_ptr})
+
+        # The live table was replaced by the staging table, which has the
+        # same indexes under the same names
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [table])
+            self.assertSetEqual({row[0] for row in cursor.fetchall()}, index_names)
+            cursor.execute('SELECT to_regclass(%s)', [table + '_rebuild'])
+            self.assertIsNone(cursor.fetchone()[0])
+
+        # New entries are still numbered by the table's sequence
+        self.backend.add(SearchTest.objects.create(title='New entry'))
+
     def test_weights(self):
         self.assertListEqual(BOOSTS_WEIGHTS,
                              [(10, 'A'), (2, 'B'), (0, 'C'), (0, 'D')])
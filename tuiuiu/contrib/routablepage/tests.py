@@ -1,7 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 
 from django.core.urlresolvers import NoReverseMatch
-from django.test import RequestFactory, TestCase
+from django.test import RequestFactory, TestCase, override_settings
 
 from tuiuiu.contrib.routablepage.templatetags.routablepage_tags import \
     routablepageurl
@@ -143,6 +143,11 @@ class TestRoutablePage(TestCase):
             del RoutablePageTest.descriptor
 
 
+@override_settings(TUIUIU_ROUTE_BY_URL_PATH=True)
+class TestRoutablePageWithURLPathRouting(TestRoutablePage):
+    pass
+
+
 class TestRoutablePageTemplateTag(TestCase):
     def setUp(self):
         self.home_page = Page.objects.get(id=2)
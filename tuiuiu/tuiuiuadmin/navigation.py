@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 
 from tuiuiu.tuiuiucore.models import Page
+from tuiuiu.tuiuiucore.page_permissions import get_page_permission_index
 
 
 def get_pages_with_direct_explore_permission(user):
@@ -9,10 +10,14 @@ def get_pages_with_direct_explore_permission(user):
         # superuser has implicit permission on the root node
         return Page.objects.filter(depth=1)
     else:
-        return Page.objects.filter(
-            group_permissions__group__in=user.groups.all(),
-            group_permissions__permission_type__in=['add', 'edit', 'publish', 'lock']
-        )
+        # Pages within a section the user already has the same permission on
+        # are left out, as they don't change the explorable root page
+        permission_index = get_page_permission_index(user)
+        paths = set()
+        for permission_type in ['add', 'edit', 'publish', 'lock']:
+            paths.update(permission_index.get_paths(permission_type))
+
+        return Page.objects.filter(path__in=paths)
 
 
 def get_explorable_root_page(user):
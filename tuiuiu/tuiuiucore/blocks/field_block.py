@@ -13,6 +13,7 @@ from django.utils.functional import cached_property
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
+from tuiuiu.tuiuiucore.cache_tags import record_cache_tag
 from tuiuiu.tuiuiucore.rich_text import RichText
 from tuiuiu.tuiuiucore.utils import resolve_model_string
 
@@ -540,6 +541,7 @@ class ChooserBlock(FieldBlock):
         if value is None:
             return value
         else:
+            record_cache_tag(self.target_model, value)
             try:
                 return self.target_model.objects.get(pk=value)
             except self.target_model.DoesNotExist:
@@ -550,6 +552,10 @@ class ChooserBlock(FieldBlock):
 
         The instances must be returned in the same order as the values and keep None values.
         """
+        for value in values:
+            if value is not None:
+                record_cache_tag(self.target_model, value)
+
         objects = self.target_model.objects.in_bulk(values)
         return [objects.get(id) for id in values]  # Keeps the ordering the same as in values.
 
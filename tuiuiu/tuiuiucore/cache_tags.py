@@ -0,0 +1,91 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+from contextlib import contextmanager
+
+
+def get_cache_tag(model, pk, relation=None):
+    """
+    Return the tag identifying responses that depend on the object of the given
+    model and primary key, e.g. 'tuiuiucore.page-42'. Objects of models using
+    multi-table inheritance are tagged with their base model, so that a page is
+    tagged the same way whether or not it was fetched as its specific type.
+
+    `relation` may be 'children' or 'descendants', for responses that depend on
+    the set of pages below a page (such as listings and sitemaps).
+    """
+    parents = model._meta.get_parent_list()
+    if parents:
+        model = list(parents)[-1]
+
+    tag = '%s-%s' % (model._meta.label_lower, pk)
+    if relation:
+        tag += '-' + relation
+
+    return tag
+
+
+def get_object_cache_tag(obj, relation=None):
+    return get_cache_tag(type(obj), obj.pk, relation)
+
+
+class CacheTagTracker(object):
+    """
+    Collects the tags of the objects used to build a response
+    """
+    def __init__(self):
+        self.tags = set()
+
+    def add(self, tag):
+        self.tags.add(tag)
+
+
+_cache_tag_trackers = threading.local()
+
+
+def get_cache_tag_tracker():
+    """
+    Return the CacheTagTracker that is active in the current thread, or None
+    """
+    return getattr(_cache_tag_trackers, 'active', None)
+
+
+def activate_cache_tag_tracker():
+    """
+    Start a new CacheTagTracker in the current thread, replacing any previous one
+    """
+    _cache_tag_trackers.active = CacheTagTracker()
+    return _cache_tag_trackers.active
+
+
+def deactivate_cache_tag_tracker():
+    _cache_tag_trackers.active = None
+
+
+@contextmanager
+def cache_tag_tracker():
+    """
+    Track the cache tags of the objects used within the block
+    """
+    tracker = activate_cache_tag_tracker()
+    try:
+        yield tracker
+    finally:
+        deactivate_cache_tag_tracker()
+
+
+def record_cache_tag(model, pk, relation=None):
+    """
+    Record that the response being built depends on the given object
+    """
+    tracker = get_cache_tag_tracker()
+    if tracker is not None:
+        tracker.add(get_cache_tag(model, pk, relation))
+
+
+def record_object_cache_tags(objs, relation=None):
+    tracker = get_cache_tag_tracker()
+    if tracker is not None:
+        for obj in objs:
+            if obj is not None:
+                tracker.add(get_object_cache_tag(obj, relation))
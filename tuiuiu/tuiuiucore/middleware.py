@@ -2,6 +2,7 @@ from __future__ import absolute_import, unicode_literals
 
 import django
 from tuiuiu.tuiuiucore.models import Site
+from tuiuiu.tuiuiucore.query import activate_page_identity_map, deactivate_page_identity_map
 
 
 if django.VERSION >= (1, 10):
@@ -20,3 +21,17 @@ class SiteMiddleware(MiddlewareMixin):
             request.site = Site.find_for_request(request)
         except Site.DoesNotExist:
             request.site = None
+
+
+class PageIdentityMapMiddleware(MiddlewareMixin):
+    """
+    Activate a PageIdentityMap for each request, so that repeated accesses to
+    page.specific for the same page (e.g. in menus and templates) are served
+    from memory for the rest of the request
+    """
+    def process_request(self, request):
+        activate_page_identity_map()
+
+    def process_response(self, request, response):
+        deactivate_page_identity_map()
+        return response
@@ -33,12 +33,15 @@ from treebeard.mp_tree import MP_Node
 
 from tuiuiu.utils.compat import user_is_authenticated
 from tuiuiu.utils.deprecation import RemovedInTuiuiu113Warning
-from tuiuiu.tuiuiucore.query import PageQuerySet, TreeQuerySet
+from tuiuiu.tuiuiucore.cache_tags import record_cache_tag
+from tuiuiu.tuiuiucore.page_permissions import bump_page_permissions_version, get_page_permission_index
+from tuiuiu.tuiuiucore.query import PageQuerySet, TreeQuerySet, get_page_identity_map, get_specific_pages
 from tuiuiu.tuiuiucore.signals import page_published, page_unpublished
-from tuiuiu.tuiuiucore.sites import get_site_for_hostname
-from tuiuiu.tuiuiucore.url_routing import RouteResult
+from tuiuiu.tuiuiucore.sites import get_site_for_hostname, get_site_routing_table
+from tuiuiu.tuiuiucore.url_routing import RouteResult, bump_page_routing_version
 from tuiuiu.tuiuiucore.utils import (
     TUIUIU_APPEND_SLASH, accepts_kwarg, camelcase_to_underscore, resolve_model_string)
+from tuiuiu.tuiuiucore.view_restrictions import bump_page_view_restrictions_version
 from tuiuiu.tuiuiusearch import index
 
 logger = logging.getLogger('tuiuiu.core')
@@ -115,6 +118,9 @@ class Site(models.Model):
 
         NB this means that high-numbered ports on an extant hostname may
         still be routed to a different hostname which is set as the default
+
+        Sites are matched against an in-memory routing table, which is rebuilt
+        whenever a Site is saved or deleted.
         """
 
         try:
@@ -127,7 +133,11 @@ class Site(models.Model):
         except (AttributeError, KeyError):
             port = request.META.get('SERVER_PORT')
 
-        return get_site_for_hostname(hostname, port)
+        routing_table = get_site_routing_table()
+        if routing_table is None:
+            return get_site_for_hostname(hostname, port)
+
+        return routing_table.get_site_for_hostname(hostname, port)
 
     @property
     def root_url(self):
@@ -199,6 +209,24 @@ class BasePageManager(models.Manager):
     def get_queryset(self):
         return PageQuerySet(self.model).order_by('path')
 
+    def specific_for(self, pages):
+        """
+        Return a list of the specific instances of the given pages, in the same
+        order, using one query per page type (and none for pages that are
+        already specific, or already held by the active PageIdentityMap).
+
+        The results are also cached on the given pages, so accessing
+        ``page.specific`` on them afterwards does not query the database.
+        """
+        pages = list(pages)
+        pages_to_fetch = [page for page in pages if 'specific' not in page.__dict__ and not page._is_specific()]
+        specific_pages = get_specific_pages([(page.pk, page.content_type_id) for page in pages_to_fetch])
+
+        for page in pages_to_fetch:
+            page.specific = specific_pages.get((page.content_type_id, page.pk), page)
+
+        return [page.specific for page in pages]
+
 
 PageManager = BasePageManager.from_queryset(PageQuerySet)
 
@@ -359,6 +387,8 @@ class Page(six.with_metaclass(PageBase, AbstractPage, index.Indexed, Clusterable
         index.FilterField('latest_revision_created_at'),
     ]
 
+    search_timestamp_fields = ['latest_revision_created_at', 'last_published_at']
+
     # Do not allow plain Page instances to be created through the Tuiuiu admin
     is_creatable = False
 
@@ -479,6 +509,7 @@ class Page(six.with_metaclass(PageBase, AbstractPage, index.Indexed, Clusterable
 
         if update_descendant_url_paths:
             self._update_descendant_url_paths(old_url_path, new_url_path)
+            bump_page_routing_version()
 
         # Check if this is a root page of any sites and clear the 'tuiuiu_site_root_paths' key if so
         if Site.objects.filter(root_page=self).exists():
@@ -614,22 +645,40 @@ class Page(six.with_metaclass(PageBase, AbstractPage, index.Indexed, Clusterable
         """
         Return this page in its most specific subclassed form.
         """
+        if self._is_specific():
+            return self
+
+        # Reuse the instance fetched earlier in this request, if there is one
+        identity_map = get_page_identity_map()
+        if identity_map is not None:
+            specific_page = identity_map.get(self.content_type_id, self.id)
+            if specific_page is not None:
+                return specific_page
+
+        content_type = ContentType.objects.get_for_id(self.content_type_id)
+        specific_page = content_type.get_object_for_this_type(id=self.id)
+
+        if identity_map is not None:
+            identity_map.add(specific_page)
+
+        return specific_page
+
+    def _is_specific(self):
+        """
+        Return True if this page is already in its most specific form (or its most
+        specific class can't be found), so that page.specific would return itself
+        """
         # the ContentType.objects manager keeps a cache, so this should potentially
         # avoid a database lookup over doing self.content_type. I think.
         content_type = ContentType.objects.get_for_id(self.content_type_id)
         model_class = content_type.model_class()
-        if model_class is None:
-            # Cannot locate a model class for this content type. This might happen
-            # if the codebase and database are out of sync (e.g. the model exists
-            # on a different git branch and we haven't rolled back migrations before
-            # switching branches); if so, the best we can do is return the page
-            # unchanged.
-            return self
-        elif isinstance(self, model_class):
-            # self is already the an instance of the most specific class
-            return self
-        else:
-            return content_type.get_object_for_this_type(id=self.id)
+
+        # If model_class is None, we cannot locate a model class for this content
+        # type. This might happen if the codebase and database are out of sync (e.g.
+        # the model exists on a different git branch and we haven't rolled back
+        # migrations before switching branches); if so, the best we can do is
+        # return the page unchanged.
+        return model_class is None or isinstance(self, model_class)
 
     #: Return the class that this page would be if instantiated in its
     #: most specific form
@@ -785,6 +834,9 @@ class Page(six.with_metaclass(PageBase, AbstractPage, index.Indexed, Clusterable
         Backwards-compatibility method to safely call get_url_parts without
         the new ``request`` kwarg (added in Tuiuiu 1.11), if needed.
         """
+        # Responses linking to this page depend on its URL
+        record_cache_tag(Page, self.pk)
+
         # RemovedInTuiuiu113Warning - this accepts_kwarg test can be removed when we drop support
         # for get_url_parts methods which omit the `request` kwarg
         if accepts_kwarg(self.get_url_parts, 'request'):
@@ -1068,6 +1120,9 @@ class Page(six.with_metaclass(PageBase, AbstractPage, index.Indexed, Clusterable
         new_url_path = new_self.set_url_path(new_self.get_parent())
         new_self.save()
         new_self._update_descendant_url_paths(old_url_path, new_url_path)
+        bump_page_routing_version()
+        bump_page_view_restrictions_version()
+        bump_page_permissions_version()
 
         # Log
         logger.info("Page moved: \"%s\" id=%d path=%s", self.title, self.id, new_url_path)
@@ -1377,6 +1432,10 @@ class Page(six.with_metaclass(PageBase, AbstractPage, index.Indexed, Clusterable
             for path in child.specific.get_static_site_paths():
                 yield '/' + child.slug + path
 
+    def get_children(self):
+        record_cache_tag(Page, self.pk, 'children')
+        return super(Page, self).get_children()
+
     def get_ancestors(self, inclusive=False):
         return Page.objects.ancestor_of(self, inclusive)
 
@@ -1614,6 +1673,11 @@ class UserPagePermissionsProxy(object):
         if user.is_active and not user.is_superuser:
             self.permissions = GroupPagePermission.objects.filter(group__user=self.user).select_related('page')
 
+    @cached_property
+    def permission_index(self):
+        """The PagePermissionIndex shared by every permission check for this user"""
+        return get_page_permission_index(self.user)
+
     def revisions_for_moderation(self):
         """Return a queryset of page revisions awaiting moderation that this user has publish permission on"""
 
@@ -1623,18 +1687,13 @@ class UserPagePermissionsProxy(object):
         if self.user.is_superuser:
             return PageRevision.submitted_revisions.all()
 
-        # get the list of pages for which they have direct publish permission
-        # (i.e. they can publish any page within this subtree)
-        publishable_pages = [perm.page for perm in self.permissions if perm.permission_type == 'publish']
-        if not publishable_pages:
+        # return only those pages whose paths start with the path of one of the pages
+        # they have direct publish permission on (i.e. they can publish any page within
+        # this subtree)
+        only_my_sections = self.permission_index.get_q('publish', path_lookup='page__path')
+        if only_my_sections is None:
             return PageRevision.objects.none()
 
-        # compile a filter expression to apply to the PageRevision.submitted_revisions manager:
-        # return only those pages whose paths start with one of the publishable_pages paths
-        only_my_sections = Q(page__path__startswith=publishable_pages[0].path)
-        for page in publishable_pages[1:]:
-            only_my_sections = only_my_sections | Q(page__path__startswith=page.path)
-
         # return the filtered queryset
         return PageRevision.submitted_revisions.filter(only_my_sections)
 
@@ -1651,19 +1710,20 @@ class UserPagePermissionsProxy(object):
         if self.user.is_superuser:
             return Page.objects.all()
 
-        editable_pages = Page.objects.none()
+        # user has edit permission on any page within the sections they have 'add'
+        # permission on that is owned by them, and on any page within the sections
+        # they have 'edit' permission on regardless of owner
+        editable_q = self.permission_index.get_q('edit')
 
-        for perm in self.permissions.filter(permission_type='add'):
-            # user has edit permission on any subpage of perm.page
-            # (including perm.page itself) that is owned by them
-            editable_pages |= Page.objects.descendant_of(perm.page, inclusive=True).filter(owner=self.user)
+        add_q = self.permission_index.get_q('add')
+        if add_q is not None:
+            add_q &= Q(owner=self.user)
+            editable_q = add_q if editable_q is None else editable_q | add_q
 
-        for perm in self.permissions.filter(permission_type='edit'):
-            # user has edit permission on any subpage of perm.page
-            # (including perm.page itself) regardless of owner
-            editable_pages |= Page.objects.descendant_of(perm.page, inclusive=True)
+        if editable_q is None:
+            return Page.objects.none()
 
-        return editable_pages
+        return Page.objects.filter(editable_q)
 
     def can_edit_pages(self):
         """Return True if the user has permission to edit any pages"""
@@ -1677,14 +1737,13 @@ class UserPagePermissionsProxy(object):
         if self.user.is_superuser:
             return Page.objects.all()
 
-        publishable_pages = Page.objects.none()
-
-        for perm in self.permissions.filter(permission_type='publish'):
-            # user has publish permission on any subpage of perm.page
-            # (including perm.page itself)
-            publishable_pages |= Page.objects.descendant_of(perm.page, inclusive=True)
+        # user has publish permission on any page within the sections they have
+        # 'publish' permission on
+        publish_q = self.permission_index.get_q('publish')
+        if publish_q is None:
+            return Page.objects.none()
 
-        return publishable_pages
+        return Page.objects.filter(publish_q)
 
     def can_publish_pages(self):
         """Return True if the user has permission to publish any pages"""
@@ -1699,10 +1758,7 @@ class PagePermissionTester(object):
         self.page_is_root = page.depth == 1  # Equivalent to page.is_root()
 
         if self.user.is_active and not self.user.is_superuser:
-            self.permissions = set(
-                perm.permission_type for perm in user_perms.permissions
-                if self.page.path.startswith(perm.page.path)
-            )
+            self.permissions = user_perms.permission_index.get_permission_types(self.page.path)
 
     def can_add_subpage(self):
         if not self.user.is_active:
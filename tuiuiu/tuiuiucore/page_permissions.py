@@ -0,0 +1,128 @@
+from __future__ import absolute_import, unicode_literals
+
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db.models import Q
+
+from tuiuiu.tuiuiucore.utils import bump_cache_version_on_commit, get_cache_version
+
+
+PAGE_PERMISSIONS_VERSION_CACHE_KEY = 'tuiuiu_page_permissions_version'
+
+
+def bump_page_permissions_version():
+    """
+    Invalidate the page permission indexes of every user once the current
+    transaction is committed. An index rebuilt before then would still see
+    the old permissions, and be kept under the new version.
+    """
+    bump_cache_version_on_commit(PAGE_PERMISSIONS_VERSION_CACHE_KEY)
+
+
+class PagePermissionIndex(object):
+    """
+    The page permissions that a user has through their groups, as a sorted
+    list of page paths for each permission type. A user with a permission on
+    a page has it on all of the page's descendants too, so a path that is
+    already covered by a shorter one in the same list is left out; the only
+    path that can be a prefix of a given page's path is then the one just
+    before it in the list.
+    """
+    def __init__(self, permissions, version=None):
+        self.version = version
+        self.paths = {}
+
+        paths_by_type = defaultdict(set)
+        for permission_type, path in permissions:
+            paths_by_type[permission_type].add(path)
+
+        for permission_type, paths in paths_by_type.items():
+            self.paths[permission_type] = []
+
+            for path in sorted(paths):
+                if not self.paths[permission_type] or not path.startswith(self.paths[permission_type][-1]):
+                    self.paths[permission_type].append(path)
+
+    @classmethod
+    def build(cls, user, version=None):
+        GroupPagePermission = apps.get_model('tuiuiucore.GroupPagePermission')
+
+        permissions = GroupPagePermission.objects.filter(group__user=user).values_list('permission_type', 'page__path')
+        return cls(permissions, version=version)
+
+    def get_paths(self, permission_type):
+        """
+        Return the paths of the top-most pages that the user has the given
+        permission on
+        """
+        return self.paths.get(permission_type, [])
+
+    def has_permission(self, permission_type, path):
+        """
+        Return True if the user has the given permission on the page at `path`
+        """
+        paths = self.get_paths(permission_type)
+        index = bisect_right(paths, path)
+
+        return index > 0 and path.startswith(paths[index - 1])
+
+    def get_permission_types(self, path):
+        """
+        Return the set of permission types that the user has on the page at `path`
+        """
+        return set(
+            permission_type for permission_type in self.paths
+            if self.has_permission(permission_type, path)
+        )
+
+    def get_q(self, permission_type, path_lookup='path'):
+        """
+        Return a Q object matching the pages (or, with a `path_lookup` such
+        as 'page__path', the objects related to pages) that the user has the
+        given permission on, or None if there aren't any
+        """
+        q = None
+
+        for path in self.get_paths(permission_type):
+            path_q = Q(**{path_lookup + '__startswith': path})
+            q = path_q if q is None else q | path_q
+
+        return q
+
+
+def get_page_permission_index(user):
+    """
+    Return the PagePermissionIndex for an active, non-superuser user.
+
+    The index is kept in the cache until groups or page permissions change or
+    a page is moved, and on the user object for the rest of the request, so
+    that every permission check made while handling the request shares it.
+    """
+    version = get_cache_version(PAGE_PERMISSIONS_VERSION_CACHE_KEY)
+
+    index = getattr(user, '_tuiuiu_page_permission_index', None)
+    if index is not None and version is not None and index.version == version:
+        return index
+
+    if version is None:
+        # The cache can't hold the version stamp (such as the dummy cache)
+        index = PagePermissionIndex.build(user)
+    else:
+        cache_key = 'tuiuiu_page_permission_index:%s:%s' % (version, user.pk)
+        permissions = cache.get(cache_key)
+
+        if permissions is None:
+            index = PagePermissionIndex.build(user, version=version)
+            cache.set(cache_key, [
+                (permission_type, path)
+                for permission_type, paths in index.paths.items()
+                for path in paths
+            ])
+        else:
+            index = PagePermissionIndex(permissions, version=version)
+
+    user._tuiuiu_page_permission_index = index
+    return index
@@ -1,7 +1,9 @@
 from __future__ import absolute_import, unicode_literals
 
 import posixpath
+import threading
 from collections import defaultdict
+from contextlib import contextmanager
 
 from django import VERSION as DJANGO_VERSION
 from django.apps import apps
@@ -10,6 +12,7 @@ from django.db.models import CharField, Q
 from django.db.models.functions import Length, Substr
 from treebeard.mp_tree import MP_NodeQuerySet
 
+from tuiuiu.tuiuiucore.cache_tags import record_cache_tag
 from tuiuiu.tuiuiusearch.queryset import SearchableQuerySetMixin
 
 
@@ -31,6 +34,7 @@ class TreeQuerySet(MP_NodeQuerySet):
 
         If inclusive is set to True, it will also contain the page itself (instead of just its descendants).
         """
+        record_cache_tag(type(other), other.pk, 'descendants')
         return self.filter(self.descendant_of_q(other, inclusive))
 
     def not_descendant_of(self, other, inclusive=False):
@@ -48,6 +52,7 @@ class TreeQuerySet(MP_NodeQuerySet):
         """
         This filters the QuerySet to only contain pages that are direct children of the specified page.
         """
+        record_cache_tag(type(other), other.pk, 'children')
         return self.filter(self.child_of_q(other))
 
     def not_child_of(self, other):
@@ -213,11 +218,16 @@ class PageQuerySet(SearchableQuerySetMixin, TreeQuerySet):
         return self.exclude(self.exact_type_q(model))
 
     def public_q(self):
-        from tuiuiu.tuiuiucore.models import PageViewRestriction
+        from tuiuiu.tuiuiucore.view_restrictions import get_restricted_path_ranges
 
+        # Restricted pages and their descendants, as ranges of paths that can
+        # be looked up on the path index
         q = Q()
-        for restriction in PageViewRestriction.objects.all():
-            q &= ~self.descendant_of_q(restriction.page, inclusive=True)
+        for lower, upper in get_restricted_path_ranges():
+            if upper is None:
+                q &= ~Q(path__gte=lower)
+            else:
+                q &= ~(Q(path__gte=lower) & Q(path__lt=upper))
         return q
 
     def public(self):
@@ -357,32 +367,119 @@ class PageQuerySet(SearchableQuerySetMixin, TreeQuerySet):
         return self.descendant_of(site.root_page, inclusive=True)
 
 
-def specific_iterator(qs):
+class PageIdentityMap(object):
     """
-    This efficiently iterates all the specific pages in a queryset, using
-    the minimum number of queries.
+    Holds the specific instances of pages that have been fetched while the map
+    is active, keyed by content type and page id, so that accessing
+    ``Page.specific`` for the same page again returns the same instance without
+    querying the database.
+    """
+    def __init__(self):
+        self.pages = {}
 
-    This should be called from ``PageQuerySet.specific``
+    def get(self, content_type_id, pk):
+        return self.pages.get((content_type_id, pk))
+
+    def add(self, page):
+        self.pages[(page.content_type_id, page.pk)] = page
+
+    def clear(self):
+        self.pages.clear()
+
+
+_page_identity_maps = threading.local()
+
+
+def get_page_identity_map():
     """
-    pks_and_types = qs.values_list('pk', 'content_type')
+    Return the PageIdentityMap that is active in the current thread, or None
+    """
+    return getattr(_page_identity_maps, 'active', None)
+
+
+def activate_page_identity_map():
+    """
+    Start a new PageIdentityMap in the current thread, replacing any previous one
+    """
+    _page_identity_maps.active = PageIdentityMap()
+    return _page_identity_maps.active
+
+
+def deactivate_page_identity_map():
+    _page_identity_maps.active = None
+
+
+@contextmanager
+def page_identity_map():
+    """
+    Activate a PageIdentityMap for the duration of the block. If a map is
+    already active (e.g. one started by PageIdentityMapMiddleware) it is
+    reused rather than replaced.
+    """
+    identity_map = get_page_identity_map()
+    if identity_map is not None:
+        yield identity_map
+        return
+
+    identity_map = activate_page_identity_map()
+    try:
+        yield identity_map
+    finally:
+        deactivate_page_identity_map()
+
+
+def get_specific_pages(pks_and_types):
+    """
+    Fetch the specific instances of the given (pk, content type id) pairs, with
+    one query per page type. Returns a dict keyed by (content type id, pk).
+
+    Pages that are already held by the active PageIdentityMap are not fetched
+    again, and newly fetched pages are added to it.
+    """
+    identity_map = get_page_identity_map()
+    specific_pages = {}
     pks_by_type = defaultdict(list)
+
     for pk, content_type in pks_and_types:
-        pks_by_type[content_type].append(pk)
+        if identity_map is not None:
+            page = identity_map.get(content_type, pk)
+            if page is not None:
+                specific_pages[(content_type, pk)] = page
+                continue
 
-    # Content types are cached by ID, so this will not run any queries.
-    content_types = {pk: ContentType.objects.get_for_id(pk)
-                     for _, pk in pks_and_types}
+        pks_by_type[content_type].append(pk)
 
     # Get the specific instances of all pages, one model class at a time.
-    pages_by_type = {}
+    # Content types are cached by ID, so this will not run any queries.
     for content_type, pks in pks_by_type.items():
-        model = content_types[content_type].model_class()
-        pages = model.objects.filter(pk__in=pks)
-        pages_by_type[content_type] = {page.pk: page for page in pages}
+        model = ContentType.objects.get_for_id(content_type).model_class()
+        if model is None:
+            # The page type no longer exists in the codebase, so the best we
+            # can do is return plain pages (as Page.specific does)
+            model = apps.get_model('tuiuiucore.Page')
+
+        for page in model.objects.filter(pk__in=pks):
+            specific_pages[(content_type, page.pk)] = page
+
+            if identity_map is not None:
+                identity_map.add(page)
+
+    return specific_pages
+
+
+def specific_iterator(qs):
+    """
+    This efficiently iterates all the specific pages in a queryset, using
+    the minimum number of queries.
+
+    This should be called from ``PageQuerySet.specific``
+    """
+    pks_and_types = qs.values_list('pk', 'content_type')
+    specific_pages = get_specific_pages(pks_and_types)
 
     # Yield all of the pages, in the order they occurred in the original query.
     for pk, content_type in pks_and_types:
-        yield pages_by_type[content_type][pk]
+        yield specific_pages[(content_type, pk)]
 
 
 # Django 1.9 changed how extending QuerySets with different iterators behaved
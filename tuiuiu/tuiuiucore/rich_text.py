@@ -1,13 +1,22 @@
 from __future__ import absolute_import, unicode_literals
 
+import hashlib
 import re  # parsing HTML with regexes LIKE A BOSS.
+import threading
 
+from django.conf import settings
+from django.core.cache import caches
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
+from django.utils.six import text_type
 
 from tuiuiu.tuiuiucore import hooks
+from tuiuiu.tuiuiucore.cache_tags import get_cache_tag, get_cache_tag_tracker
 from tuiuiu.tuiuiucore.models import Page
+from tuiuiu.tuiuiucore.sites import SITE_ROUTING_VERSION_CACHE_KEY
+from tuiuiu.tuiuiucore.url_routing import PAGE_ROUTING_VERSION_CACHE_KEY
+from tuiuiu.tuiuiucore.utils import get_cache_versions
 from tuiuiu.tuiuiucore.whitelist import Whitelister
 
 
@@ -25,6 +34,9 @@ class PageLinkHandler(object):
     representation will be:
     <a linktype="page" id="42">hello world</a>
     """
+    # Page URLs change whenever the page or site routing does
+    cache_version_keys = [PAGE_ROUTING_VERSION_CACHE_KEY, SITE_ROUTING_VERSION_CACHE_KEY]
+
     @staticmethod
     def get_db_attributes(tag):
         """
@@ -34,22 +46,48 @@ class PageLinkHandler(object):
         """
         return {'id': tag['data-id']}
 
+    @staticmethod
+    def get_cache_tags(attrs):
+        return [get_cache_tag(Page, attrs['id'])]
+
     @staticmethod
     def expand_db_attributes(attrs, for_editor):
-        try:
-            page = Page.objects.get(id=attrs['id'])
+        return PageLinkHandler.expand_db_attributes_many([attrs], for_editor)[0]
+
+    @staticmethod
+    def expand_db_attributes_many(attrs_list, for_editor):
+        """
+        Expand the attributes of many <a linktype="page"> elements at once, with
+        one query for the pages (plus one per page type) and, for the editor,
+        one for their parents.
+        """
+        pages = {
+            text_type(page.pk): page
+            for page in Page.objects.filter(id__in=set(attrs['id'] for attrs in attrs_list)).specific()
+        }
+
+        if for_editor:
+            parent_paths = set(page.path[:-page.steplen] for page in pages.values() if page.depth > 1)
+            parent_ids = dict(Page.objects.filter(path__in=parent_paths).values_list('path', 'id'))
+
+        results = []
+        for attrs in attrs_list:
+            page = pages.get(text_type(attrs['id']))
+            if page is None:
+                results.append("<a>")
+                continue
 
             if for_editor:
                 editor_attrs = 'data-linktype="page" data-id="%d" ' % page.id
-                parent_page = page.get_parent()
-                if parent_page:
-                    editor_attrs += 'data-parent-id="%d" ' % parent_page.id
+                parent_id = parent_ids.get(page.path[:-page.steplen])
+                if parent_id:
+                    editor_attrs += 'data-parent-id="%d" ' % parent_id
             else:
                 editor_attrs = ''
 
-            return '<a %shref="%s">' % (editor_attrs, escape(page.specific.url))
-        except Page.DoesNotExist:
-            return "<a>"
+            results.append('<a %shref="%s">' % (editor_attrs, escape(page.url)))
+
+        return results
 
 
 EMBED_HANDLERS = {}
@@ -159,26 +197,187 @@ def extract_attrs(attr_string):
     return attributes
 
 
-def expand_db_html(html, for_editor=False):
+_expansion_caches = threading.local()
+
+
+def activate_expansion_cache(**kwargs):
     """
-    Expand database-representation HTML into proper HTML usable in either
-    templates or the rich text editor
+    Start memoising the expansions of rich text links and embeds in this
+    thread. Connected to request_started, so that the memo lasts for the
+    duration of a request.
+    """
+    _expansion_caches.active = {}
+
+
+def deactivate_expansion_cache(**kwargs):
+    _expansion_caches.active = None
+
+
+def clear_expansion_cache(**kwargs):
+    """
+    Forget the expansions memoised so far in this thread, as the objects they
+    refer to may have changed. Connected to post_save and post_delete.
+    """
+    if get_expansion_cache() is not None:
+        _expansion_caches.active = {}
+
+
+def get_expansion_cache():
+    return getattr(_expansion_caches, 'active', None)
+
+
+def expand_db_tags(html, tag_re, type_attr, get_handler, for_editor):
     """
-    def replace_a_tag(m):
+    Replace every element matched by tag_re that has a type_attr attribute with
+    its expansion, as returned by the handler for its type. The elements of each
+    type are expanded together, by the handler's expand_db_attributes_many method
+    if it has one, and the results are memoised for the rest of the request.
+    """
+    cache = get_expansion_cache()
+    if cache is None:
+        cache = {}
+
+    # First pass: find the elements that need expanding, grouped by type
+    attrs_by_type = {}
+    for m in tag_re.finditer(html):
         attrs = extract_attrs(m.group(1))
-        if 'linktype' not in attrs:
+        if type_attr not in attrs:
+            continue
+
+        key = (type_attr, for_editor, tuple(sorted(attrs.items())))
+        if key not in cache:
+            attrs_by_type.setdefault(attrs[type_attr], {})[key] = attrs
+
+    for tag_type, attrs_by_key in attrs_by_type.items():
+        handler = get_handler(tag_type)
+        keys = list(attrs_by_key.keys())
+        attrs_list = [attrs_by_key[key] for key in keys]
+
+        if hasattr(handler, 'expand_db_attributes_many'):
+            results = handler.expand_db_attributes_many(attrs_list, for_editor)
+        else:
+            results = [handler.expand_db_attributes(attrs, for_editor) for attrs in attrs_list]
+
+        cache.update(zip(keys, results))
+
+    # Second pass: replace them
+    def replace_tag(m):
+        attrs = extract_attrs(m.group(1))
+        if type_attr not in attrs:
             # return unchanged
             return m.group(0)
-        handler = get_link_handler(attrs['linktype'])
-        return handler.expand_db_attributes(attrs, for_editor)
 
-    def replace_embed_tag(m):
-        attrs = extract_attrs(m.group(1))
-        handler = get_embed_handler(attrs['embedtype'])
-        return handler.expand_db_attributes(attrs, for_editor)
+        return cache[(type_attr, for_editor, tuple(sorted(attrs.items())))]
+
+    return tag_re.sub(replace_tag, html)
+
+
+FIND_TYPE_ATTR = re.compile(r'(?<![\w-])(linktype|embedtype)="([^"]*)"')
+
+
+def get_rich_text_cache():
+    """
+    Return the cache that expanded rich text is stored in, as configured by
+    TUIUIU_RICH_TEXT_CACHE, or None if it isn't cached (the default).
+    """
+    alias = getattr(settings, 'TUIUIU_RICH_TEXT_CACHE', None)
+    if alias is None:
+        return None
+
+    return caches[alias]
+
+
+def get_rich_text_cache_key(html):
+    """
+    Return the cache key for the expansion of `html`. The key changes whenever
+    any of the version stamps that the handlers of its elements declare does:
+    either those listed in the handler's cache_version_keys, or, for stamps that
+    depend on the object an element refers to, those returned by its
+    get_cache_version_keys method. Returns None if the expansion can't be cached.
+    """
+    version_keys = set()
+    for tag_re, type_attr, get_handler in [
+            (FIND_A_TAG, 'linktype', get_link_handler), (FIND_EMBED_TAG, 'embedtype', get_embed_handler)]:
+        for m in tag_re.finditer(html):
+            attrs = extract_attrs(m.group(1))
+            if type_attr not in attrs:
+                continue
+
+            try:
+                handler = get_handler(attrs[type_attr])
+            except KeyError:
+                # Not a type we know about, so let the expansion deal with it
+                return None
+
+            if hasattr(handler, 'get_cache_version_keys'):
+                version_keys.update(handler.get_cache_version_keys(attrs))
+            elif hasattr(handler, 'cache_version_keys'):
+                version_keys.update(handler.cache_version_keys)
+            else:
+                # The handler doesn't say when its output changes
+                return None
+
+    version_keys = sorted(version_keys)
+    versions = get_cache_versions(version_keys)
+    if None in versions:
+        return None
+
+    key = hashlib.sha1(html.encode('utf-8'))
+    for version_key, version in zip(version_keys, versions):
+        key.update(('\n%s=%s' % (version_key, version)).encode('utf-8'))
+
+    return 'tuiuiu-rich-text-' + key.hexdigest()
+
+
+def record_cache_tags(html):
+    """
+    Record the cache tags of the objects that the links and embeds in `html`
+    refer to, as given by the get_cache_tags method of their handlers
+    """
+    tracker = get_cache_tag_tracker()
+
+    for tag_re, type_attr, get_handler in [
+            (FIND_A_TAG, 'linktype', get_link_handler), (FIND_EMBED_TAG, 'embedtype', get_embed_handler)]:
+        for m in tag_re.finditer(html):
+            attrs = extract_attrs(m.group(1))
+            if type_attr not in attrs:
+                continue
+
+            handler = get_handler(attrs[type_attr])
+            if hasattr(handler, 'get_cache_tags'):
+                for tag in handler.get_cache_tags(attrs):
+                    tracker.add(tag)
+
+
+def expand_db_html(html, for_editor=False):
+    """
+    Expand database-representation HTML into proper HTML usable in either
+    templates or the rich text editor
+    """
+    if not FIND_TYPE_ATTR.search(html):
+        # Nothing to expand
+        return html
+
+    if get_cache_tag_tracker() is not None:
+        # Done here rather than by the handlers, which aren't called when the
+        # expansion is cached
+        record_cache_tags(html)
+
+    rich_text_cache = None if for_editor else get_rich_text_cache()
+    cache_key = None
+    if rich_text_cache is not None:
+        cache_key = get_rich_text_cache_key(html)
+        if cache_key is not None:
+            expanded_html = rich_text_cache.get(cache_key)
+            if expanded_html is not None:
+                return expanded_html
+
+    html = expand_db_tags(html, FIND_A_TAG, 'linktype', get_link_handler, for_editor)
+    html = expand_db_tags(html, FIND_EMBED_TAG, 'embedtype', get_embed_handler, for_editor)
+
+    if cache_key is not None:
+        rich_text_cache.set(cache_key, html)
 
-    html = FIND_A_TAG.sub(replace_a_tag, html)
-    html = FIND_EMBED_TAG.sub(replace_embed_tag, html)
     return html
 
 
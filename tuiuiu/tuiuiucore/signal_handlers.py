@@ -2,21 +2,34 @@ from __future__ import absolute_import, unicode_literals
 
 import logging
 
+from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.db.models.signals import post_delete, post_save, pre_delete
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 
-from tuiuiu.tuiuiucore.models import Page, Site
+from tuiuiu.tuiuiucore.models import (
+    GroupPagePermission, Page, PageViewRestriction, Site, get_page_models)
+from tuiuiu.tuiuiucore.page_permissions import bump_page_permissions_version
+from tuiuiu.tuiuiucore.rich_text import (
+    activate_expansion_cache, clear_expansion_cache, deactivate_expansion_cache)
+from tuiuiu.tuiuiucore.signals import page_published, page_unpublished
+from tuiuiu.tuiuiucore.sites import bump_site_routing_version
+from tuiuiu.tuiuiucore.url_routing import bump_page_routing_version
+from tuiuiu.tuiuiucore.view_restrictions import bump_page_view_restrictions_version
 
 logger = logging.getLogger('tuiuiu.core')
 
 
-# Clear the tuiuiu_site_root_paths from the cache whenever Site records are updated.
+# Clear the tuiuiu_site_root_paths from the cache and invalidate the site
+# routing tables whenever Site records are updated.
 def post_save_site_signal_handler(instance, update_fields=None, **kwargs):
     cache.delete('tuiuiu_site_root_paths')
+    bump_site_routing_version()
 
 
 def post_delete_site_signal_handler(instance, **kwargs):
     cache.delete('tuiuiu_site_root_paths')
+    bump_site_routing_version()
 
 
 def pre_delete_page_unpublish(sender, instance, **kwargs):
@@ -30,9 +43,46 @@ def post_delete_page_log_deletion(sender, instance, **kwargs):
     logger.info("Page deleted: \"%s\" id=%d", instance.title, instance.id)
 
 
+# Invalidate the page route caches whenever the set of routable pages changes.
+# (Moves and slug changes are handled in Page.move and Page.save.)
+def page_routing_changed_signal_handler(instance, **kwargs):
+    bump_page_routing_version()
+
+
+# Invalidate the restricted path ranges used by PageQuerySet.public() whenever
+# view restrictions change. (Moves are handled in Page.move.)
+def page_view_restriction_changed_signal_handler(instance, **kwargs):
+    bump_page_view_restrictions_version()
+
+
+# Invalidate the users' page permission indexes whenever page permissions or
+# group memberships change. (Moves are handled in Page.move.)
+def page_permissions_changed_signal_handler(**kwargs):
+    bump_page_permissions_version()
+
+
 def register_signal_handlers():
     post_save.connect(post_save_site_signal_handler, sender=Site)
     post_delete.connect(post_delete_site_signal_handler, sender=Site)
 
     pre_delete.connect(pre_delete_page_unpublish, sender=Page)
     post_delete.connect(post_delete_page_log_deletion, sender=Page)
+
+    page_published.connect(page_routing_changed_signal_handler)
+    page_unpublished.connect(page_routing_changed_signal_handler)
+    post_delete.connect(page_routing_changed_signal_handler, sender=Page)
+
+    post_save.connect(page_view_restriction_changed_signal_handler, sender=PageViewRestriction)
+    post_delete.connect(page_view_restriction_changed_signal_handler, sender=PageViewRestriction)
+
+    post_save.connect(page_permissions_changed_signal_handler, sender=GroupPagePermission)
+    post_delete.connect(page_permissions_changed_signal_handler, sender=GroupPagePermission)
+    m2m_changed.connect(page_permissions_changed_signal_handler, sender=get_user_model().groups.through)
+
+    # Memoise rich text link and embed expansions for the duration of each request.
+    # (The images and documents apps clear the memo when their objects change.)
+    request_started.connect(activate_expansion_cache)
+    request_finished.connect(deactivate_expansion_cache)
+    for model in get_page_models():
+        post_save.connect(clear_expansion_cache, sender=model)
+        post_delete.connect(clear_expansion_cache, sender=model)
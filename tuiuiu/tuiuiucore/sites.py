@@ -1,8 +1,14 @@
 from __future__ import absolute_import, unicode_literals
 
+import copy
+import threading
+from collections import defaultdict
+
 from django.apps import apps
 from django.db.models import Case, IntegerField, Q, When
 
+from tuiuiu.tuiuiucore.utils import bump_cache_version_on_commit, get_cache_version
+
 
 MATCH_HOSTNAME_PORT = 0
 MATCH_HOSTNAME_DEFAULT = 1
@@ -50,3 +56,109 @@ def get_site_for_hostname(hostname, port):
             return sites[len(sites) == 2]
 
     raise Site.DoesNotExist()
+
+
+SITE_ROUTING_VERSION_CACHE_KEY = 'tuiuiu_site_routing_version'
+
+
+def get_site_routing_version():
+    return get_cache_version(SITE_ROUTING_VERSION_CACHE_KEY)
+
+
+def bump_site_routing_version():
+    """
+    Invalidate the site routing tables of every process once the current
+    transaction is committed
+    """
+    bump_cache_version_on_commit(SITE_ROUTING_VERSION_CACHE_KEY)
+
+
+class SiteRoutingTable(object):
+    """
+    An in-memory copy of the Site table that resolves a hostname and port to
+    a Site using the same rules as get_site_for_hostname, without touching the
+    database.
+
+    Sites are stored without their root page; each lookup returns a copy of
+    the stored Site so that the root page (and anything else a request caches
+    on the instance) is never shared between requests.
+    """
+    def __init__(self, sites, version=None):
+        self.version = version
+        self.default_site = None
+        self.sites_by_hostname = defaultdict(list)
+
+        for site in sites:
+            if site.is_default_site:
+                self.default_site = site
+
+            self.sites_by_hostname[site.hostname].append(site)
+
+    @classmethod
+    def build(cls, version=None):
+        Site = apps.get_model('tuiuiucore.Site')
+        return cls(Site.objects.order_by('pk'), version=version)
+
+    def find_site(self, hostname, port):
+        try:
+            port = int(port)
+        except (TypeError, ValueError):
+            port = None
+
+        hostname_sites = self.sites_by_hostname.get(hostname, [])
+
+        for site in hostname_sites:
+            if site.port == port:
+                return site
+
+        if self.default_site is not None and self.default_site.hostname == hostname:
+            return self.default_site
+
+        if self.default_site is not None:
+            # if there is exactly one site for this hostname use it, otherwise fall back to the default
+            if len(hostname_sites) == 1:
+                return hostname_sites[0]
+
+            return self.default_site
+
+        if len(hostname_sites) == 1:
+            return hostname_sites[0]
+
+    def get_site_for_hostname(self, hostname, port):
+        site = self.find_site(hostname, port)
+
+        if site is None:
+            raise apps.get_model('tuiuiucore.Site').DoesNotExist()
+
+        return copy.copy(site)
+
+
+_site_routing_table = None
+_site_routing_table_lock = threading.Lock()
+
+
+def get_site_routing_table():
+    """
+    Return this process's SiteRoutingTable, rebuilding it if the Site table
+    has changed since it was last built.
+
+    Returns None if the cache backend can't hold the version stamp (such as
+    the dummy cache), as there would be no way to invalidate the table, or if
+    this thread has changed sites in a transaction that isn't committed yet.
+    """
+    global _site_routing_table
+
+    version = get_site_routing_version()
+    if version is None:
+        return None
+
+    table = _site_routing_table
+
+    if table is None or table.version != version:
+        with _site_routing_table_lock:
+            table = _site_routing_table
+
+            if table is None or table.version != version:
+                table = _site_routing_table = SiteRoutingTable.build(version=version)
+
+    return table
@@ -3,6 +3,7 @@ from __future__ import absolute_import, unicode_literals
 import datetime
 import json
 
+import mock
 import pytz
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
@@ -23,6 +24,8 @@ from tuiuiu.tests.testapp.models import (
     TaggedPage)
 from tuiuiu.tests.utils import TuiuiuTestUtils
 from tuiuiu.tuiuiucore.models import Page, PageManager, Site, get_page_models
+from tuiuiu.tuiuiucore.sites import get_site_routing_table
+from tuiuiu.tuiuiucore.url_routing import get_page_route_cache, route_by_url_path
 
 
 def get_ct(model):
@@ -110,6 +113,10 @@ class TestSiteRouting(TestCase):
         self.unrecognised_port = '8000'
         self.unrecognised_hostname = 'unknown.site.com'
 
+        # Build the site routing table up front, so that each lookup below
+        # only costs the version stamp check against the (database) cache
+        get_site_routing_table()
+
     def test_no_host_header_routes_to_default_site(self):
         # requests without a Host: header should be directed to the default site
         request = HttpRequest()
@@ -455,6 +462,135 @@ class TestServeView(TestCase):
         self.assertContains(response, 'bad googlebot no cookie')
 
 
+@override_settings(TUIUIU_ROUTE_BY_URL_PATH=True)
+class TestServeViewWithURLPathRouting(TestServeView):
+    pass
+
+
+# Use a local memory cache so that the only queries counted are the ones made by
+# routing, standing in for a cache shared between processes
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+@mock.patch('tuiuiu.tuiuiucore.utils.cache_is_shared', lambda cache: True)
+class TestRouteByURLPath(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        self.site = Site.objects.get(is_default_site=True)
+        self.site.get_site_root_paths()
+
+    def route(self, path_components):
+        request = HttpRequest()
+        request.path = '/' + ''.join(component + '/' for component in path_components)
+        return route_by_url_path(request, self.site, path_components)
+
+    def test_route(self):
+        plans_page = EventPage.objects.get(url_path='/home/secret-plans/steal-underpants/')
+
+        # One query for the whole path, one to fetch the specific page
+        with self.assertNumQueries(2):
+            (found_page, args, kwargs) = self.route(['secret-plans', 'steal-underpants'])
+
+        self.assertEqual(found_page, plans_page)
+        self.assertIsInstance(found_page, EventPage)
+
+    def test_route_to_site_root(self):
+        # The site root is a plain Page, so there is no specific page to fetch
+        with self.assertNumQueries(1):
+            (found_page, args, kwargs) = self.route([])
+
+        self.assertEqual(found_page, self.site.root_page)
+
+    def test_route_through_page_with_route_override(self):
+        # EventIndex overrides route, so routing continues from there
+        (found_page, args, kwargs) = self.route(['events', 'christmas'])
+        self.assertEqual(found_page.url_path, '/home/events/christmas/')
+
+        response = self.route(['events', '1'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_route_to_unknown_page_returns_404(self):
+        with self.assertRaises(Http404):
+            self.route(['events', 'quinquagesima'])
+
+        with self.assertRaises(Http404):
+            self.route(['quinquagesima', 'christmas'])
+
+    def test_route_to_unpublished_page_returns_404(self):
+        with self.assertRaises(Http404):
+            self.route(['events', 'tentative-unpublished-event'])
+
+    def test_route_doesnt_escape_site_root(self):
+        events_page = Page.objects.get(url_path='/home/events/')
+        self.site = Site.objects.create(hostname='events.example.com', root_page=events_page)
+
+        with self.assertRaises(Http404):
+            self.route(['events', 'christmas'])
+
+        (found_page, args, kwargs) = self.route(['christmas'])
+        self.assertEqual(found_page.url_path, '/home/events/christmas/')
+
+    @override_settings(TUIUIU_ROUTE_CACHE_SIZE=10)
+    def test_route_cache(self):
+        plans_page = EventPage.objects.get(url_path='/home/secret-plans/steal-underpants/')
+        self.route(['secret-plans', 'steal-underpants'])
+
+        # Only the specific page is fetched once the path has been resolved
+        with self.assertNumQueries(1):
+            (found_page, args, kwargs) = self.route(['secret-plans', 'steal-underpants'])
+        self.assertEqual(found_page, plans_page)
+        self.assertIsInstance(found_page, EventPage)
+
+        # Cached routes still respect the live flag
+        EventPage.objects.filter(id=plans_page.id).update(live=False)
+        with self.assertRaises(Http404):
+            self.route(['secret-plans', 'steal-underpants'])
+
+    @override_settings(TUIUIU_ROUTE_CACHE_SIZE=10)
+    def test_route_cache_cleared_on_unpublish(self):
+        plans_page = EventPage.objects.get(url_path='/home/secret-plans/steal-underpants/')
+        self.route(['secret-plans', 'steal-underpants'])
+
+        route_cache = get_page_route_cache()
+        cache_key = (self.site.pk, ('secret-plans', 'steal-underpants'))
+        version = route_cache.get_version()
+
+        with mock.patch('tuiuiu.tuiuiucore.utils.on_commit') as on_commit:
+            plans_page.unpublish()
+
+        # The cache is bypassed by this thread until the change is committed,
+        # and only cleared for the others then
+        self.assertIsNone(route_cache.get_version())
+        self.assertIsNotNone(route_cache.get(cache_key, version))
+
+        for call in on_commit.call_args_list:
+            call[0][0]()
+        self.assertIsNone(route_cache.get(cache_key, route_cache.get_version()))
+
+    @override_settings(TUIUIU_ROUTE_CACHE_SIZE=10)
+    def test_route_cache_cleared_on_move(self):
+        plans_page = EventPage.objects.get(url_path='/home/secret-plans/steal-underpants/')
+        self.route(['secret-plans', 'steal-underpants'])
+
+        plans_page.move(Page.objects.get(url_path='/home/about-us/'), pos='last-child')
+
+        with self.assertRaises(Http404):
+            self.route(['secret-plans', 'steal-underpants'])
+        (found_page, args, kwargs) = self.route(['about-us', 'steal-underpants'])
+        self.assertEqual(found_page, plans_page)
+
+    @override_settings(TUIUIU_ROUTE_CACHE_SIZE=2)
+    def test_route_cache_evicts_least_recently_used(self):
+        self.route(['secret-plans'])
+        self.route(['secret-plans', 'steal-underpants'])
+        self.route(['secret-plans'])
+        self.route(['about-us'])
+
+        self.assertEqual(
+            list(get_page_route_cache().entries.keys()),
+            [(self.site.pk, ('secret-plans', )), (self.site.pk, ('about-us', ))]
+        )
+
+
 class TestStaticSitePaths(TestCase):
     def setUp(self):
         self.root_page = Page.objects.get(id=1)
@@ -1,11 +1,13 @@
 from __future__ import absolute_import, unicode_literals
 
+import mock
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 
 from tuiuiu.tests.testapp.models import BusinessSubIndex, EventIndex, EventPage
 from tuiuiu.tuiuiucore.models import GroupPagePermission, Page, UserPagePermissionsProxy
+from tuiuiu.tuiuiucore.page_permissions import PagePermissionIndex
 
 
 class TestPagePermission(TestCase):
@@ -466,3 +468,86 @@ class TestPagePermission(TestCase):
         perms = UserPagePermissionsProxy(user).for_page(christmas_page)
 
         self.assertFalse(perms.can_lock())
+
+    def test_permission_index_shared_by_checks(self):
+        user = get_user_model().objects.get(username='eventeditor')
+        christmas_page = EventPage.objects.get(url_path='/home/events/christmas/')
+        unpublished_event_page = EventPage.objects.get(url_path='/home/events/tentative-unpublished-event/')
+
+        index = UserPagePermissionsProxy(user).permission_index
+
+        self.assertIs(christmas_page.permissions_for_user(user).user_perms.permission_index, index)
+        self.assertIs(unpublished_event_page.permissions_for_user(user).user_perms.permission_index, index)
+
+
+class TestPagePermissionInvalidation(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        # on_commit callbacks are never run inside a TestCase, so collect them instead
+        self.on_commit_callbacks = []
+        on_commit_patcher = mock.patch('tuiuiu.tuiuiucore.utils.on_commit', self.on_commit_callbacks.append)
+        on_commit_patcher.start()
+        self.addCleanup(on_commit_patcher.stop)
+
+        self.christmas_page = EventPage.objects.get(url_path='/home/events/christmas/')
+
+    def commit(self):
+        for callback in self.on_commit_callbacks:
+            callback()
+        self.on_commit_callbacks[:] = []
+
+    def get_permissions(self, username):
+        # A fresh user object, as the index is also kept on the user for the rest of the request
+        user = get_user_model().objects.get(username=username)
+        return self.christmas_page.permissions_for_user(user)
+
+    def test_permissions_change_when_user_joins_group(self):
+        self.assertFalse(self.get_permissions('eventeditor').can_publish())
+
+        user = get_user_model().objects.get(username='eventeditor')
+        user.groups.add(Group.objects.get(name='Event moderators'))
+        self.commit()
+
+        self.assertTrue(self.get_permissions('eventeditor').can_publish())
+
+    def test_permissions_change_when_group_permission_deleted(self):
+        self.assertTrue(self.get_permissions('eventmoderator').can_lock())
+
+        GroupPagePermission.objects.filter(group__user__username='eventmoderator', permission_type='lock').delete()
+
+        # The transaction that deleted it doesn't use the cached indexes, which
+        # other processes keep until the deletion is committed
+        self.assertFalse(self.get_permissions('eventmoderator').can_lock())
+
+        self.commit()
+        self.assertFalse(self.get_permissions('eventmoderator').can_lock())
+
+
+class TestPagePermissionIndex(SimpleTestCase):
+    def setUp(self):
+        self.index = PagePermissionIndex([
+            ('add', '00010001'),
+            ('add', '000100010002'),
+            ('add', '00010003'),
+            ('publish', '000100010002'),
+        ])
+
+    def test_nested_paths_left_out(self):
+        self.assertEqual(self.index.get_paths('add'), ['00010001', '00010003'])
+        self.assertEqual(self.index.get_paths('publish'), ['000100010002'])
+        self.assertEqual(self.index.get_paths('edit'), [])
+
+    def test_has_permission(self):
+        self.assertTrue(self.index.has_permission('add', '00010001'))
+        self.assertTrue(self.index.has_permission('add', '0001000100050001'))
+        self.assertTrue(self.index.has_permission('add', '000100030001'))
+        self.assertFalse(self.index.has_permission('add', '0001'))
+        self.assertFalse(self.index.has_permission('add', '00010002'))
+        self.assertFalse(self.index.has_permission('publish', '000100010001'))
+        self.assertFalse(self.index.has_permission('edit', '00010001'))
+
+    def test_get_permission_types(self):
+        self.assertEqual(self.index.get_permission_types('0001000100020001'), {'add', 'publish'})
+        self.assertEqual(self.index.get_permission_types('000100010001'), {'add'})
+        self.assertEqual(self.index.get_permission_types('0001'), set())
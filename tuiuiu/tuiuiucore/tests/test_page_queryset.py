@@ -1,10 +1,15 @@
 from __future__ import absolute_import, unicode_literals
 
-from django.test import TestCase
+import mock
+from django.test import SimpleTestCase, TestCase, override_settings
 
-from tuiuiu.tests.testapp.models import EventPage, SimplePage, SingleEventPage
+from tuiuiu.tests.testapp.models import EventIndex, EventPage, SimplePage, SingleEventPage
 from tuiuiu.tuiuiucore.models import Page, PageViewRestriction, Site
+from tuiuiu.tuiuiucore.query import page_identity_map
 from tuiuiu.tuiuiucore.signals import page_unpublished
+from tuiuiu.tuiuiucore.utils import get_cache_version
+from tuiuiu.tuiuiucore.view_restrictions import (
+    PAGE_VIEW_RESTRICTIONS_VERSION_CACHE_KEY, get_next_path, get_path_ranges)
 
 
 class TestPageQuerySet(TestCase):
@@ -397,6 +402,106 @@ class TestPageQuerySet(TestCase):
         # Check that the event is in the results
         self.assertTrue(pages.filter(id=event.id).exists())
 
+    def test_public_with_adjacent_restrictions(self):
+        events_index = Page.objects.get(url_path='/home/events/')
+        events = list(events_index.get_children())
+
+        for event in events:
+            PageViewRestriction.objects.create(page=event, password='hello')
+
+        self.assertFalse(Page.objects.public().filter(id__in=[event.id for event in events]).exists())
+        self.assertTrue(Page.objects.public().filter(id=events_index.id).exists())
+
+
+class TestPublicInvalidation(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        # on_commit callbacks are never run inside a TestCase, so collect them instead
+        self.on_commit_callbacks = []
+        on_commit_patcher = mock.patch('tuiuiu.tuiuiucore.utils.on_commit', self.on_commit_callbacks.append)
+        on_commit_patcher.start()
+        self.addCleanup(on_commit_patcher.stop)
+
+    def commit(self):
+        for callback in self.on_commit_callbacks:
+            callback()
+        self.on_commit_callbacks[:] = []
+
+    def test_public_after_restriction_added(self):
+        event = Page.objects.get(url_path='/home/events/christmas/')
+        self.assertTrue(Page.objects.public().filter(id=event.id).exists())
+        version = get_cache_version(PAGE_VIEW_RESTRICTIONS_VERSION_CACHE_KEY)
+
+        PageViewRestriction.objects.create(page=event, password='hello')
+
+        # The transaction that added the restriction applies it straight away
+        self.assertFalse(Page.objects.public().filter(id=event.id).exists())
+
+        # Other processes rebuild their ranges once it is committed
+        self.commit()
+        self.assertNotEqual(get_cache_version(PAGE_VIEW_RESTRICTIONS_VERSION_CACHE_KEY), version)
+
+    def test_public_after_restriction_deleted(self):
+        events_index = Page.objects.get(url_path='/home/events/')
+        event = Page.objects.get(url_path='/home/events/christmas/')
+
+        restriction = PageViewRestriction.objects.create(page=events_index, password='hello')
+        self.commit()
+        self.assertFalse(Page.objects.public().filter(id=event.id).exists())
+
+        restriction.delete()
+        self.commit()
+        self.assertTrue(Page.objects.public().filter(id=event.id).exists())
+
+    def test_public_after_restricted_page_moved(self):
+        homepage = Page.objects.get(url_path='/home/')
+        event = Page.objects.get(url_path='/home/events/christmas/')
+
+        PageViewRestriction.objects.create(page=event, password='hello')
+        self.commit()
+        self.assertFalse(Page.objects.public().filter(id=event.id).exists())
+
+        event.move(homepage, pos='last-child')
+        self.commit()
+        self.assertFalse(Page.objects.public().filter(id=event.id).exists())
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_public_without_shared_cache(self):
+        event = Page.objects.get(url_path='/home/events/christmas/')
+        self.assertTrue(Page.objects.public().filter(id=event.id).exists())
+
+        # Other processes couldn't be told about the restriction, so the
+        # ranges are fetched from the database every time
+        PageViewRestriction.objects.create(page=event, password='hello')
+        self.assertFalse(Page.objects.public().filter(id=event.id).exists())
+
+
+class TestPathRanges(SimpleTestCase):
+    alphabet = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+    def test_get_next_path(self):
+        self.assertEqual(get_next_path('00010002', self.alphabet), '00010003')
+        self.assertEqual(get_next_path('0001000Z', self.alphabet), '0001001')
+        self.assertIsNone(get_next_path('ZZZZ', self.alphabet))
+
+    def test_get_path_ranges(self):
+        self.assertEqual(get_path_ranges([], self.alphabet), [])
+        self.assertEqual(get_path_ranges(['00010002', '000100020003', '00010005'], self.alphabet), [
+            ('00010002', '00010003'),
+            ('00010005', '00010006'),
+        ])
+
+        # Consecutive siblings are merged into one range
+        self.assertEqual(get_path_ranges(['00010003', '00010002', '00010004'], self.alphabet), [
+            ('00010002', '00010005'),
+        ])
+
+        # As are ranges that extend to the end of the tree
+        self.assertEqual(get_path_ranges(['ZZZY', 'ZZZZ'], self.alphabet), [
+            ('ZZZY', None),
+        ])
+
 
 class TestPageQueryInSite(TestCase):
     fixtures = ['test.json']
@@ -602,6 +707,69 @@ class TestSpecificQuery(TestCase):
         self.assertIn(Page.objects.get(url_path='/home/events/').specific, pages)
         self.assertIn(Page.objects.get(url_path='/home/about-us/').specific, pages)
 
+    def test_specific_for(self):
+        pages = list(Page.objects.get(url_path='/home/').get_descendants())
+
+        with self.assertNumQueries(3):
+            # One query per page type: EventIndex, EventPage, SimplePage
+            specific_pages = Page.objects.specific_for(pages)
+
+        self.assertEqual([page.pk for page in specific_pages], [page.pk for page in pages])
+        for page, specific_page in zip(pages, specific_pages):
+            self.assertIsInstance(specific_page, page.specific_class)
+
+            # The specific page is also cached on the original instance
+            with self.assertNumQueries(0):
+                self.assertIs(page.specific, specific_page)
+
+    def test_specific_for_skips_specific_pages(self):
+        pages = [
+            EventIndex.objects.get(url_path='/home/events/'),
+            Page.objects.get(url_path='/'),
+            Page.objects.get(url_path='/home/events/christmas/'),
+        ]
+
+        with self.assertNumQueries(1):
+            specific_pages = Page.objects.specific_for(pages)
+
+        self.assertIs(specific_pages[0], pages[0])
+        self.assertIs(specific_pages[1], pages[1])
+        self.assertIsInstance(specific_pages[2], EventPage)
+
+    def test_identity_map(self):
+        with page_identity_map():
+            with self.assertNumQueries(2):
+                christmas = Page.objects.get(url_path='/home/events/christmas/').specific
+
+            with self.assertNumQueries(1):
+                # Only the plain page is fetched
+                self.assertIs(Page.objects.get(url_path='/home/events/christmas/').specific, christmas)
+
+            with self.assertNumQueries(3):
+                # The type/id query, and EventIndex and SimplePage pages, but no EventPages
+                # as christmas is already known
+                pages = list(Page.objects.filter(url_path__in=[
+                    '/home/events/', '/home/events/christmas/', '/home/about-us/'
+                ]).specific())
+
+            self.assertIn(christmas, pages)
+            self.assertIs(pages[pages.index(christmas)], christmas)
+
+        # The map is discarded at the end of the block
+        with self.assertNumQueries(2):
+            self.assertIsNot(Page.objects.get(url_path='/home/events/christmas/').specific, christmas)
+
+    def test_identity_map_middleware(self):
+        from tuiuiu.tuiuiucore.middleware import PageIdentityMapMiddleware
+        from tuiuiu.tuiuiucore.query import get_page_identity_map
+        middleware = PageIdentityMapMiddleware()
+
+        middleware.process_request(None)
+        self.assertIsNotNone(get_page_identity_map())
+
+        middleware.process_response(None, None)
+        self.assertIsNone(get_page_identity_map())
+
 
 class TestFirstCommonAncestor(TestCase):
     """
@@ -1,12 +1,15 @@
 from __future__ import absolute_import, unicode_literals
 
+import mock
 from bs4 import BeautifulSoup
-from django.test import TestCase
-from mock import patch
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-from tuiuiu.tuiuiucore.models import Page
+from tuiuiu.tuiuiucore.cache_tags import cache_tag_tracker
+from tuiuiu.tuiuiucore.models import Collection, Page
 from tuiuiu.tuiuiucore.rich_text import (
-    DbWhitelister, PageLinkHandler, RichText, expand_db_html, extract_attrs)
+    DbWhitelister, PageLinkHandler, RichText, activate_expansion_cache, deactivate_expansion_cache,
+    expand_db_html, extract_attrs)
 
 
 class TestPageLinkHandler(TestCase):
@@ -106,7 +109,7 @@ class TestExpandDbHtml(TestCase):
         result = expand_db_html(html)
         self.assertEqual(result, '<a id="1">foo</a>')
 
-    @patch('tuiuiu.tuiuiuembeds.finders.oembed.find_embed')
+    @mock.patch('tuiuiu.tuiuiuembeds.finders.oembed.find_embed')
     def test_expand_db_html_with_embed(self, oembed):
         oembed.return_value = {
             'title': 'test title',
@@ -123,6 +126,134 @@ class TestExpandDbHtml(TestCase):
         self.assertIn('test html', result)
 
 
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+class TestExpandDbHtmlInBulk(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        cache.clear()
+
+        # Populate the site root paths cache, which all page URLs use
+        Page.objects.get(id=2).url
+
+        self.events_page_id = Page.objects.get(url_path='/home/events/').pk
+        self.christmas_page_id = Page.objects.get(url_path='/home/events/christmas/').pk
+        self.html = (
+            '<p><a linktype="page" id="%d">Events</a>, <a linktype="page" id="%d">Christmas</a>, '
+            '<a linktype="page" id="%d">Christmas again</a> and <a linktype="page" id="0">nothing</a></p>'
+        ) % (self.events_page_id, self.christmas_page_id, self.christmas_page_id)
+
+    def test_expand_pages_in_bulk(self):
+        # One query for the pages, one per page type for the specific pages
+        with self.assertNumQueries(3):
+            result = expand_db_html(self.html)
+
+        self.assertEqual(
+            result,
+            '<p><a href="/events/">Events</a>, <a href="/events/christmas/">Christmas</a>, '
+            '<a href="/events/christmas/">Christmas again</a> and <a>nothing</a></p>'
+        )
+
+    def test_expand_pages_in_bulk_for_editor(self):
+        # As above, plus one query for the parent pages
+        with self.assertNumQueries(4):
+            result = expand_db_html(self.html, for_editor=True)
+
+        self.assertIn(
+            '<a data-linktype="page" data-id="%d" data-parent-id="%d" href="/events/christmas/">Christmas</a>' % (
+                self.christmas_page_id, self.events_page_id),
+            result
+        )
+
+    def test_expansions_memoised_for_request(self):
+        activate_expansion_cache()
+        try:
+            expand_db_html(self.html)
+
+            with self.assertNumQueries(0):
+                result = expand_db_html(self.html)
+        finally:
+            deactivate_expansion_cache()
+
+        self.assertIn('<a href="/events/christmas/">Christmas</a>', result)
+
+        # The memo is only active during a request
+        with self.assertNumQueries(3):
+            expand_db_html(self.html)
+
+    def test_memo_cleared_when_pages_change(self):
+        activate_expansion_cache()
+        try:
+            expand_db_html(self.html)
+
+            # Objects that links and embeds can't refer to leave the memo alone
+            Collection.get_first_root_node().save()
+            with self.assertNumQueries(0):
+                expand_db_html(self.html)
+
+            Page.objects.get(id=self.christmas_page_id).specific.save()
+            with self.assertNumQueries(3):
+                expand_db_html(self.html)
+        finally:
+            deactivate_expansion_cache()
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    },
+    TUIUIU_RICH_TEXT_CACHE='default',
+)
+# The local memory cache stands in for a cache shared between processes
+@mock.patch('tuiuiu.tuiuiucore.utils.cache_is_shared', lambda cache: True)
+class TestRichTextCache(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        cache.clear()
+        self.christmas_page = Page.objects.get(url_path='/home/events/christmas/').specific
+        self.html = '<p>Merry <a linktype="page" id="%d">Christmas</a>!</p>' % self.christmas_page.id
+
+    def test_expansion_is_cached(self):
+        result = expand_db_html(self.html)
+        self.assertEqual(result, '<p>Merry <a href="/events/christmas/">Christmas</a>!</p>')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(expand_db_html(self.html), result)
+
+        # Rich text for the editor isn't cached
+        with self.assertNumQueries(3):
+            expand_db_html(self.html, for_editor=True)
+
+    def test_publishing_invalidates_cache(self):
+        expand_db_html(self.html)
+
+        self.christmas_page.slug = 'xmas'
+        self.christmas_page.save_revision().publish()
+
+        self.assertEqual(expand_db_html(self.html), '<p>Merry <a href="/events/xmas/">Christmas</a>!</p>')
+
+    def test_cache_tags_recorded_when_cached(self):
+        expand_db_html(self.html)
+
+        with cache_tag_tracker() as tracker:
+            expand_db_html(self.html)
+
+        self.assertEqual(tracker.tags, set(['tuiuiucore.page-%d' % self.christmas_page.id]))
+
+    def test_html_without_links_is_returned_unchanged(self):
+        html = '<p>Merry <a href="http://example.com/">Christmas</a>!</p>'
+
+        with self.assertNumQueries(0):
+            self.assertEqual(expand_db_html(html), html)
+
+
 class TestRichTextValue(TestCase):
     fixtures = ['test.json']
 
@@ -1,10 +1,12 @@
 from __future__ import absolute_import, unicode_literals
 
+import mock
 from django.core.exceptions import ValidationError
 from django.http.request import HttpRequest
 from django.test import TestCase, override_settings
 
 from tuiuiu.tuiuiucore.models import Page, Site
+from tuiuiu.tuiuiucore.sites import SiteRoutingTable, get_site_for_hostname, get_site_routing_table
 
 
 class TestSiteNaturalKey(TestCase):
@@ -93,6 +95,107 @@ class TestFindSiteForRequest(TestCase):
             self.assertEqual(Site.find_for_request(request), self.site)
 
 
+@override_settings(ALLOWED_HOSTS=['example.com', 'unknown.com'])
+class TestSiteRoutingTable(TestCase):
+    def setUp(self):
+        # on_commit callbacks are never run inside a TestCase, so collect them instead
+        self.on_commit_callbacks = []
+        on_commit_patcher = mock.patch('tuiuiu.tuiuiucore.utils.on_commit', self.on_commit_callbacks.append)
+        on_commit_patcher.start()
+        self.addCleanup(on_commit_patcher.stop)
+
+        self.default_site = Site.objects.get()
+        self.site = Site.objects.create(hostname='example.com', port=80, root_page=Page.objects.get(pk=2))
+        self.alternate_port_site = Site.objects.create(hostname='example.com', port=8080, root_page=Page.objects.get(pk=2))
+        self.commit()
+
+    def commit(self):
+        for callback in self.on_commit_callbacks:
+            callback()
+        self.on_commit_callbacks[:] = []
+
+    def get_request(self, host, port=80):
+        request = HttpRequest()
+        request.META = {'HTTP_HOST': host, 'SERVER_PORT': port}
+        return request
+
+    def test_matches_database_lookup(self):
+        table = SiteRoutingTable.build()
+
+        for hostname, port in [('example.com', 80), ('example.com', '8080'), ('example.com', 8000),
+                               ('unknown.com', 80), ('localhost', 80), (None, None)]:
+            self.assertEqual(
+                table.get_site_for_hostname(hostname, port),
+                Site.objects.get(pk=get_site_for_hostname(hostname, port).pk)
+            )
+
+    def test_unique_hostname_without_default(self):
+        self.default_site.delete()
+        self.alternate_port_site.delete()
+        table = SiteRoutingTable.build()
+
+        self.assertEqual(table.get_site_for_hostname('example.com', 8000), self.site)
+
+        with self.assertRaises(Site.DoesNotExist):
+            table.get_site_for_hostname('unknown.com', 80)
+
+    # The local memory cache stands in for a cache shared between processes
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @mock.patch('tuiuiu.tuiuiucore.utils.cache_is_shared', lambda cache: True)
+    def test_lookup_doesnt_query_database(self):
+        Site.find_for_request(self.get_request('example.com'))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Site.find_for_request(self.get_request('example.com')), self.site)
+            self.assertEqual(Site.find_for_request(self.get_request('example.com', 8080)), self.alternate_port_site)
+            self.assertEqual(Site.find_for_request(self.get_request('unknown.com')), self.default_site)
+
+    def test_returns_copies(self):
+        first = Site.find_for_request(self.get_request('example.com'))
+        second = Site.find_for_request(self.get_request('example.com'))
+
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+    def test_rebuilt_when_site_saved(self):
+        table = get_site_routing_table()
+
+        self.site.hostname = 'example.org'
+        self.site.save()
+
+        # Until the change is committed, this thread looks sites up in the database
+        self.assertIsNone(get_site_routing_table())
+        self.assertEqual(Site.find_for_request(self.get_request('example.com')), self.alternate_port_site)
+
+        self.commit()
+        self.assertIsNot(get_site_routing_table(), table)
+        self.assertEqual(Site.find_for_request(self.get_request('example.com')), self.alternate_port_site)
+
+    def test_rebuilt_when_site_deleted(self):
+        table = get_site_routing_table()
+
+        self.site.delete()
+        self.alternate_port_site.delete()
+        self.commit()
+
+        self.assertIsNot(get_site_routing_table(), table)
+        self.assertEqual(Site.find_for_request(self.get_request('example.com')), self.default_site)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_falls_back_to_database_without_shared_cache(self):
+        self.assertIsNone(get_site_routing_table())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Site.find_for_request(self.get_request('example.com')), self.site)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_falls_back_to_database_with_local_memory_cache(self):
+        # Each process has its own local memory cache, so a change made by
+        # one process couldn't invalidate the tables of the others
+        self.assertIsNone(get_site_routing_table())
+        self.assertEqual(Site.find_for_request(self.get_request('example.com')), self.site)
+
+
 class TestDefaultSite(TestCase):
     def test_create_default_site(self):
         Site.objects.all().delete()
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*
 from __future__ import absolute_import, unicode_literals
 
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 from django.utils.text import slugify
 
-from tuiuiu.tuiuiucore.utils import accepts_kwarg, cautious_slugify
+from tuiuiu.tuiuiucore.utils import (
+    accepts_kwarg, bump_cache_version_on_commit, cautious_slugify, get_cache_version)
 
 
 class TestCautiousSlugify(TestCase):
@@ -52,3 +54,34 @@ class TestAcceptsKwarg(TestCase):
         self.assertFalse(accepts_kwarg(func_without_banana, 'banana'))
         self.assertTrue(accepts_kwarg(func_with_banana, 'banana'))
         self.assertTrue(accepts_kwarg(func_with_kwargs, 'banana'))
+
+
+class TestBumpCacheVersionOnCommit(TransactionTestCase):
+    def test_bumped_on_commit(self):
+        version = get_cache_version('test_version')
+
+        with transaction.atomic():
+            bump_cache_version_on_commit('test_version')
+
+            # Other threads keep the old version until the commit, but this
+            # one has to bypass the caches that rely on it
+            self.assertIsNone(get_cache_version('test_version'))
+
+        new_version = get_cache_version('test_version')
+        self.assertIsNotNone(new_version)
+        self.assertNotEqual(new_version, version)
+
+    def test_not_bumped_on_rollback(self):
+        version = get_cache_version('test_version')
+
+        try:
+            with transaction.atomic():
+                bump_cache_version_on_commit('test_version')
+                raise RuntimeError("Roll back")
+        except RuntimeError:
+            pass
+
+        self.assertEqual(get_cache_version('test_version'), version)
+
+        with transaction.atomic():
+            self.assertEqual(get_cache_version('test_version'), version)
@@ -1,5 +1,16 @@
 from __future__ import absolute_import, unicode_literals
 
+import threading
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.http import Http404
+from django.utils.six import get_unbound_function
+
+from tuiuiu.tuiuiucore.utils import bump_cache_version_on_commit, get_cache_version
+
 
 class RouteResult(object):
     """
@@ -16,3 +27,185 @@ class RouteResult(object):
 
     def __getitem__(self, index):
         return (self.page, self.args, self.kwargs)[index]
+
+
+PAGE_ROUTING_VERSION_CACHE_KEY = 'tuiuiu_page_routing_version'
+
+
+def bump_page_routing_version():
+    """
+    Invalidate the page route caches of every process once the current
+    transaction is committed
+    """
+    bump_cache_version_on_commit(PAGE_ROUTING_VERSION_CACHE_KEY)
+
+
+class PageRouteCache(object):
+    """
+    A per-process LRU cache mapping (site id, path components) to the
+    (page id, content type id) of the page that serves that path.
+
+    Entries are dropped whenever the page routing version stamp changes,
+    which happens when pages are published, unpublished, moved, renamed or
+    deleted.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_version(self):
+        version = get_cache_version(PAGE_ROUTING_VERSION_CACHE_KEY)
+        if version is None:
+            # This thread can't use the cache just now, but other threads can
+            return None
+
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+        return version
+
+    def get(self, key, version):
+        if version is None:
+            return None
+
+        with self.lock:
+            if version != self.version:
+                return None
+
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return None
+
+            # Move the entry to the most recently used end
+            self.entries[key] = value
+            return value
+
+    def set(self, key, value, version):
+        if version is None:
+            return
+
+        with self.lock:
+            # Don't store routes that were resolved against an older version
+            if version != self.version:
+                return
+
+            self.entries.pop(key, None)
+            self.entries[key] = value
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+_page_route_cache = None
+
+
+def get_page_route_cache():
+    """
+    Return this process's PageRouteCache, or None if the cache is disabled
+    (the TUIUIU_ROUTE_CACHE_SIZE setting is 0, which is the default)
+    """
+    global _page_route_cache
+
+    max_size = getattr(settings, 'TUIUIU_ROUTE_CACHE_SIZE', 0)
+    if not max_size:
+        return None
+
+    if _page_route_cache is None or _page_route_cache.max_size != max_size:
+        _page_route_cache = PageRouteCache(max_size)
+
+    return _page_route_cache
+
+
+def overrides_route(page_class):
+    """
+    Return True if page_class implements its own routing (for example, using
+    RoutablePageMixin) rather than the default path-based walk of Page.route
+    """
+    Page = apps.get_model('tuiuiucore.Page')
+
+    if page_class is None:
+        return False
+
+    return get_unbound_function(page_class.route) is not get_unbound_function(Page.route)
+
+
+def route_by_url_path(request, site, path_components):
+    """
+    Find the page to serve for the given path on the given site, in the same
+    way as calling site.root_page.specific.route(request, path_components),
+    but by looking up every page along the path in a single query against the
+    url_path column rather than fetching each level in turn.
+
+    Routing falls back to the recursive walk from the first page along the path
+    that overrides Page.route, and to a walk from the site root if the url_path
+    column doesn't agree with the tree.
+    """
+    Page = apps.get_model('tuiuiucore.Page')
+
+    route_cache = get_page_route_cache()
+    cache_key = (site.pk, tuple(path_components))
+    cache_version = None
+
+    if route_cache is not None:
+        cache_version = route_cache.get_version()
+        cached_route = route_cache.get(cache_key, cache_version)
+
+        if cached_route is not None:
+            page_id, content_type_id = cached_route
+            model_class = ContentType.objects.get_for_id(content_type_id).model_class() or Page
+
+            try:
+                page = model_class._base_manager.get(id=page_id)
+            except model_class.DoesNotExist:
+                pass
+            else:
+                return page.route(request, [])
+
+    root_url_path = None
+    for site_id, root_path, root_url in site.get_site_root_paths():
+        if site_id == site.pk:
+            root_url_path = root_path
+            break
+    else:
+        root_url_path = site.root_page.url_path
+
+    url_paths = [root_url_path]
+    for component in path_components:
+        url_paths.append(url_paths[-1] + component + '/')
+
+    pages_by_url_path = {
+        page.url_path: page
+        for page in Page.objects.filter(url_path__in=url_paths)
+    }
+
+    parent = None
+    for index, url_path in enumerate(url_paths):
+        try:
+            page = pages_by_url_path[url_path]
+        except KeyError:
+            # None of the pages above this one route on their own, so Page.route
+            # would have failed to find this child as well
+            raise Http404
+
+        if parent is None:
+            is_consistent = page.pk == site.root_page_id
+        else:
+            is_consistent = page.depth == parent.depth + 1 and page.path.startswith(parent.path)
+
+        if not is_consistent:
+            return site.root_page.specific.route(request, path_components)
+
+        if index < len(path_components) and overrides_route(page.specific_class):
+            return page.specific.route(request, path_components[index:])
+
+        parent = page
+
+    if route_cache is not None:
+        route_cache.set(cache_key, (page.pk, page.content_type_id), cache_version)
+
+    return page.specific.route(request, [])
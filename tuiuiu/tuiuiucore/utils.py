@@ -3,15 +3,23 @@ from __future__ import absolute_import, unicode_literals
 import inspect
 import re
 import sys
+import threading
 import unicodedata
+import uuid
 
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
 from django.db.models import Model
 from django.utils.encoding import force_text
 from django.utils.six import string_types
 from django.utils.text import slugify
 
+from tuiuiu.utils.compat import on_commit
+
 
 TUIUIU_APPEND_SLASH = getattr(settings, 'TUIUIU_APPEND_SLASH', True)
 
@@ -113,3 +121,114 @@ def accepts_kwarg(func, kwarg):
         # Fall back on inspect.getargspec, available on Python 2.7 but deprecated since 3.5
         argspec = inspect.getargspec(func)
         return (kwarg in argspec.args) or (argspec.keywords is not None)
+
+
+def cache_is_shared(cache):
+    """
+    Return True if `cache` is shared by all processes, so that a version stamp
+    replaced by one process is seen by the others. The dummy cache holds
+    nothing, and the local memory cache (Django's default) is separate for
+    each process.
+    """
+    return not isinstance(cache, (DummyCache, LocMemCache))
+
+
+def get_cache_version(key, cache=None):
+    """
+    Return the version stamp stored under `key` in `cache` (the default cache
+    if not given), for use by per-process caches that need to notice changes
+    made by other processes.
+
+    A fresh stamp is issued if the cache has none (e.g. after eviction), which
+    invalidates every per-process cache relying on it. Returns None if the
+    cache isn't shared between processes (see cache_is_shared), in which case
+    callers have to go to the database.
+    """
+    if cache is None:
+        cache = caches[DEFAULT_CACHE_ALIAS]
+
+    if not cache_is_shared(cache) or is_bump_pending(key):
+        return None
+
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+
+    return version
+
+
+def get_cache_versions(keys, cache=None):
+    """
+    Return the version stamps stored under each of `keys`, as a list in the same
+    order, fetching them from the cache together.
+    """
+    if cache is None:
+        cache = caches[DEFAULT_CACHE_ALIAS]
+
+    if not cache_is_shared(cache):
+        return [None for key in keys]
+
+    versions = cache.get_many(keys)
+
+    return [
+        versions[key] if key in versions and not is_bump_pending(key) else get_cache_version(key, cache)
+        for key in keys
+    ]
+
+
+def bump_cache_version(key, cache=None):
+    """
+    Replace the version stamp stored under `key` in `cache` (the default cache
+    if not given), invalidating the per-process caches that rely on it.
+    """
+    if cache is None:
+        cache = caches[DEFAULT_CACHE_ALIAS]
+
+    cache.set(key, uuid.uuid4().hex, None)
+
+
+# The version stamps that each thread is going to bump when its current
+# transaction is committed, with the list of on_commit callbacks that
+# identifies the transaction (Django replaces it when a transaction ends)
+_pending_bumps = threading.local()
+
+
+def bump_cache_version_on_commit(key, cache=None, bump=bump_cache_version):
+    """
+    Replace the version stamp stored under `key` in `cache` (the default cache
+    if not given) once the current transaction is committed, by calling
+    `bump(key, cache)`. Bumping it straight away would let other processes
+    rebuild their caches from the old data before the commit, and keep them
+    under the new version.
+
+    Until the commit, get_cache_version returns None for the key in this
+    thread, as only this transaction can see its changes so far.
+    """
+    pending_keys = set()
+    run_on_commit = getattr(connection, 'run_on_commit', None)
+    if connection.in_atomic_block and run_on_commit is not None:
+        if getattr(_pending_bumps, 'run_on_commit', None) is not run_on_commit:
+            _pending_bumps.run_on_commit = run_on_commit
+            _pending_bumps.keys = set()
+
+        pending_keys = _pending_bumps.keys
+        pending_keys.add(key)
+
+    def bump_on_commit():
+        pending_keys.discard(key)
+        bump(key, cache)
+
+    on_commit(bump_on_commit)
+
+
+def is_bump_pending(key):
+    """
+    Return True if the current thread is going to bump the version stamp under
+    `key` when its current transaction is committed
+    """
+    return (
+        key in getattr(_pending_bumps, 'keys', ()) and
+        _pending_bumps.run_on_commit is getattr(connection, 'run_on_commit', None)
+    )
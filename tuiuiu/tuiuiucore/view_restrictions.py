@@ -0,0 +1,100 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+from django.apps import apps
+
+from tuiuiu.tuiuiucore.utils import bump_cache_version_on_commit, get_cache_version
+
+
+PAGE_VIEW_RESTRICTIONS_VERSION_CACHE_KEY = 'tuiuiu_page_view_restrictions_version'
+
+
+def bump_page_view_restrictions_version():
+    """
+    Invalidate the restricted path ranges of every process once the current
+    transaction is committed, so that ranges rebuilt from the old restrictions
+    before then can't be kept under the new version
+    """
+    bump_cache_version_on_commit(PAGE_VIEW_RESTRICTIONS_VERSION_CACHE_KEY)
+
+
+def get_next_path(path, alphabet):
+    """
+    Return the first path (in treebeard's alphabet) that sorts after every path
+    starting with `path`, or None if there isn't one.
+
+    >>> get_next_path('00010002', '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    '00010003'
+    >>> get_next_path('0001000Z', '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    '0001001'
+    """
+    path = path.rstrip(alphabet[-1])
+    if not path:
+        return None
+
+    return path[:-1] + alphabet[alphabet.index(path[-1]) + 1]
+
+
+def get_path_ranges(paths, alphabet):
+    """
+    Convert a list of tree paths into the smallest list of (lower, upper) path
+    ranges that contain those paths and all of their descendants. Paths in a
+    range satisfy `lower <= path < upper`; `upper` is None for a range that
+    extends to the end of the tree.
+    """
+    ranges = []
+
+    for path in sorted(paths):
+        if ranges and (ranges[-1][1] is None or path < ranges[-1][1]):
+            # Within the previous range, as a descendant of its last path
+            continue
+
+        upper = get_next_path(path, alphabet)
+
+        if ranges and ranges[-1][1] == path:
+            # Adjacent to the previous range (e.g. consecutive siblings)
+            ranges[-1] = (ranges[-1][0], upper)
+        else:
+            ranges.append((path, upper))
+
+    return ranges
+
+
+def build_restricted_path_ranges():
+    Page = apps.get_model('tuiuiucore.Page')
+    PageViewRestriction = apps.get_model('tuiuiucore.PageViewRestriction')
+
+    paths = PageViewRestriction.objects.values_list('page__path', flat=True).distinct()
+    return get_path_ranges(paths, Page.alphabet)
+
+
+_restricted_path_ranges = None
+_restricted_path_ranges_version = None
+_restricted_path_ranges_lock = threading.Lock()
+
+
+def get_restricted_path_ranges():
+    """
+    Return the ranges of page paths covered by a view restriction, as given
+    by get_path_ranges. They are kept by each process until a restriction is
+    saved or deleted, or a page is moved.
+
+    They are fetched from the database every time if the version stamp isn't
+    kept in a cache shared by all processes (such as with the dummy or local
+    memory cache), as a restriction added in one process would otherwise not
+    be applied by the others, and while this thread has changed restrictions
+    in a transaction that isn't committed yet.
+    """
+    global _restricted_path_ranges, _restricted_path_ranges_version
+
+    version = get_cache_version(PAGE_VIEW_RESTRICTIONS_VERSION_CACHE_KEY)
+    if version is None:
+        return build_restricted_path_ranges()
+
+    with _restricted_path_ranges_lock:
+        if _restricted_path_ranges is None or _restricted_path_ranges_version != version:
+            _restricted_path_ranges = build_restricted_path_ranges()
+            _restricted_path_ranges_version = version
+
+        return _restricted_path_ranges
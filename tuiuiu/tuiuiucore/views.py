@@ -1,12 +1,15 @@
 from __future__ import absolute_import, unicode_literals
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
 
 from tuiuiu.tuiuiucore import hooks
+from tuiuiu.tuiuiucore.cache_tags import record_object_cache_tags
 from tuiuiu.tuiuiucore.forms import PasswordViewRestrictionForm
 from tuiuiu.tuiuiucore.models import Page, PageViewRestriction
+from tuiuiu.tuiuiucore.url_routing import route_by_url_path
 
 
 def serve(request, path):
@@ -16,7 +19,13 @@ def serve(request, path):
         raise Http404
 
     path_components = [component for component in path.split('/') if component]
-    page, args, kwargs = request.site.root_page.specific.route(request, path_components)
+
+    if getattr(settings, 'TUIUIU_ROUTE_BY_URL_PATH', False):
+        page, args, kwargs = route_by_url_path(request, request.site, path_components)
+    else:
+        page, args, kwargs = request.site.root_page.specific.route(request, path_components)
+
+    record_object_cache_tags([page])
 
     for fn in hooks.get_hooks('before_serve_page'):
         result = fn(page, request, args, kwargs)
@@ -1,26 +1,60 @@
 from __future__ import absolute_import, unicode_literals
 
 from django.utils.html import escape
+from django.utils.six import text_type
 
+from tuiuiu.tuiuiucore.cache_tags import get_cache_tag
+from tuiuiu.tuiuiucore.utils import bump_cache_version_on_commit
 from tuiuiu.tuiuiudocs.models import get_document_model
 
 
+def get_document_link_version_cache_key(document_id):
+    return 'tuiuiudocs_link_version_%s' % document_id
+
+
+def bump_document_link_version(document_id):
+    """
+    Invalidate the cached rich text that links to the given document once the
+    current transaction is committed
+    """
+    bump_cache_version_on_commit(get_document_link_version_cache_key(document_id))
+
+
 class DocumentLinkHandler(object):
     @staticmethod
     def get_db_attributes(tag):
         return {'id': tag['data-id']}
 
+    @staticmethod
+    def get_cache_version_keys(attrs):
+        return [get_document_link_version_cache_key(attrs['id'])]
+
+    @staticmethod
+    def get_cache_tags(attrs):
+        return [get_cache_tag(get_document_model(), attrs['id'])]
+
     @staticmethod
     def expand_db_attributes(attrs, for_editor):
+        return DocumentLinkHandler.expand_db_attributes_many([attrs], for_editor)[0]
+
+    @staticmethod
+    def expand_db_attributes_many(attrs_list, for_editor):
         Document = get_document_model()
-        try:
-            doc = Document.objects.get(id=attrs['id'])
+        docs = Document.objects.in_bulk(set(attrs['id'] for attrs in attrs_list))
+        docs = {text_type(pk): doc for pk, doc in docs.items()}
+
+        results = []
+        for attrs in attrs_list:
+            doc = docs.get(text_type(attrs['id']))
+            if doc is None:
+                results.append("<a>")
+                continue
 
             if for_editor:
                 editor_attrs = 'data-linktype="document" data-id="%d" ' % doc.id
             else:
                 editor_attrs = ''
 
-            return '<a %shref="%s">' % (editor_attrs, escape(doc.url))
-        except Document.DoesNotExist:
-            return "<a>"
+            results.append('<a %shref="%s">' % (editor_attrs, escape(doc.url)))
+
+        return results
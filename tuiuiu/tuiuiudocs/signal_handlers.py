@@ -1,8 +1,10 @@
 from __future__ import absolute_import, unicode_literals
 
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save
 
-from tuiuiu.tuiuiudocs.models import Document
+from tuiuiu.tuiuiucore.rich_text import clear_expansion_cache
+from tuiuiu.tuiuiudocs.models import Document, get_document_model
+from tuiuiu.tuiuiudocs.rich_text import bump_document_link_version
 
 
 # Receive the post_delete signal and delete the file associated with the model instance.
@@ -11,5 +13,15 @@ def post_delete_document_file_cleanup(sender, instance, **kwargs):
     instance.file.delete(False)
 
 
+# Invalidate cached rich text that links to a document whenever the document changes
+def document_link_changed_signal_handler(instance, **kwargs):
+    bump_document_link_version(instance.pk)
+
+
 def register_signal_handlers():
     post_delete.connect(post_delete_document_file_cleanup, sender=Document)
+
+    # Links in rich text are to the configured document model
+    for handler in [document_link_changed_signal_handler, clear_expansion_cache]:
+        post_save.connect(handler, sender=get_document_model())
+        post_delete.connect(handler, sender=get_document_model())
@@ -11,6 +11,9 @@ class MediaEmbedHandler(object):
     representation will be:
     <embed embedtype="media" url="http://vimeo.com/XXXXX">
     """
+    # Embeds are stored in the database once found, and don't change
+    cache_version_keys = []
+
     @staticmethod
     def get_db_attributes(tag):
         """
@@ -11,6 +11,9 @@ class ImagesAdminAPIEndpoint(ImagesAPIEndpoint):
         'thumbnail',
     ]
 
+    def get_queryset(self):
+        return super(ImagesAdminAPIEndpoint, self).get_queryset().prefetch_renditions('max-165x165')
+
     listing_default_fields = ImagesAPIEndpoint.listing_default_fields + [
         'width',
         'height',
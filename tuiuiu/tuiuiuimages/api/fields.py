@@ -32,7 +32,7 @@ class ImageRenditionField(Field):
 
     def to_representation(self, image):
         try:
-            thumbnail = image.get_rendition(self.filter_spec)
+            thumbnail = image.get_rendition(self.filter_spec, defer=False)
 
             return OrderedDict([
                 ('url', thumbnail.url),
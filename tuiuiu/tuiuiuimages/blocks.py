@@ -18,6 +18,15 @@ class ImageChooserBlock(ChooserBlock):
         from tuiuiu.tuiuiuimages.widgets import AdminImageChooser
         return AdminImageChooser
 
+    def bulk_to_python(self, values):
+        images = super(ImageChooserBlock, self).bulk_to_python(values)
+
+        if self.meta.prefetch_renditions:
+            from tuiuiu.tuiuiuimages.models import prefetch_renditions
+            prefetch_renditions([image for image in images if image is not None], *self.meta.prefetch_renditions)
+
+        return images
+
     def render_basic(self, value, context=None):
         if value:
             return get_rendition_or_not_found(value, 'original').img_tag()
@@ -26,3 +35,6 @@ class ImageChooserBlock(ChooserBlock):
 
     class Meta:
         icon = "image"
+        # Filter specs of the renditions to look up in bulk, along with the images,
+        # when loading a StreamField containing this block
+        prefetch_renditions = ()
@@ -37,9 +37,15 @@ class Format(object):
         else:
             class_attr = ''
 
-        return '<img %s%ssrc="%s" width="%d" height="%d" alt="%s">' % (
+        if rendition.width is not None:
+            size_attrs = 'width="%d" height="%d" ' % (rendition.width, rendition.height)
+        else:
+            # The rendition is still being generated in the background
+            size_attrs = ''
+
+        return '<img %s%ssrc="%s" %salt="%s">' % (
             extra_attributes, class_attr,
-            escape(rendition.url), rendition.width, rendition.height, alt_text
+            escape(rendition.url), size_attrs, alt_text
         )
 
 
@@ -151,9 +151,11 @@ class MinMaxOperation(Operation):
         self.width = int(width_str)
         self.height = int(height_str)
 
-    def run(self, willow, image, env):
-        image_width, image_height = willow.get_size()
-
+    def get_resize_size(self, image_width, image_height):
+        """
+        Return the size an image of the given size is resized to, or None if it
+        is left as it is
+        """
         horz_scale = self.width / image_width
         vert_scale = self.height / image_height
 
@@ -183,16 +185,24 @@ class MinMaxOperation(Operation):
             # Unknown method
             return
 
-        return willow.resize((width, height))
+        return width, height
+
+    def run(self, willow, image, env):
+        size = self.get_resize_size(*willow.get_size())
+
+        if size is not None:
+            return willow.resize(size)
 
 
 class WidthHeightOperation(Operation):
     def construct(self, size):
         self.size = int(size)
 
-    def run(self, willow, image, env):
-        image_width, image_height = willow.get_size()
-
+    def get_resize_size(self, image_width, image_height):
+        """
+        Return the size an image of the given size is resized to, or None if it
+        is left as it is
+        """
         if self.method == 'width':
             if image_width <= self.size:
                 return
@@ -215,7 +225,13 @@ class WidthHeightOperation(Operation):
             # Unknown method
             return
 
-        return willow.resize((width, height))
+        return width, height
+
+    def run(self, willow, image, env):
+        size = self.get_resize_size(*willow.get_size())
+
+        if size is not None:
+            return willow.resize(size)
 
 
 class JPEGQualityOperation(Operation):
@@ -2,7 +2,7 @@ from __future__ import absolute_import, unicode_literals
 
 from jinja2.ext import Extension
 
-from .shortcuts import get_rendition_or_not_found
+from .shortcuts import get_rendition_or_not_found, srcset_img_tag
 
 
 def image(image, filterspec, **attrs):
@@ -17,12 +17,20 @@ def image(image, filterspec, **attrs):
         return rendition
 
 
+def srcset(image, *filterspecs, **attrs):
+    if not image:
+        return ''
+
+    return srcset_img_tag(image, filterspecs, attrs)
+
+
 class TuiuiuImagesExtension(Extension):
     def __init__(self, environment):
         super(TuiuiuImagesExtension, self).__init__(environment)
 
         self.environment.globals.update({
             'image': image,
+            'srcset': srcset,
         })
 
 
@@ -8,6 +8,7 @@ from contextlib import contextmanager
 import django
 from django.conf import settings
 from django.core import checks
+from django.core.cache import InvalidCacheBackendError, caches
 from django.core.files import File
 from django.core.urlresolvers import reverse
 from django.db import models
@@ -22,11 +23,15 @@ from taggit.managers import TaggableManager
 from unidecode import unidecode
 from willow.image import Image as WillowImage
 
+from tuiuiu.utils.compat import on_commit
 from tuiuiu.tuiuiuadmin.utils import get_object_usage
 from tuiuiu.tuiuiucore import hooks
+from tuiuiu.tuiuiucore.cache_tags import record_object_cache_tags
 from tuiuiu.tuiuiucore.models import CollectionMember
 from tuiuiu.tuiuiuimages.exceptions import InvalidFilterSpecError
+from tuiuiu.tuiuiuimages.image_operations import DoNothingOperation, FormatOperation, JPEGQualityOperation
 from tuiuiu.tuiuiuimages.rect import Rect
+from tuiuiu.tuiuiuimages.rendition_queue import get_rendition_queue
 from tuiuiu.tuiuiusearch import index
 from tuiuiu.tuiuiusearch.queryset import SearchableQuerySetMixin
 
@@ -39,7 +44,31 @@ class SourceImageIOError(IOError):
 
 
 class ImageQuerySet(SearchableQuerySetMixin, models.QuerySet):
-    pass
+    _rendition_filters = ()
+
+    def prefetch_renditions(self, *filters):
+        """
+        Look up the renditions of the given filters (Filter objects or filter
+        spec strings) for all images in this queryset once it is evaluated, so
+        that calling get_rendition on the images doesn't make a query per image.
+        """
+        clone = self._clone()
+        clone._rendition_filters = self._rendition_filters + filters
+        return clone
+
+    def _clone(self, *args, **kwargs):
+        clone = super(ImageQuerySet, self)._clone(*args, **kwargs)
+        clone._rendition_filters = self._rendition_filters
+        return clone
+
+    def _fetch_all(self):
+        prefetch = self._result_cache is None and self._rendition_filters
+        super(ImageQuerySet, self)._fetch_all()
+
+        if prefetch:
+            # values() / values_list() querysets don't return images
+            images = [image for image in self._result_cache if isinstance(image, AbstractImage)]
+            prefetch_renditions(images, *self._rendition_filters)
 
 
 def get_upload_to(instance, filename):
@@ -53,6 +82,17 @@ def get_upload_to(instance, filename):
     return instance.get_upload_to(filename)
 
 
+def get_rendition_cache():
+    """
+    Return the cache used to look up existing renditions without querying the
+    database, or None if the project doesn't define a 'renditions' cache
+    """
+    try:
+        return caches['renditions']
+    except InvalidCacheBackendError:
+        return None
+
+
 def get_rendition_upload_to(instance, filename):
     """
     Obtain a valid upload path for an image rendition file.
@@ -255,46 +295,184 @@ class AbstractImage(CollectionMember, index.Indexed, models.Model):
         else:
             return cls.renditions.related.related_model
 
-    def get_rendition(self, filter):
+    def get_rendition(self, filter, defer=True):
+        """
+        Return the rendition of this image for the given filter, generating it
+        if it doesn't exist yet.
+
+        If TUIUIUIMAGES_RENDITION_QUEUE is set and `defer` is true, a missing
+        rendition is queued for generation in the background instead, and a
+        PendingRendition pointing at a placeholder URL is returned.
+        """
         if isinstance(filter, string_types):
             filter = Filter(spec=filter)
 
+        record_object_cache_tags([self])
+
         cache_key = filter.get_cache_key(self)
         Rendition = self.get_rendition_model()
 
+        # Renditions that were looked up in bulk by prefetch_renditions
+        prefetched_renditions = getattr(self, '_prefetched_renditions', {})
+        if (filter.spec, cache_key) in prefetched_renditions:
+            return prefetched_renditions[(filter.spec, cache_key)]
+
+        rendition = Rendition.get_from_cache(self, filter.spec, cache_key)
+        if rendition is not None:
+            return rendition
+
         try:
             rendition = self.renditions.get(
                 filter_spec=filter.spec,
                 focal_point_key=cache_key,
             )
         except Rendition.DoesNotExist:
+            queue = get_rendition_queue() if defer else None
+            if queue is not None:
+                placeholder_url = queue.get_placeholder_url(self, filter)
+                if placeholder_url is not None:
+                    queue.enqueue(self, [filter])
+                    return PendingRendition(self, filter.spec, cache_key, placeholder_url)
+
             # Generate the rendition image
             generated_image = filter.run(self, BytesIO())
+            rendition = self.create_rendition(filter, cache_key, generated_image)
 
-            # Generate filename
-            input_filename = os.path.basename(self.file.name)
-            input_filename_without_extension, input_extension = os.path.splitext(input_filename)
+        rendition.add_to_cache()
 
-            # A mapping of image formats to extensions
-            FORMAT_EXTENSIONS = {
-                'jpeg': '.jpg',
-                'png': '.png',
-                'gif': '.gif',
-            }
+        return rendition
 
-            output_extension = filter.spec.replace('|', '.') + FORMAT_EXTENSIONS[generated_image.format_name]
-            if cache_key:
-                output_extension = cache_key + '.' + output_extension
+    def get_renditions(self, *filters, **kwargs):
+        """
+        Return a dict of the renditions of this image for the given filters
+        (Filter objects or filter spec strings), keyed by filter spec.
 
-            # Truncate filename to prevent it going over 60 chars
-            output_filename_without_extension = input_filename_without_extension[:(59 - len(output_extension))]
-            output_filename = output_filename_without_extension + '.' + output_extension
+        Unlike calling get_rendition for each filter, the existing renditions are
+        looked up together, and the source image is only opened and decoded once
+        to generate the missing ones. Renditions which only resize the image are
+        derived from the smallest larger one generated alongside them.
 
-            rendition, created = self.renditions.get_or_create(
-                filter_spec=filter.spec,
-                focal_point_key=cache_key,
-                defaults={'file': File(generated_image.f, name=output_filename)}
-            )
+        Accepts the same `defer` argument as get_rendition.
+        """
+        defer = kwargs.pop('defer', True)
+
+        filters = [Filter(spec=filter) if isinstance(filter, string_types) else filter for filter in filters]
+        record_object_cache_tags([self])
+        prefetch_renditions([self], *filters)
+
+        renditions = {}
+        missing_filters = []
+        prefetched_renditions = getattr(self, '_prefetched_renditions', {})
+        for filter in filters:
+            rendition = prefetched_renditions.get((filter.spec, filter.get_cache_key(self)))
+            if rendition is not None:
+                renditions[filter.spec] = rendition
+            else:
+                missing_filters.append(filter)
+
+        if missing_filters and defer and get_rendition_queue() is not None:
+            # Leave it to get_rendition to queue them
+            for filter in missing_filters:
+                renditions[filter.spec] = self.get_rendition(filter)
+        elif missing_filters:
+            for filter, generated_image in self.generate_rendition_images(missing_filters):
+                renditions[filter.spec] = self.create_rendition(filter, filter.get_cache_key(self), generated_image)
+                renditions[filter.spec].add_to_cache()
+
+        return renditions
+
+    def get_eager_rendition_filters(self):
+        """
+        Return the filter specs of the renditions to generate as soon as this
+        image is uploaded. Override this to vary them, e.g. by collection.
+        """
+        return getattr(settings, 'TUIUIUIMAGES_EAGER_RENDITIONS', [])
+
+    def generate_eager_renditions(self):
+        """
+        Queue the renditions returned by get_eager_rendition_filters for
+        generation in the background. Nothing is done unless
+        TUIUIUIMAGES_RENDITION_QUEUE is set, as generating them during the
+        upload request is what this is meant to avoid.
+        """
+        queue = get_rendition_queue()
+        if queue is None:
+            return
+
+        filters = [Filter(spec=filter_spec) for filter_spec in self.get_eager_rendition_filters()]
+        if not filters:
+            return
+
+        # The queue's workers can't see the image until it is committed
+        on_commit(lambda: queue.enqueue(self, filters))
+
+    def generate_rendition_images(self, filters):
+        """
+        Run all the given filters on this image, opening and decoding it only
+        once. Yields (filter, generated image) pairs.
+        """
+        with self.get_willow_image() as willow:
+            original_format = willow.format_name
+
+            # Fix orientation of image
+            willow = willow.auto_orient()
+            original_size = willow.get_size()
+
+            # Resize the images that are only resized from largest to smallest,
+            # so that each can be derived from the previous ones
+            resized_images = []
+            resize_filters = []
+            for filter in filters:
+                if filter.resize_operation is not None:
+                    size = filter.resize_operation.get_resize_size(*original_size) or original_size
+                    resize_filters.append((size, filter))
+                else:
+                    yield filter, filter.process(willow, self, BytesIO(), original_format)
+
+            for size, filter in sorted(resize_filters, key=lambda item: item[0][0] * item[0][1], reverse=True):
+                # Start from the smallest image that is at least as large in both dimensions
+                source_size, source = original_size, willow
+                for resized_size, resized in resized_images:
+                    if size[0] <= resized_size[0] < source_size[0] and size[1] <= resized_size[1]:
+                        source_size, source = resized_size, resized
+
+                if source_size != size:
+                    source = source.resize(size)
+                    resized_images.append((size, source))
+
+                # The resize operation finds that the image is already the right size
+                yield filter, filter.process(source, self, BytesIO(), original_format)
+
+    def create_rendition(self, filter, focal_point_key, generated_image):
+        """
+        Save the image generated by running filter on this image as a rendition.
+        If another process has saved the same rendition in the meantime, that
+        one is returned instead.
+        """
+        # Generate filename
+        input_filename = os.path.basename(self.file.name)
+        input_filename_without_extension, input_extension = os.path.splitext(input_filename)
+
+        # A mapping of image formats to extensions
+        FORMAT_EXTENSIONS = {
+            'jpeg': '.jpg',
+            'png': '.png',
+            'gif': '.gif',
+        }
+
+        output_extension = filter.spec.replace('|', '.') + FORMAT_EXTENSIONS[generated_image.format_name]
+        if focal_point_key:
+            output_extension = focal_point_key + '.' + output_extension
+
+        # Truncate filename to prevent it going over 60 chars
+        output_filename_without_extension = input_filename_without_extension[:(59 - len(output_extension))]
+        output_filename = output_filename_without_extension + '.' + output_extension
+
+        rendition, created = self.renditions.get_or_create(
+            filter_spec=filter.spec,
+            focal_point_key=focal_point_key,
+            defaults={'file': File(generated_image.f, name=output_filename)}
+        )
 
         return rendition
 
@@ -323,6 +501,91 @@ class AbstractImage(CollectionMember, index.Indexed, models.Model):
         abstract = True
 
 
+def prefetch_renditions_from_cache(images, *filters):
+    """
+    Look up the renditions of all the given images for all the given filters
+    (Filter objects or filter spec strings) with a single get_many call on the
+    rendition cache. The renditions that are found are attached to the images,
+    so that subsequent get_rendition calls for them don't go to the cache or
+    the database.
+    """
+    cache = get_rendition_cache()
+    if cache is None:
+        return
+
+    filters = [Filter(spec=filter) if isinstance(filter, string_types) else filter for filter in filters]
+
+    lookups = {}
+    for image in images:
+        Rendition = image.get_rendition_model()
+
+        for filter in filters:
+            focal_point_key = filter.get_cache_key(image)
+            cache_key = Rendition.construct_cache_key(image.pk, filter.spec, focal_point_key)
+            lookups[cache_key] = (image, filter.spec, focal_point_key)
+
+    for cache_key, value in cache.get_many(list(lookups.keys())).items():
+        image, filter_spec, focal_point_key = lookups[cache_key]
+        Rendition = image.get_rendition_model()
+
+        add_prefetched_rendition(
+            image, Rendition.from_cache_value(image, filter_spec, focal_point_key, value)
+        )
+
+
+def add_prefetched_rendition(image, rendition):
+    if not hasattr(image, '_prefetched_renditions'):
+        image._prefetched_renditions = {}
+
+    image._prefetched_renditions[(rendition.filter_spec, rendition.focal_point_key)] = rendition
+
+
+def prefetch_renditions(images, *filters):
+    """
+    Look up the renditions of all the given images for all the given filters
+    (Filter objects or filter spec strings) and attach them to the images, so
+    that subsequent get_rendition calls for them don't make any queries.
+
+    Renditions are looked up in the rendition cache first; the remaining ones
+    are fetched with a single query per rendition model. Renditions that don't
+    exist yet are left for get_rendition to generate.
+    """
+    filters = [Filter(spec=filter) if isinstance(filter, string_types) else filter for filter in filters]
+    if not images or not filters:
+        return
+
+    prefetch_renditions_from_cache(images, *filters)
+
+    # Find the renditions that weren't in the cache, grouped by rendition model
+    missing = {}
+    for image in images:
+        prefetched_renditions = getattr(image, '_prefetched_renditions', {})
+
+        for filter in filters:
+            focal_point_key = filter.get_cache_key(image)
+            if (filter.spec, focal_point_key) not in prefetched_renditions:
+                lookups = missing.setdefault(image.get_rendition_model(), {})
+                lookups.setdefault((image.pk, filter.spec, focal_point_key), []).append(image)
+
+    for Rendition, lookups in missing.items():
+        renditions = Rendition.objects.filter(
+            image_id__in=set(image_id for image_id, filter_spec, focal_point_key in lookups),
+            filter_spec__in=set(filter_spec for image_id, filter_spec, focal_point_key in lookups),
+        )
+
+        for rendition in renditions:
+            key = (rendition.image_id, rendition.filter_spec, rendition.focal_point_key)
+            if key not in lookups:
+                # A rendition for an outdated focal point
+                continue
+
+            for image in lookups[key]:
+                rendition.image = image
+                add_prefetched_rendition(image, rendition)
+
+            rendition.add_to_cache()
+
+
 class Image(AbstractImage):
     admin_form_fields = (
         'title',
@@ -364,6 +627,23 @@ class Filter(object):
             operations.append(op_class(*op_spec_parts))
         return operations
 
+    @cached_property
+    def resize_operation(self):
+        """
+        If this filter does nothing to the image but resize it, return the
+        operation that resizes it. The output of such filters can be derived
+        from any larger version of the image.
+        """
+        resize_operations = [operation for operation in self.operations if hasattr(operation, 'get_resize_size')]
+        other_operations = [
+            operation for operation in self.operations
+            if not hasattr(operation, 'get_resize_size') and
+            not isinstance(operation, (DoNothingOperation, FormatOperation, JPEGQualityOperation))
+        ]
+
+        if len(resize_operations) == 1 and not other_operations:
+            return resize_operations[0]
+
     def run(self, image, output):
         with image.get_willow_image() as willow:
             original_format = willow.format_name
@@ -371,42 +651,49 @@ class Filter(object):
             # Fix orientation of image
             willow = willow.auto_orient()
 
-            env = {
-                'original-format': original_format,
-            }
-            for operation in self.operations:
-                willow = operation.run(willow, image, env) or willow
+            return self.process(willow, image, output, original_format)
+
+    def process(self, willow, image, output, original_format):
+        """
+        Run the operations on `willow`, an already opened and oriented copy of
+        image, and save the result to output
+        """
+        env = {
+            'original-format': original_format,
+        }
+        for operation in self.operations:
+            willow = operation.run(willow, image, env) or willow
 
-            # Find the output format to use
-            if 'output-format' in env:
-                # Developer specified an output format
-                output_format = env['output-format']
+        # Find the output format to use
+        if 'output-format' in env:
+            # Developer specified an output format
+            output_format = env['output-format']
+        else:
+            # Default to outputting in original format
+            output_format = original_format
+
+            # Convert BMP files to PNG
+            if original_format == 'bmp':
+                output_format = 'png'
+
+            # Convert unanimated GIFs to PNG as well
+            if original_format == 'gif' and not willow.has_animation():
+                output_format = 'png'
+
+        if output_format == 'jpeg':
+            # Allow changing of JPEG compression quality
+            if 'jpeg-quality' in env:
+                quality = env['jpeg-quality']
+            elif hasattr(settings, 'TUIUIUIMAGES_JPEG_QUALITY'):
+                quality = settings.TUIUIUIMAGES_JPEG_QUALITY
             else:
-                # Default to outputting in original format
-                output_format = original_format
-
-                # Convert BMP files to PNG
-                if original_format == 'bmp':
-                    output_format = 'png'
-
-                # Convert unanimated GIFs to PNG as well
-                if original_format == 'gif' and not willow.has_animation():
-                    output_format = 'png'
-
-            if output_format == 'jpeg':
-                # Allow changing of JPEG compression quality
-                if 'jpeg-quality' in env:
-                    quality = env['jpeg-quality']
-                elif hasattr(settings, 'TUIUIUIMAGES_JPEG_QUALITY'):
-                    quality = settings.TUIUIUIMAGES_JPEG_QUALITY
-                else:
-                    quality = 85
+                quality = 85
 
-                return willow.save_as_jpeg(output, quality=quality, progressive=True, optimize=True)
-            elif output_format == 'png':
-                return willow.save_as_png(output)
-            elif output_format == 'gif':
-                return willow.save_as_gif(output)
+            return willow.save_as_jpeg(output, quality=quality, progressive=True, optimize=True)
+        elif output_format == 'png':
+            return willow.save_as_png(output)
+        elif output_format == 'gif':
+            return willow.save_as_gif(output)
 
     def get_cache_key(self, image):
         vary_parts = []
@@ -422,7 +709,16 @@ class Filter(object):
         if not vary_string:
             return ''
 
-        return hashlib.sha1(vary_string.encode('utf-8')).hexdigest()[:8]
+        # Images sharing a focal point (or a filter used repeatedly on one image)
+        # don't need to be hashed again
+        if vary_string not in self._cache_keys:
+            self._cache_keys[vary_string] = hashlib.sha1(vary_string.encode('utf-8')).hexdigest()[:8]
+
+        return self._cache_keys[vary_string]
+
+    @cached_property
+    def _cache_keys(self):
+        return {}
 
     _registered_operations = None
 
@@ -486,6 +782,63 @@ class AbstractRendition(models.Model):
         filename = self.file.field.storage.get_valid_name(filename)
         return os.path.join(folder_name, filename)
 
+    @classmethod
+    def construct_cache_key(cls, image_id, filter_spec, focal_point_key):
+        return 'tuiuiuimages-rendition-{0}-{1}-{2}-{3}'.format(
+            cls._meta.label_lower,
+            image_id,
+            hashlib.sha1(filter_spec.encode('utf-8')).hexdigest(),
+            focal_point_key,
+        )
+
+    @property
+    def cache_key(self):
+        return self.construct_cache_key(self.image_id, self.filter_spec, self.focal_point_key)
+
+    def get_cache_value(self):
+        """
+        Return what is stored in the rendition cache for this rendition: enough
+        to build an <img> tag without touching the database or the file
+        """
+        return (self.pk, self.file.name, self.width, self.height)
+
+    @classmethod
+    def from_cache_value(cls, image, filter_spec, focal_point_key, value):
+        pk, file_name, width, height = value
+
+        rendition = cls(
+            pk=pk, image=image, filter_spec=filter_spec, focal_point_key=focal_point_key,
+            file=file_name, width=width, height=height
+        )
+        rendition._state.adding = False
+        return rendition
+
+    @classmethod
+    def get_from_cache(cls, image, filter_spec, focal_point_key):
+        """
+        Return the rendition of image for the given filter spec from the rendition
+        cache, or None if it isn't cached (or there's no rendition cache)
+        """
+        cache = get_rendition_cache()
+        if cache is None:
+            return None
+
+        value = cache.get(cls.construct_cache_key(image.pk, filter_spec, focal_point_key))
+        if value is None:
+            return None
+
+        return cls.from_cache_value(image, filter_spec, focal_point_key, value)
+
+    def add_to_cache(self):
+        cache = get_rendition_cache()
+        if cache is not None:
+            cache.set(self.cache_key, self.get_cache_value())
+
+    def remove_from_cache(self):
+        cache = get_rendition_cache()
+        if cache is not None:
+            cache.delete(self.cache_key)
+
     @classmethod
     def check(cls, **kwargs):
         errors = super(AbstractRendition, cls).check(**kwargs)
@@ -510,6 +863,47 @@ class AbstractRendition(models.Model):
         abstract = True
 
 
+class PendingRendition(object):
+    """
+    Stands in for a rendition that is being generated in the background. It
+    can be output like a rendition, but its dimensions are not known yet.
+    """
+    width = None
+    height = None
+
+    def __init__(self, image, filter_spec, focal_point_key, url):
+        self.image = image
+        self.filter_spec = filter_spec
+        self.focal_point_key = focal_point_key
+        self.url = url
+
+    @property
+    def alt(self):
+        return self.image.title
+
+    @property
+    def attrs(self):
+        return flatatt(self.attrs_dict)
+
+    @property
+    def attrs_dict(self):
+        # flatatt leaves out the unknown width and height
+        return OrderedDict([
+            ('src', self.url),
+            ('width', self.width),
+            ('height', self.height),
+            ('alt', self.alt),
+        ])
+
+    def img_tag(self, extra_attributes={}):
+        attrs = self.attrs_dict.copy()
+        attrs.update(extra_attributes)
+        return mark_safe('<img{}>'.format(flatatt(attrs)))
+
+    def __html__(self):
+        return self.img_tag()
+
+
 class Rendition(AbstractRendition):
     image = models.ForeignKey(Image, related_name='renditions', on_delete=models.CASCADE)
 
@@ -0,0 +1,156 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import NoReverseMatch, reverse
+from django.db import connection
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger('tuiuiu.images')
+
+
+class BaseRenditionQueue(object):
+    """
+    Generates missing renditions outside of the request that asked for them.
+
+    Subclasses implement `submit`, which must arrange for
+    `generate_renditions(image_id, filter_specs, keys)` to be called at some
+    point, e.g. in a thread, another process or a task queue.
+    """
+    def __init__(self, params):
+        self.placeholder_url = params.get('PLACEHOLDER_URL')
+        self.serve_view_name = params.get('SERVE_VIEW', 'tuiuiuimages_serve')
+
+        # How long another process's claim on a rendition is honoured for
+        self.lock_timeout = params.get('LOCK_TIMEOUT', 300)
+
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+    def get_placeholder_url(self, image, filter):
+        """
+        Return the URL to use for a rendition until it has been generated: the
+        PLACEHOLDER_URL if one is set, otherwise the URL of a ServeView which
+        generates the rendition on demand. Returns None if neither is available,
+        in which case the rendition is generated immediately.
+        """
+        if self.placeholder_url:
+            return self.placeholder_url
+
+        from tuiuiu.tuiuiuimages.views.serve import generate_signature
+
+        signature = generate_signature(image.id, filter.spec)
+        try:
+            url = reverse(self.serve_view_name, args=(signature, image.id, filter.spec))
+        except NoReverseMatch:
+            return None
+
+        return url + image.filename
+
+    def _get_lock_cache_key(self, key):
+        return 'tuiuiuimages-rendition-pending-' + key
+
+    def enqueue(self, image, filters):
+        """
+        Queue the generation of the renditions of `image` for the given list of
+        filters, except for those that are already being generated.
+        """
+        Rendition = image.get_rendition_model()
+
+        filter_specs = []
+        keys = []
+        for filter in filters:
+            key = Rendition.construct_cache_key(image.pk, filter.spec, filter.get_cache_key(image))
+
+            with self._pending_lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+
+            # Claim the rendition so that other processes don't generate it too
+            if not cache.add(self._get_lock_cache_key(key), True, self.lock_timeout):
+                with self._pending_lock:
+                    self._pending.discard(key)
+                continue
+
+            filter_specs.append(filter.spec)
+            keys.append(key)
+
+        if filter_specs:
+            self.submit(image.id, filter_specs, keys)
+
+        return filter_specs
+
+    def submit(self, image_id, filter_specs, keys):
+        raise NotImplementedError
+
+    def generate_renditions(self, image_id, filter_specs, keys):
+        from tuiuiu.tuiuiuimages import get_image_model
+
+        try:
+            image = get_image_model().objects.get(id=image_id)
+            image.get_renditions(*filter_specs, defer=False)
+        except Exception:
+            logger.exception("Failed to generate renditions %s of image %s", ', '.join(filter_specs), image_id)
+        finally:
+            cache.delete_many([self._get_lock_cache_key(key) for key in keys])
+            with self._pending_lock:
+                self._pending.difference_update(keys)
+
+
+class ThreadPoolRenditionQueue(BaseRenditionQueue):
+    """
+    Generates renditions in a pool of WORKERS threads in the current process.
+    """
+    def __init__(self, params):
+        super(ThreadPoolRenditionQueue, self).__init__(params)
+        self.workers = params.get('WORKERS', 2)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+
+            return self._pool
+
+    def submit(self, image_id, filter_specs, keys):
+        self.get_pool().apply_async(self.generate_renditions, (image_id, filter_specs, keys))
+
+    def generate_renditions(self, image_id, filter_specs, keys):
+        try:
+            super(ThreadPoolRenditionQueue, self).generate_renditions(image_id, filter_specs, keys)
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+
+
+_queue = None
+_queue_params = None
+_queue_lock = threading.Lock()
+
+
+def get_rendition_queue():
+    """
+    Return the rendition queue configured by TUIUIUIMAGES_RENDITION_QUEUE, or
+    None if renditions are generated synchronously (the default)
+    """
+    global _queue, _queue_params
+
+    params = getattr(settings, 'TUIUIUIMAGES_RENDITION_QUEUE', None)
+    if not params:
+        return None
+
+    with _queue_lock:
+        if _queue is None or _queue_params != params:
+            backend = params.get('BACKEND', 'tuiuiu.tuiuiuimages.rendition_queue.ThreadPoolRenditionQueue')
+            _queue = import_string(backend)(params)
+            _queue_params = params
+
+        return _queue
@@ -1,7 +1,24 @@
 from __future__ import absolute_import, unicode_literals
 
+from django.utils.six import text_type
+
+from tuiuiu.tuiuiucore.cache_tags import get_cache_tag
+from tuiuiu.tuiuiucore.utils import bump_cache_version_on_commit
 from tuiuiu.tuiuiuimages import get_image_model
 from tuiuiu.tuiuiuimages.formats import get_image_format
+from tuiuiu.tuiuiuimages.models import prefetch_renditions
+
+
+def get_image_embed_version_cache_key(image_id):
+    return 'tuiuiuimages_embed_version_%s' % image_id
+
+
+def bump_image_embed_version(image_id):
+    """
+    Invalidate the cached rich text that embeds the given image once the
+    current transaction is committed
+    """
+    bump_cache_version_on_commit(get_image_embed_version_cache_key(image_id))
 
 
 class ImageEmbedHandler(object):
@@ -24,21 +41,54 @@ class ImageEmbedHandler(object):
             'alt': tag['data-alt'],
         }
 
+    @staticmethod
+    def get_cache_version_keys(attrs):
+        return [get_image_embed_version_cache_key(attrs['id'])]
+
+    @staticmethod
+    def get_cache_tags(attrs):
+        return [get_cache_tag(get_image_model(), attrs['id'])]
+
     @staticmethod
     def expand_db_attributes(attrs, for_editor):
         """
         Given a dict of attributes from the <embed> tag, return the real HTML
         representation.
         """
+        return ImageEmbedHandler.expand_db_attributes_many([attrs], for_editor)[0]
+
+    @staticmethod
+    def expand_db_attributes_many(attrs_list, for_editor):
+        """
+        Given a list of attribute dicts from <embed> tags, return the HTML
+        representation of each, fetching the images and their renditions in bulk.
+        """
         Image = get_image_model()
-        try:
-            image = Image.objects.get(id=attrs['id'])
-        except Image.DoesNotExist:
-            return "<img>"
+        images = Image.objects.in_bulk(set(attrs['id'] for attrs in attrs_list))
+        images = {text_type(pk): image for pk, image in images.items()}
+
+        # Fetch the existing renditions of each format in one go
+        images_by_format = {}
+        for attrs in attrs_list:
+            image = images.get(text_type(attrs['id']))
+            if image is not None:
+                images_by_format.setdefault(attrs['format'], set()).add(image)
+
+        for format_name, format_images in images_by_format.items():
+            prefetch_renditions(format_images, get_image_format(format_name).filter_spec)
+
+        results = []
+        for attrs in attrs_list:
+            image = images.get(text_type(attrs['id']))
+            if image is None:
+                results.append("<img>")
+                continue
+
+            image_format = get_image_format(attrs['format'])
 
-        image_format = get_image_format(attrs['format'])
+            if for_editor:
+                results.append(image_format.image_to_editor_html(image, attrs['alt']))
+            else:
+                results.append(image_format.image_to_html(image, attrs['alt']))
 
-        if for_editor:
-            return image_format.image_to_editor_html(image, attrs['alt'])
-        else:
-            return image_format.image_to_html(image, attrs['alt'])
+        return results
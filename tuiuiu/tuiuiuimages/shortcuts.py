@@ -22,3 +22,49 @@ def get_rendition_or_not_found(image, specs):
         rendition = Rendition(image=image, width=0, height=0)
         rendition.file.name = 'not-found'
         return rendition
+
+
+def get_renditions_or_not_found(image, specs):
+    """
+    Like get_rendition_or_not_found, but for a list of filter specs, which are
+    looked up and generated together with image.get_renditions.
+
+    :param image: AbstractImage
+    :param specs: list of str or Filter
+    :return: list of Rendition, in the same order as specs
+    """
+    try:
+        renditions = image.get_renditions(*specs)
+    except SourceImageIOError:
+        rendition = get_rendition_or_not_found(image, specs[0])
+        return [rendition] * len(specs)
+
+    return [renditions[getattr(spec, 'spec', spec)] for spec in specs]
+
+
+def srcset_img_tag(image, specs, extra_attributes={}):
+    """
+    Return an <img> tag for image with a srcset listing the renditions for all
+    the given filter specs. The first one provides the src, width and height.
+
+    :param image: AbstractImage
+    :param specs: list of str or Filter
+    :param extra_attributes: dict of additional attributes for the tag
+    :return: str
+    """
+    renditions = get_renditions_or_not_found(image, specs)
+
+    srcset = []
+    widths = set()
+    for rendition in renditions:
+        # Leave out renditions that aren't ready yet, and those that came out the same size
+        if rendition.width and rendition.width not in widths:
+            widths.add(rendition.width)
+            srcset.append('{} {}w'.format(rendition.url, rendition.width))
+
+    attrs = {}
+    if srcset:
+        attrs['srcset'] = ', '.join(srcset)
+    attrs.update(extra_attributes)
+
+    return renditions[0].img_tag(attrs)
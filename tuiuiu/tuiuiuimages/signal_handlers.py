@@ -1,9 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 
 from django.conf import settings
-from django.db.models.signals import post_delete, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 
+from tuiuiu.tuiuiucore.rich_text import clear_expansion_cache
 from tuiuiu.tuiuiuimages import get_image_model
+from tuiuiu.tuiuiuimages.rich_text import bump_image_embed_version
 
 
 def post_delete_file_cleanup(instance, **kwargs):
@@ -11,6 +13,21 @@ def post_delete_file_cleanup(instance, **kwargs):
     instance.file.delete(False)
 
 
+def post_delete_rendition_cache_cleanup(instance, **kwargs):
+    instance.remove_from_cache()
+
+
+# Invalidate cached rich text that embeds an image whenever the image, or the
+# renditions used for it, might have changed. (A new rendition replaces any
+# placeholder URL.)
+def image_embed_changed_signal_handler(instance, **kwargs):
+    bump_image_embed_version(instance.pk)
+
+
+def rendition_embed_changed_signal_handler(instance, **kwargs):
+    bump_image_embed_version(instance.image_id)
+
+
 def pre_save_image_feature_detection(instance, **kwargs):
     if getattr(settings, 'TUIUIUIMAGES_FEATURE_DETECTION_ENABLED', False):
         # Make sure the image doesn't already have a focal point
@@ -26,3 +43,11 @@ def register_signal_handlers():
     pre_save.connect(pre_save_image_feature_detection, sender=Image)
     post_delete.connect(post_delete_file_cleanup, sender=Image)
     post_delete.connect(post_delete_file_cleanup, sender=Rendition)
+    post_delete.connect(post_delete_rendition_cache_cleanup, sender=Rendition)
+    post_save.connect(image_embed_changed_signal_handler, sender=Image)
+    post_delete.connect(image_embed_changed_signal_handler, sender=Image)
+    post_save.connect(rendition_embed_changed_signal_handler, sender=Rendition)
+
+    for model in [Image, Rendition]:
+        post_save.connect(clear_expansion_cache, sender=model)
+        post_delete.connect(clear_expansion_cache, sender=model)
@@ -6,7 +6,7 @@ from django import template
 from django.utils.functional import cached_property
 
 from tuiuiu.tuiuiuimages.models import Filter
-from tuiuiu.tuiuiuimages.shortcuts import get_rendition_or_not_found
+from tuiuiu.tuiuiuimages.shortcuts import get_rendition_or_not_found, srcset_img_tag
 
 register = template.Library()
 allowed_filter_pattern = re.compile("^[A-Za-z0-9_\-\.]+$")
@@ -97,3 +97,62 @@ class ImageNode(template.Node):
             for key in self.attrs:
                 resolved_attrs[key] = self.attrs[key].resolve(context)
             return rendition.img_tag(resolved_attrs)
+
+
+@register.tag(name="srcset")
+def srcset(parser, token):
+    bits = token.split_contents()[1:]
+    if not bits:
+        raise template.TemplateSyntaxError("'srcset' tag requires an image")
+
+    image_expr = parser.compile_filter(bits[0])
+
+    filter_specs = []
+    attrs = {}
+
+    for bit in bits[1:]:
+        try:
+            name, value = bit.split('=')
+            attrs[name] = parser.compile_filter(value)
+        except ValueError:
+            if allowed_filter_pattern.match(bit):
+                filter_specs.append(bit)
+            else:
+                raise template.TemplateSyntaxError(
+                    "filter specs in 'srcset' tag may only contain A-Z, a-z, 0-9, dots, hyphens and underscores. "
+                    "(given filter: {})".format(bit)
+                )
+
+    if not filter_specs:
+        raise template.TemplateSyntaxError(
+            "'srcset' tag should be of the form "
+            "{% srcset self.photo width-400 width-800 [ custom-attr=\"value\" ... ] %}"
+        )
+
+    return SrcsetNode(image_expr, filter_specs, attrs=attrs)
+
+
+class SrcsetNode(template.Node):
+    def __init__(self, image_expr, filter_specs, attrs={}):
+        self.image_expr = image_expr
+        self.attrs = attrs
+        self.filter_specs = filter_specs
+
+    @cached_property
+    def filters(self):
+        return [Filter(spec=filter_spec) for filter_spec in self.filter_specs]
+
+    def render(self, context):
+        try:
+            image = self.image_expr.resolve(context)
+        except template.VariableDoesNotExist:
+            return ''
+
+        if not image:
+            return ''
+
+        resolved_attrs = {}
+        for key in self.attrs:
+            resolved_attrs[key] = self.attrs[key].resolve(context)
+
+        return srcset_img_tag(image, self.filters, resolved_attrs)
@@ -2,6 +2,7 @@ from __future__ import absolute_import, unicode_literals
 
 import json
 
+import mock
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group, Permission
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -12,6 +13,7 @@ from django.utils.http import urlquote
 
 from tuiuiu.tests.utils import TuiuiuTestUtils
 from tuiuiu.tuiuiucore.models import Collection, GroupCollectionPermission
+from tuiuiu.tuiuiuimages import rendition_queue
 from tuiuiu.tuiuiuimages.views.serve import generate_signature
 
 from .utils import Image, get_test_image_file
@@ -538,6 +540,24 @@ class TestImageChooserSelectFormatView(TestCase, TuiuiuTestUtils):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'value=\\"some previous alt text\\"')
 
+    @override_settings(TUIUIUIMAGES_RENDITION_QUEUE={
+        'BACKEND': 'tuiuiu.tuiuiuimages.tests.test_models.RecordingRenditionQueue',
+        'PLACEHOLDER_URL': '/static/placeholder.png',
+    })
+    def test_preview_not_deferred(self):
+        rendition_queue._queue = None
+        self.addCleanup(setattr, rendition_queue, '_queue', None)
+
+        response = self.client.post(
+            reverse('tuiuiuimages:chooser_select_format', args=(self.image.id,)),
+            {'format': 'left', 'alt_text': "Arthur"}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # The editor needs the size of the preview, so it is generated straight away
+        self.assertContains(response, '"width": 500, "height": 375}')
+        self.assertNotContains(response, 'placeholder.png')
+
 
 class TestImageChooserUploadView(TestCase, TuiuiuTestUtils):
     def setUp(self):
@@ -746,6 +766,32 @@ class TestMultipleImageUploader(TestCase, TuiuiuTestUtils):
         self.assertEqual(response_json['image_id'], response.context['image'].id)
         self.assertTrue(response_json['success'])
 
+    @override_settings(
+        TUIUIUIMAGES_EAGER_RENDITIONS=['width-400', 'width-200'],
+        TUIUIUIMAGES_RENDITION_QUEUE={
+            'BACKEND': 'tuiuiu.tuiuiuimages.tests.test_models.RecordingRenditionQueue',
+        },
+    )
+    def test_add_post_queues_eager_renditions(self):
+        rendition_queue._queue = None
+        self.addCleanup(setattr, rendition_queue, '_queue', None)
+
+        # Run the on_commit callback straight away, as the test transaction is never committed
+        with mock.patch('tuiuiu.tuiuiuimages.models.on_commit', lambda func: func()):
+            response = self.client.post(reverse('tuiuiuimages:add_multiple'), {
+                'files[]': SimpleUploadedFile('test.png', get_test_image_file().file.getvalue()),
+            }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        # Nothing is generated during the upload
+        image = response.context['image']
+        self.assertFalse(image.renditions.exists())
+
+        rendition_queue.get_rendition_queue().run_jobs()
+        self.assertEqual(
+            set(image.renditions.values_list('filter_spec', flat=True)),
+            {'width-400', 'width-200'}
+        )
+
     def test_add_post_noajax(self):
         """
         This tests that only AJAX requests are allowed to POST to the add view
@@ -55,3 +55,16 @@ class TestImageChooserBlock(TestCase):
         expected_html = '<img alt="missing image" src="/media/not-found" width="0" height="0">'
 
         self.assertHTMLEqual(html, expected_html)
+
+    def test_bulk_to_python_prefetches_renditions(self):
+        rendition = self.image.get_rendition('width-400')
+        block = ImageChooserBlock(prefetch_renditions=['width-400'])
+
+        # One query for the images, one for the renditions
+        with self.assertNumQueries(2):
+            images = block.bulk_to_python([self.image.id, None])
+
+        self.assertIsNone(images[1])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(images[0].get_rendition('width-400'), rendition)
@@ -414,6 +414,16 @@ class TestFilter(TestCase):
 
         self.assertEqual(run_mock.call_count, 2)
 
+    def test_resize_operation(self):
+        self.assertIsInstance(Filter(spec='width-400').resize_operation, image_operations.WidthHeightOperation)
+        self.assertIsInstance(
+            Filter(spec='max-400x400|format-jpeg|jpegquality-40').resize_operation,
+            image_operations.MinMaxOperation
+        )
+        self.assertIsNone(Filter(spec='fill-400x400').resize_operation)
+        self.assertIsNone(Filter(spec='width-400|height-200').resize_operation)
+        self.assertIsNone(Filter(spec='original').resize_operation)
+
 
 @hooks.register('register_image_operations')
 def register_image_operations():
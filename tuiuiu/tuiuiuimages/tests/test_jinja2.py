@@ -75,6 +75,14 @@ class TestImagesJinja(TestCase):
         output = ('width: 200, url: ' + self.get_image_filename(self.image, "width-200"))
         self.assertHTMLEqual(self.render(template, {'myimage': self.image}), output)
 
+    def test_srcset(self):
+        self.assertHTMLEqual(
+            self.render('{{ srcset(myimage, "width-200", "width-400", sizes="50vw") }}', {'myimage': self.image}),
+            '<img alt="Test image" src="{0}" width="200" height="150" sizes="50vw" '
+            'srcset="{0} 200w, {1} 400w">'.format(
+                self.get_image_filename(self.image, "width-200"),
+                self.get_image_filename(self.image, "width-400")))
+
     def test_missing_image(self):
         self.assertHTMLEqual(
             self.render('{{ image(myimage, "width-200") }}', {'myimage': self.bad_image}),
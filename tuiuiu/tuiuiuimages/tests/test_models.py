@@ -9,13 +9,19 @@ from django.core.urlresolvers import reverse
 from django.db.utils import IntegrityError
 from django.test import TestCase
 from django.test.utils import override_settings
+from mock import patch
 from willow.image import Image as WillowImage
 
 from tuiuiu.tests.testapp.models import EventPage, EventPageCarouselItem
 from tuiuiu.tests.utils import TuiuiuTestUtils
 from tuiuiu.tuiuiucore.models import Collection, GroupCollectionPermission, Page
-from tuiuiu.tuiuiuimages.models import Rendition, SourceImageIOError
+from tuiuiu.tuiuiuimages import rendition_queue
+from tuiuiu.tuiuiuimages.formats import Format
+from tuiuiu.tuiuiuimages.models import (
+    PendingRendition, Rendition, SourceImageIOError, get_rendition_cache,
+    prefetch_renditions_from_cache)
 from tuiuiu.tuiuiuimages.rect import Rect
+from tuiuiu.tuiuiuimages.rendition_queue import BaseRenditionQueue
 
 from .utils import Image, get_test_image_file
 
@@ -147,6 +153,58 @@ class TestImageQuerySet(TestCase):
             }
             self.assertTrue('aardvark' in results['Test image 0'])
 
+    def test_prefetch_renditions(self):
+        for i in range(0, 5):
+            image = Image.objects.create(
+                title="Test image %d" % i,
+                file=get_test_image_file(),
+            )
+            image.get_rendition('max-165x165')
+
+        # One query for the images, one for the renditions
+        with self.assertNumQueries(2):
+            images = list(Image.objects.order_by('id').prefetch_renditions('max-165x165'))
+
+            for image in images:
+                rendition = image.get_rendition('max-165x165')
+                self.assertEqual(rendition.image, image)
+                self.assertEqual(rendition.width, 165)
+
+    def test_prefetch_renditions_survives_filtering(self):
+        image = Image.objects.create(
+            title="Test image",
+            file=get_test_image_file(),
+        )
+        rendition = image.get_rendition('width-400')
+
+        images = Image.objects.prefetch_renditions('width-400').filter(title="Test image")
+
+        with self.assertNumQueries(2):
+            self.assertEqual(images[0].get_rendition('width-400'), rendition)
+
+    def test_prefetch_renditions_with_search(self):
+        image = Image.objects.create(
+            title="Test image",
+            file=get_test_image_file(),
+        )
+        rendition = image.get_rendition('width-400')
+
+        results = list(Image.objects.prefetch_renditions('width-400').search("Test"))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(results[0].get_rendition('width-400'), rendition)
+
+    def test_prefetch_renditions_generates_missing_renditions(self):
+        Image.objects.create(
+            title="Test image",
+            file=get_test_image_file(),
+        )
+
+        image = Image.objects.prefetch_renditions('width-400').get()
+
+        self.assertEqual(image.get_rendition('width-400').width, 400)
+        self.assertEqual(image.renditions.count(), 1)
+
 
 class TestImagePermissions(TestCase):
     def setUp(self):
@@ -244,6 +302,213 @@ class TestRenditions(TestCase):
         rendition = self.image.get_rendition('width-400')
         self.assertEqual(rendition.alt, "Test image")
 
+    def test_get_renditions(self):
+        existing_rendition = self.image.get_rendition('width-400')
+
+        with patch.object(Image, 'get_willow_image', wraps=self.image.get_willow_image) as get_willow_image:
+            renditions = self.image.get_renditions('width-400', 'fill-100x100', 'width-200', 'max-300x300')
+
+        # The image is only opened once, to generate the missing renditions
+        self.assertEqual(get_willow_image.call_count, 1)
+
+        self.assertEqual(renditions['width-400'], existing_rendition)
+        self.assertEqual(
+            [(renditions[spec].width, renditions[spec].height) for spec in ['fill-100x100', 'width-200', 'max-300x300']],
+            [(100, 100), (200, 150), (300, 225)]
+        )
+        self.assertEqual(self.image.renditions.count(), 4)
+
+        # The same renditions are returned by get_rendition afterwards
+        self.assertEqual(self.image.get_rendition('width-200'), renditions['width-200'])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'renditions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'renditions'},
+})
+class TestRenditionCache(TestCase):
+    def setUp(self):
+        get_rendition_cache().clear()
+
+        self.image = Image.objects.create(
+            title="Test image",
+            file=get_test_image_file(),
+        )
+
+    def test_get_rendition_from_cache(self):
+        rendition = self.image.get_rendition('width-400')
+
+        with self.assertNumQueries(0):
+            cached_rendition = self.image.get_rendition('width-400')
+
+        self.assertEqual(cached_rendition, rendition)
+        self.assertEqual(cached_rendition.url, rendition.url)
+        self.assertEqual(cached_rendition.width, 400)
+        self.assertEqual(cached_rendition.height, 300)
+        self.assertEqual(cached_rendition.alt, "Test image")
+        self.assertEqual(cached_rendition.img_tag(), rendition.img_tag())
+
+    def test_existing_rendition_is_cached(self):
+        rendition = self.image.get_rendition('width-400')
+        get_rendition_cache().clear()
+
+        # The rendition is fetched from the database once, then cached
+        with self.assertNumQueries(1):
+            self.image.get_rendition('width-400')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.image.get_rendition('width-400'), rendition)
+
+    def test_cache_varies_on_focal_point(self):
+        rendition = self.image.get_rendition('fill-100x100')
+
+        self.image.focal_point_x = 100
+        self.image.focal_point_y = 100
+        self.image.focal_point_width = 20
+        self.image.focal_point_height = 20
+        self.image.save()
+
+        self.assertNotEqual(self.image.get_rendition('fill-100x100'), rendition)
+
+    def test_deleted_rendition_is_removed_from_cache(self):
+        rendition = self.image.get_rendition('width-400')
+
+        self.image.renditions.all().delete()
+
+        self.assertIsNone(Rendition.get_from_cache(self.image, 'width-400', ''))
+        self.assertNotEqual(self.image.get_rendition('width-400'), rendition)
+
+    def test_prefetch_renditions_from_cache(self):
+        other_image = Image.objects.create(
+            title="Other image",
+            file=get_test_image_file(),
+        )
+        renditions = [
+            self.image.get_rendition('width-400'),
+            self.image.get_rendition('fill-100x100'),
+            other_image.get_rendition('width-400'),
+        ]
+
+        images = list(Image.objects.filter(id__in=[self.image.id, other_image.id]).order_by('id'))
+        prefetch_renditions_from_cache(images, 'width-400', 'fill-100x100')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(images[0].get_rendition('width-400'), renditions[0])
+            self.assertEqual(images[0].get_rendition('fill-100x100'), renditions[1])
+            self.assertEqual(images[1].get_rendition('width-400'), renditions[2])
+
+        # Renditions that didn't exist yet are still generated
+        self.assertEqual(images[1].get_rendition('fill-100x100').width, 100)
+
+
+class RecordingRenditionQueue(BaseRenditionQueue):
+    def __init__(self, params):
+        super(RecordingRenditionQueue, self).__init__(params)
+        self.jobs = []
+
+    def submit(self, image_id, filter_specs, keys):
+        self.jobs.append((image_id, filter_specs, keys))
+
+    def run_jobs(self):
+        while self.jobs:
+            self.generate_renditions(*self.jobs.pop(0))
+
+
+@override_settings(TUIUIUIMAGES_RENDITION_QUEUE={
+    'BACKEND': 'tuiuiu.tuiuiuimages.tests.test_models.RecordingRenditionQueue',
+    'PLACEHOLDER_URL': '/static/placeholder.png',
+})
+class TestRenditionQueue(TestCase):
+    def setUp(self):
+        rendition_queue._queue = None
+
+        self.image = Image.objects.create(
+            title="Test image",
+            file=get_test_image_file(),
+        )
+
+    def test_missing_rendition_is_queued(self):
+        rendition = self.image.get_rendition('width-400')
+
+        self.assertIsInstance(rendition, PendingRendition)
+        self.assertEqual(rendition.url, '/static/placeholder.png')
+        self.assertHTMLEqual(rendition.img_tag(), '<img alt="Test image" src="/static/placeholder.png">')
+        self.assertFalse(self.image.renditions.exists())
+
+        rendition_queue.get_rendition_queue().run_jobs()
+
+        rendition = self.image.get_rendition('width-400')
+        self.assertIsInstance(rendition, Rendition)
+        self.assertEqual(rendition.width, 400)
+
+    def test_pending_rendition_in_rich_text(self):
+        format = Format('test', 'test', 'test', 'width-400')
+
+        self.assertHTMLEqual(
+            format.image_to_html(self.image, 'Test image'),
+            '<img class="test" src="/static/placeholder.png" alt="Test image">'
+        )
+
+    def test_rendition_is_queued_once(self):
+        self.image.get_rendition('width-400')
+        self.image.get_rendition('width-400')
+        self.image.get_rendition('width-200')
+
+        self.assertEqual(len(rendition_queue.get_rendition_queue().jobs), 2)
+
+    def test_existing_rendition_is_not_queued(self):
+        self.image.get_rendition('width-400', defer=False)
+
+        self.assertIsInstance(self.image.get_rendition('width-400'), Rendition)
+        self.assertEqual(rendition_queue.get_rendition_queue().jobs, [])
+
+    @override_settings(TUIUIUIMAGES_EAGER_RENDITIONS=['width-400', 'width-200'])
+    def test_eager_renditions_are_queued(self):
+        # Run the on_commit callback straight away, as the test transaction is never committed
+        with patch('tuiuiu.tuiuiuimages.models.on_commit', lambda func: func()):
+            self.image.generate_eager_renditions()
+
+        queue = rendition_queue.get_rendition_queue()
+        self.assertEqual(len(queue.jobs), 1)
+        self.assertEqual(queue.jobs[0][1], ['width-400', 'width-200'])
+
+        queue.run_jobs()
+        self.assertEqual(self.image.renditions.count(), 2)
+
+    @override_settings(TUIUIUIMAGES_EAGER_RENDITIONS=['width-400', 'width-200'], TUIUIUIMAGES_RENDITION_QUEUE=None)
+    def test_eager_renditions_need_queue(self):
+        # They would otherwise be generated during the upload request
+        with patch('tuiuiu.tuiuiuimages.models.on_commit', lambda func: func()):
+            self.image.generate_eager_renditions()
+
+        self.assertFalse(self.image.renditions.exists())
+
+    @override_settings(TUIUIUIMAGES_RENDITION_QUEUE={
+        'BACKEND': 'tuiuiu.tuiuiuimages.tests.test_models.RecordingRenditionQueue',
+        'SERVE_VIEW': 'tuiuiuimages_serve_action_serve',
+    })
+    def test_placeholder_is_serve_view(self):
+        rendition = self.image.get_rendition('width-400')
+
+        self.assertIsInstance(rendition, PendingRendition)
+        self.assertTrue(rendition.url.startswith('/testimages/actions/serve/'))
+
+        # The serve view generates the rendition straight away
+        response = self.client.get(rendition.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.image.renditions.filter(filter_spec='width-400').exists())
+
+    @override_settings(TUIUIUIMAGES_RENDITION_QUEUE={
+        'BACKEND': 'tuiuiu.tuiuiuimages.tests.test_models.RecordingRenditionQueue',
+        'SERVE_VIEW': 'nonexistent_serve_view',
+    })
+    def test_generated_immediately_without_placeholder(self):
+        # The serve view isn't set up, so there's nothing to point at
+        rendition = self.image.get_rendition('width-400')
+
+        self.assertIsInstance(rendition, Rendition)
+        self.assertEqual(rendition_queue.get_rendition_queue().jobs, [])
+
 
 class TestUsageCount(TestCase):
     fixtures = ['test.json']
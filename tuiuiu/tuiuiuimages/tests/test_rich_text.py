@@ -1,8 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 
+import mock
 from bs4 import BeautifulSoup
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
+from tuiuiu.tuiuiucore.rich_text import expand_db_html
 from tuiuiu.tuiuiuimages.rich_text import ImageEmbedHandler
 
 from .utils import Image, get_test_image_file
@@ -50,3 +53,74 @@ class TestImageEmbedHandler(TestCase):
             '<img data-embedtype="image" data-id="1" data-format="left" '
             'data-alt="test-alt" class="richtext-image left"', result
         )
+
+    def test_expand_db_attributes_many(self):
+        images = [
+            Image.objects.create(title='Test %d' % i, file=get_test_image_file())
+            for i in range(3)
+        ]
+        for image in images:
+            image.get_rendition('width-500')
+
+        attrs_list = [
+            {'id': str(image.id), 'alt': 'test-alt', 'format': 'left'}
+            for image in images
+        ] + [{'id': '0', 'alt': 'missing', 'format': 'left'}]
+
+        # One query for the images and one for their renditions
+        with self.assertNumQueries(2):
+            result = ImageEmbedHandler.expand_db_attributes_many(attrs_list, False)
+
+        self.assertEqual(len(result), 4)
+        for image, html in zip(images, result):
+            self.assertIn('<img class="richtext-image left"', html)
+            self.assertIn(image.renditions.get(filter_spec='width-500').url, html)
+        self.assertEqual(result[3], '<img>')
+
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            }
+        },
+        TUIUIU_RICH_TEXT_CACHE='default',
+    )
+    # The local memory cache stands in for a cache shared between processes
+    @mock.patch('tuiuiu.tuiuiucore.utils.cache_is_shared', lambda cache: True)
+    def test_saving_image_invalidates_rich_text_cache(self):
+        # on_commit callbacks are never run inside a TestCase, so collect them instead
+        on_commit_callbacks = []
+
+        def commit():
+            for callback in on_commit_callbacks:
+                callback()
+            on_commit_callbacks[:] = []
+
+        on_commit_patcher = mock.patch('tuiuiu.tuiuiucore.utils.on_commit', on_commit_callbacks.append)
+        on_commit_patcher.start()
+        self.addCleanup(on_commit_patcher.stop)
+
+        cache.clear()
+        image = Image.objects.create(title='Test', file=get_test_image_file())
+        html = '<embed embedtype="image" id="%d" format="left" alt="test-alt"/>' % image.id
+        commit()
+
+        # Generating the rendition invalidates the cache too
+        result = expand_db_html(html)
+        commit()
+        self.assertEqual(expand_db_html(html), result)
+
+        image.renditions.all().delete()
+        self.assertEqual(expand_db_html(html), result)
+
+        # Only saving the embedded image invalidates the cache
+        Image.objects.create(title='Other', file=get_test_image_file()).get_rendition('width-500')
+        commit()
+        self.assertEqual(expand_db_html(html), result)
+        self.assertFalse(image.renditions.exists())
+
+        # Saving the image invalidates the cache, so the rendition is generated again
+        image.save()
+        commit()
+        expand_db_html(html)
+        self.assertTrue(image.renditions.filter(filter_spec='width-500').exists())
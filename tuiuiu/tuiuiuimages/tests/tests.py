@@ -9,7 +9,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.core.urlresolvers import reverse
 from django.test import TestCase, override_settings
 from django.utils import six
-from mock import MagicMock
+from mock import MagicMock, patch
 from taggit.forms import TagField, TagWidget
 
 from tuiuiu.tests.testapp.models import CustomImage, CustomImageFilePath
@@ -124,6 +124,40 @@ class TestImageTag(TestCase):
             temp.render(context)
 
 
+class TestSrcsetTag(TestCase):
+    def setUp(self):
+        self.image = Image.objects.create(
+            title="Test image",
+            file=get_test_image_file(),
+        )
+
+    def render_srcset_tag(self, image, args):
+        temp = template.Template('{% load tuiuiuimages_tags %}{% srcset image_obj ' + args + ' %}')
+        context = template.Context({'image_obj': image})
+        return temp.render(context)
+
+    def test_srcset_tag(self):
+        result = self.render_srcset_tag(self.image, 'width-200 width-400 width-1000 sizes="50vw"')
+        renditions = self.image.get_renditions('width-200', 'width-400')
+
+        self.assertHTMLEqual(
+            result,
+            '<img alt="Test image" src="{0}" width="200" height="150" sizes="50vw" '
+            'srcset="{0} 200w, {1} 400w, {2} 640w">'.format(
+                renditions['width-200'].url,
+                renditions['width-400'].url,
+                self.image.get_rendition('width-1000').url,
+            )
+        )
+
+    def test_srcset_tag_none(self):
+        self.assertEqual(self.render_srcset_tag(None, 'width-200'), '')
+
+    def test_srcset_tag_requires_filter_specs(self):
+        with self.assertRaises(template.TemplateSyntaxError):
+            self.render_srcset_tag(self.image, 'class="photo"')
+
+
 class TestMissingImage(TestCase):
     """
     Missing image files in media/original_images should be handled gracefully, to cope with
@@ -236,6 +270,65 @@ class TestFrontendServeView(TestCase):
         self.assertTrue(response.streaming)
         self.assertEqual(response['Content-Type'], 'image/png')
 
+    def get_serve_url(self, filter_spec):
+        signature = generate_signature(self.image.id, filter_spec)
+        return reverse('tuiuiuimages_serve', args=(signature, self.image.id, filter_spec))
+
+    def test_get_caching_headers(self):
+        response = self.client.get(self.get_serve_url('fill-800x600'))
+        rendition = self.image.get_rendition('fill-800x600')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), rendition.file.size)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertTrue(response['ETag'].startswith('"'))
+
+    def test_get_if_none_match(self):
+        url = self.get_serve_url('fill-800x600')
+        etag = self.client.get(url)['ETag']
+
+        with patch('tuiuiu.tuiuiuimages.views.serve.ServeView.serve_file') as serve_file:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(serve_file.called)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_if_modified_since(self):
+        url = self.get_serve_url('fill-800x600')
+        last_modified = self.client.get(url)['Last-Modified']
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_range(self):
+        url = self.get_serve_url('fill-800x600')
+        content = b''.join(self.client.get(url).streaming_content)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, content[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/{}'.format(len(content)))
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.content, content[-5:])
+
+        response = self.client.get(url, HTTP_RANGE='bytes={}-'.format(len(content)))
+        self.assertEqual(response.status_code, 416)
+
+        # A range for an outdated version of the file is ignored
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+
     def test_get_with_extra_component(self):
         """
         Test that a filename can be optionally added to the end of the URL.
@@ -25,7 +25,7 @@ def get_image_json(image):
     helper function: given an image, return the json to pass back to the
     image chooser panel
     """
-    preview_image = image.get_rendition('max-165x165')
+    preview_image = image.get_rendition('max-165x165', defer=False)
 
     return json.dumps({
         'id': image.id,
@@ -48,7 +48,7 @@ def chooser(request):
     else:
         uploadform = None
 
-    images = Image.objects.order_by('-created_at')
+    images = Image.objects.order_by('-created_at').prefetch_renditions('max-165x165')
 
     # allow hooks to modify the queryset
     for hook in hooks.get_hooks('construct_image_chooser_queryset'):
@@ -130,6 +130,7 @@ def chooser_upload(request):
 
         if form.is_valid():
             form.save()
+            image.generate_eager_renditions()
 
             # Reindex the image to make sure all tags are indexed
             search_index.insert_or_update_object(image)
@@ -149,7 +150,7 @@ def chooser_upload(request):
     else:
         form = ImageForm(user=request.user)
 
-    images = Image.objects.order_by('-created_at')
+    images = Image.objects.order_by('-created_at').prefetch_renditions('max-165x165')
     paginator, images = paginate(request, images, per_page=12)
 
     return render_modal_workflow(
@@ -166,7 +167,7 @@ def chooser_select_format(request, image_id):
         if form.is_valid():
 
             format = get_image_format(form.cleaned_data['format'])
-            preview_image = image.get_rendition(format.filter_spec)
+            preview_image = image.get_rendition(format.filter_spec, defer=False)
 
             image_json = json.dumps({
                 'id': image.id,
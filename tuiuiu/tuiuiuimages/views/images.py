@@ -33,7 +33,7 @@ def index(request):
     # Get images (filtered by user permission)
     images = permission_policy.instances_user_has_any_permission_for(
         request.user, ['change', 'delete']
-    ).order_by('-created_at')
+    ).order_by('-created_at').prefetch_renditions('max-165x165')
 
     # Search
     query_string = None
@@ -111,6 +111,9 @@ def edit(request, image_id):
 
             form.save()
 
+            if 'file' in form.changed_data:
+                image.generate_eager_renditions()
+
             # Reindex the image to make sure all tags are indexed
             search_index.insert_or_update_object(image)
 
@@ -251,6 +254,7 @@ def add(request):
             image.file_size = image.file.size
 
             form.save()
+            image.generate_eager_renditions()
 
             # Reindex the image to make sure all tags are indexed
             search_index.insert_or_update_object(image)
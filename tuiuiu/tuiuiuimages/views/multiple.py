@@ -70,6 +70,7 @@ def add(request):
             image.uploaded_by_user = request.user
             image.file_size = image.file.size
             image.save()
+            image.generate_eager_renditions()
 
             # Success! Send back an edit form for this image to the user
             return JsonResponse({
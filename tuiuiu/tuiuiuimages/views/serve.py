@@ -3,14 +3,19 @@ from __future__ import absolute_import, unicode_literals
 import base64
 import hashlib
 import hmac
-import imghdr
+import mimetypes
+import os
+import re
 from wsgiref.util import FileWrapper
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured, PermissionDenied
-from django.http import HttpResponse, HttpResponsePermanentRedirect, StreamingHttpResponse
+from django.http import (
+    HttpResponse, HttpResponseNotModified, HttpResponsePermanentRedirect, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import classonlymethod
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
 from django.utils.six import text_type
 from django.views.generic import View
 
@@ -38,11 +43,46 @@ def verify_signature(signature, image_id, filter_spec, key=None):
     return signature == generate_signature(image_id, filter_spec, key=key)
 
 
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range_header(header, size):
+    """
+    Parse the value of a Range header asking for a single range of bytes of a
+    file of the given size. Returns a (first, last) pair of byte positions,
+    None if the header should be ignored, or raises ValueError if the range
+    can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        # Multiple ranges, or units other than bytes, aren't supported
+        return None
+
+    first, last = match.groups()
+    if first:
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # The last n bytes
+        first = max(size - int(last), 0)
+        last = size - 1
+    else:
+        return None
+
+    if first > last:
+        raise ValueError("Unsatisfiable range: " + header)
+
+    return first, last
+
+
 class ServeView(View):
     model = get_image_model()
     action = 'serve'
     key = None
 
+    # The URL of a rendition is signed and never changes, so it can be cached for a long time
+    cache_timeout = 60 * 60 * 24 * 365
+
     @classonlymethod
     def as_view(cls, **initkwargs):
         if 'action' in initkwargs:
@@ -59,7 +99,7 @@ class ServeView(View):
 
         # Get/generate the rendition
         try:
-            rendition = image.get_rendition(filter_spec)
+            rendition = image.get_rendition(filter_spec, defer=False)
         except SourceImageIOError:
             return HttpResponse("Source image file not found", content_type='text/plain', status=410)
         except InvalidFilterSpecError:
@@ -67,12 +107,75 @@ class ServeView(View):
 
         return getattr(self, self.action)(rendition)
 
+    def get_etag(self, rendition):
+        # A rendition's file is never changed once it is generated
+        return quote_etag(hashlib.sha1(
+            '{}-{}'.format(rendition.pk, rendition.file.name).encode('utf-8')
+        ).hexdigest())
+
+    def get_last_modified(self, rendition):
+        # Only look this up for local files, where it doesn't cost a request to the storage
+        try:
+            return int(os.path.getmtime(rendition.file.path))
+        except (NotImplementedError, OSError):
+            return None
+
+    def is_not_modified(self, etag, last_modified):
+        if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            # If-Modified-Since is ignored when If-None-Match is given
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or 'W/' + etag in tags
+
+        if_modified_since = parse_http_date_safe(self.request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and last_modified is not None and last_modified <= if_modified_since
+
     def serve(self, rendition):
-        # Open and serve the file
+        etag = self.get_etag(rendition)
+        last_modified = self.get_last_modified(rendition)
+
+        # Answer revalidations without touching the file
+        if self.is_not_modified(etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = self.serve_file(rendition, etag)
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, public=True, max_age=self.cache_timeout)
+        return response
+
+    def serve_file(self, rendition, etag):
+        # The file extension reflects the format the rendition was saved in
+        content_type = mimetypes.guess_type(rendition.file.name)[0] or 'application/octet-stream'
+        size = rendition.file.size
+
+        byte_range = None
+        range_header = self.request.META.get('HTTP_RANGE')
+        if_range = self.request.META.get('HTTP_IF_RANGE')
+        if range_header and (if_range is None or if_range.strip() == etag):
+            try:
+                byte_range = parse_range_header(range_header, size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */{}'.format(size)
+                return response
+
         rendition.file.open('rb')
-        image_format = imghdr.what(rendition.file)
-        return StreamingHttpResponse(FileWrapper(rendition.file),
-                                     content_type='image/' + image_format)
+
+        if byte_range is not None:
+            first, last = byte_range
+            rendition.file.seek(first)
+            response = HttpResponse(rendition.file.read(last - first + 1), content_type=content_type, status=206)
+            rendition.file.close()
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, size)
+        else:
+            response = StreamingHttpResponse(FileWrapper(rendition.file), content_type=content_type)
+            response['Content-Length'] = size
+
+        response['Accept-Ranges'] = 'bytes'
+        return response
 
     def redirect(self, rendition):
         # Redirect to the file's public location
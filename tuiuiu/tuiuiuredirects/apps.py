@@ -7,3 +7,7 @@ class TuiuiuRedirectsAppConfig(AppConfig):
     name = 'tuiuiu.tuiuiuredirects'
     label = 'tuiuiuredirects'
     verbose_name = "Tuiuiu redirects"
+
+    def ready(self):
+        from tuiuiu.tuiuiuredirects.signal_handlers import register_signal_handlers
+        register_signal_handlers()
@@ -5,6 +5,7 @@ from django import http
 from django.utils.six.moves.urllib.parse import urlparse
 
 from tuiuiu.tuiuiuredirects import models
+from tuiuiu.tuiuiuredirects.redirect_index import get_redirect_index
 
 
 if django.VERSION >= (1, 10):
@@ -14,6 +15,10 @@ else:
 
 
 def get_redirect(request, path):
+    index = get_redirect_index()
+    if index is not None:
+        return index.find_redirect(request.site, path)
+
     try:
         return models.Redirect.get_for_site(request.site).get(old_path=path)
     except models.Redirect.MultipleObjectsReturned:
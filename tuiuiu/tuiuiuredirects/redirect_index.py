@@ -0,0 +1,100 @@
+from __future__ import absolute_import, unicode_literals
+
+import copy
+import threading
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+
+from tuiuiu.tuiuiucore.utils import bump_cache_version_on_commit, get_cache_version
+
+
+REDIRECT_INDEX_VERSION_CACHE_KEY = 'tuiuiu_redirect_index_version'
+
+
+def get_redirect_index_version():
+    return get_cache_version(REDIRECT_INDEX_VERSION_CACHE_KEY)
+
+
+def bump_redirect_index_version():
+    """
+    Invalidate the redirect indexes of every process once the current
+    transaction is committed
+    """
+    bump_cache_version_on_commit(REDIRECT_INDEX_VERSION_CACHE_KEY)
+
+
+class RedirectIndex(object):
+    """
+    An in-memory copy of the Redirect table, keyed by site and normalised path,
+    that finds redirects using the same rules as RedirectMiddleware's queries
+    without touching the database. Paths with no redirect are answered from
+    the index too, so 404s for them never reach the database.
+
+    Each lookup returns a copy of the stored Redirect, so that the page it
+    points to is loaded afresh, and never shared between requests.
+    """
+    def __init__(self, redirects, version=None):
+        self.version = version
+        self.redirects_by_path = defaultdict(dict)
+
+        for redirect in redirects:
+            self.redirects_by_path[redirect.old_path][redirect.site_id] = redirect
+
+    @classmethod
+    def build(cls, version=None):
+        Redirect = apps.get_model('tuiuiuredirects.Redirect')
+        return cls(Redirect.objects.order_by('pk'), version=version)
+
+    def find_redirect(self, site, path):
+        redirects = self.redirects_by_path.get(path)
+        if not redirects:
+            return None
+
+        if site:
+            # Prefer a site-specific redirect to a site-ambivalent one
+            redirect = redirects.get(site.pk) or redirects.get(None)
+        elif len(redirects) == 1:
+            redirect = list(redirects.values())[0]
+        else:
+            redirect = redirects.get(None)
+
+        if redirect is not None:
+            return copy.copy(redirect)
+
+
+_redirect_index = None
+_redirect_index_lock = threading.Lock()
+
+
+def get_redirect_index():
+    """
+    Return this process's RedirectIndex, rebuilding it if the Redirect table
+    has changed since it was last built.
+
+    Returns None unless TUIUIUREDIRECTS_INDEX is True, or if the version stamp
+    isn't kept in a cache shared by all processes (such as with the dummy or
+    local memory cache), as there would be no way to invalidate the index, or
+    if this thread has changed redirects in a transaction that isn't
+    committed yet.
+    """
+    global _redirect_index
+
+    if not getattr(settings, 'TUIUIUREDIRECTS_INDEX', False):
+        return None
+
+    version = get_redirect_index_version()
+    if version is None:
+        return None
+
+    index = _redirect_index
+
+    if index is None or index.version != version:
+        with _redirect_index_lock:
+            index = _redirect_index
+
+            if index is None or index.version != version:
+                index = _redirect_index = RedirectIndex.build(version=version)
+
+    return index
@@ -0,0 +1,15 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.db.models.signals import post_delete, post_save
+
+from tuiuiu.tuiuiuredirects.models import Redirect
+from tuiuiu.tuiuiuredirects.redirect_index import bump_redirect_index_version
+
+
+def redirect_index_signal_handler(**kwargs):
+    bump_redirect_index_version()
+
+
+def register_signal_handlers():
+    post_save.connect(redirect_index_signal_handler, sender=Redirect)
+    post_delete.connect(redirect_index_signal_handler, sender=Redirect)
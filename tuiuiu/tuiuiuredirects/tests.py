@@ -1,11 +1,15 @@
 from __future__ import absolute_import, unicode_literals
 
+import mock
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.test import TestCase, override_settings
+from django.test import RequestFactory, TestCase, override_settings
 
 from tuiuiu.tests.utils import TuiuiuTestUtils
 from tuiuiu.tuiuiucore.models import Page, Site
 from tuiuiu.tuiuiuredirects import models
+from tuiuiu.tuiuiuredirects.middleware import get_redirect
+from tuiuiu.tuiuiuredirects.redirect_index import get_redirect_index
 
 
 @override_settings(ALLOWED_HOSTS=['testserver', 'localhost', 'test.example.com', 'other.example.com'])
@@ -242,6 +246,84 @@ class TestRedirects(TestCase):
         self.assertRedirects(response, 'http://localhost/events/christmas/', status_code=301, fetch_redirect_response=False)
 
 
+@override_settings(TUIUIUREDIRECTS_INDEX=True)
+class TestRedirectsWithIndex(TestRedirects):
+    pass
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}, TUIUIUREDIRECTS_INDEX=True)
+# The local memory cache stands in for a cache shared between processes
+@mock.patch('tuiuiu.tuiuiucore.utils.cache_is_shared', lambda cache: True)
+class TestRedirectIndex(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        cache.clear()
+        self.site = Site.objects.get(is_default_site=True)
+
+        # on_commit callbacks are never run inside a TestCase, so collect them instead
+        self.on_commit_callbacks = []
+        on_commit_patcher = mock.patch('tuiuiu.tuiuiucore.utils.on_commit', self.on_commit_callbacks.append)
+        on_commit_patcher.start()
+        self.addCleanup(on_commit_patcher.stop)
+
+    def commit(self):
+        for callback in self.on_commit_callbacks:
+            callback()
+        self.on_commit_callbacks[:] = []
+
+    def get_redirect(self, path, site=None):
+        request = RequestFactory().get(path)
+        request.site = site or self.site
+        return get_redirect(request, models.Redirect.normalise_path(path))
+
+    def test_lookups_dont_query_database(self):
+        models.Redirect.objects.create(old_path='/redirectme', redirect_link='/redirectto')
+        self.commit()
+        get_redirect_index()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_redirect('/redirectme/').link, '/redirectto')
+            self.assertIsNone(self.get_redirect('/missing/'))
+            self.assertIsNone(self.get_redirect('/missing/'))
+
+    def test_index_is_invalidated(self):
+        redirect = models.Redirect.objects.create(old_path='/redirectme', redirect_link='/redirectto')
+        self.assertEqual(self.get_redirect('/redirectme/').link, '/redirectto')
+
+        self.commit()
+        index = get_redirect_index()
+
+        redirect.redirect_link = '/elsewhere'
+        redirect.save()
+
+        # This thread sees its own changes before they are committed
+        self.assertIsNone(get_redirect_index())
+        self.assertEqual(self.get_redirect('/redirectme/').link, '/elsewhere')
+
+        self.commit()
+        self.assertIsNot(get_redirect_index(), index)
+        self.assertEqual(self.get_redirect('/redirectme/').link, '/elsewhere')
+
+        redirect.delete()
+        self.commit()
+        self.assertIsNone(self.get_redirect('/redirectme/'))
+
+    def test_prefers_site_specific_redirect(self):
+        contact_page = Page.objects.get(url_path='/home/contact-us/')
+        other_site = Site.objects.create(hostname='other.example.com', port=80, root_page=contact_page)
+
+        models.Redirect.objects.create(old_path='/xmas', redirect_link='/generic')
+        models.Redirect.objects.create(site=other_site, old_path='/xmas', redirect_link='/site-specific')
+        models.Redirect.objects.create(site=other_site, old_path='/easter', redirect_link='/site-specific')
+
+        self.assertEqual(self.get_redirect('/xmas/').link, '/generic')
+        self.assertEqual(self.get_redirect('/xmas/', site=other_site).link, '/site-specific')
+        self.assertIsNone(self.get_redirect('/easter/'))
+
+
 class TestRedirectsIndexView(TestCase, TuiuiuTestUtils):
     def setUp(self):
         self.login()
@@ -1,12 +1,19 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
 from django.db.models.lookups import Lookup
 from django.db.models.query import QuerySet
 from django.db.models.sql.where import SubqueryConstraint, WhereNode
+from django.utils.encoding import force_bytes
 from django.utils.six import text_type
 
 from tuiuiu.tuiuiusearch.index import class_is_indexed
+from tuiuiu.tuiuiusearch.utils import get_search_results_cache, get_search_results_version
 
 
 class FilterError(Exception):
@@ -106,6 +113,14 @@ class BaseSearchResults(object):
         self._count_cache = None
         self._score_field = None
 
+        # Shared with clones, which run the same search with different limits,
+        # so that they can reuse the total number of hits and the pages of
+        # results that have been fetched already
+        self._shared = {
+            'total_count': None,
+            'results': {},
+        }
+
     def _set_limits(self, start=None, stop=None):
         if stop is not None:
             if self.stop is not None:
@@ -125,25 +140,143 @@ class BaseSearchResults(object):
         new.start = self.start
         new.stop = self.stop
         new._score_field = self._score_field
+        new._shared = self._shared
         return new
 
+    def _set_total_count(self, total_count):
+        """
+        Record the total number of hits for the search, ignoring any limits.
+        Backends that get it along with the results call this from _do_search.
+        """
+        self._shared['total_count'] = total_count
+
+    def _apply_limits_to_count(self, total_count):
+        count = total_count - self.start
+        if self.stop is not None:
+            count = min(count, self.stop - self.start)
+
+        return max(count, 0)
+
+    def _get_results_memo_key(self):
+        start, stop = self.start, self.stop
+
+        # Slices ending past the last hit return the same results
+        total_count = self._shared['total_count']
+        if total_count is not None and (stop is None or stop > total_count):
+            stop = max(total_count, start)
+
+        return (start, stop, self._score_field)
+
     def _do_search(self):
         raise NotImplementedError
 
     def _do_count(self):
         raise NotImplementedError
 
+    def _get_cache_key(self, kind):
+        """
+        Return the key that the results (or count) of this search are cached
+        under, or None if they aren't cached
+        """
+        if get_search_results_cache() is None:
+            return None
+
+        try:
+            # Includes the filters and ordering of the queryset being searched
+            queryset_sql = text_type(self.query.queryset.query)
+        except EmptyResultSet:
+            return None
+
+        version, changed_at = get_search_results_version(self.query.queryset.model)
+        if version is None:
+            return None
+
+        if changed_at is not None and time.time() < changed_at + self.backend.refresh_delay:
+            # The latest change may not be searchable yet, and results that
+            # miss it would be cached under the new version
+            return None
+
+        query_string = self.query.query_string
+        if query_string is not None:
+            query_string = ' '.join(query_string.lower().split())
+
+        key = [
+            kind, self.backend.get_cache_key_prefix(), version, queryset_sql, query_string, self.query.fields,
+            self.query.operator, self.query.order_by_relevance, self.start, self.stop, self._score_field,
+        ]
+        return 'tuiuiusearch-results-' + hashlib.sha1(force_bytes(repr(key))).hexdigest()
+
+    def _get_objects_for_hits(self, hits):
+        """
+        Fetch the objects for a list of (pk, score) tuples, in the same order
+        """
+        objects = {
+            text_type(obj.pk): obj
+            for obj in self.query.queryset.filter(pk__in=[pk for pk, score in hits])
+        }
+
+        results = []
+        for pk, score in hits:
+            obj = objects.get(text_type(pk))
+
+            # Skip objects that have been deleted since the results were cached
+            if obj is not None:
+                if self._score_field:
+                    setattr(obj, self._score_field, score)
+                results.append(obj)
+
+        return results
+
+    def _get_results(self):
+        cache_key = self._get_cache_key('results')
+        if cache_key is None:
+            return self._do_search()
+
+        cache = get_search_results_cache()
+        hits = cache.get(cache_key)
+        if hits is not None:
+            return self._get_objects_for_hits(hits)
+
+        results = list(self._do_search())
+        hits = [
+            (obj.pk, getattr(obj, self._score_field, None) if self._score_field else None)
+            for obj in results
+        ]
+        cache.set(cache_key, hits, getattr(settings, 'TUIUIUSEARCH_RESULTS_CACHE_TIMEOUT', 300))
+
+        return results
+
+    def _get_count(self):
+        cache_key = self._get_cache_key('count')
+        if cache_key is None:
+            return self._do_count()
+
+        cache = get_search_results_cache()
+        count = cache.get(cache_key)
+        if count is None:
+            count = self._do_count()
+            cache.set(cache_key, count, getattr(settings, 'TUIUIUSEARCH_RESULTS_CACHE_TIMEOUT', 300))
+
+        return count
+
     def results(self):
         if self._results_cache is None:
-            self._results_cache = self._do_search()
+            results = self._shared['results'].get(self._get_results_memo_key())
+            if results is None:
+                results = self._get_results()
+                self._shared['results'][self._get_results_memo_key()] = results
+
+            self._results_cache = results
         return self._results_cache
 
     def count(self):
         if self._count_cache is None:
             if self._results_cache is not None:
                 self._count_cache = len(self._results_cache)
+            elif self._shared['total_count'] is not None:
+                self._count_cache = self._apply_limits_to_count(self._shared['total_count'])
             else:
-                self._count_cache = self._do_count()
+                self._count_cache = self._get_count()
         return self._count_cache
 
     def __getitem__(self, key):
@@ -193,6 +326,9 @@ class EmptySearchResults(BaseSearchResults):
     def _clone(self):
         return self.__class__()
 
+    def _get_cache_key(self, kind):
+        return None
+
     def _do_search(self):
         return []
 
@@ -205,6 +341,10 @@ class BaseSearchBackend(object):
     results_class = None
     rebuilder_class = None
 
+    # The number of seconds that a change to the index can take to show up in
+    # search results
+    refresh_delay = 0
+
     def __init__(self, params):
         pass
 
@@ -214,6 +354,13 @@ class BaseSearchBackend(object):
     def get_rebuilder(self):
         return None
 
+    def get_cache_key_prefix(self):
+        """
+        Return a string identifying the backend (and the index it searches) in
+        the keys of cached search results
+        """
+        return '%s.%s' % (type(self).__module__, type(self).__name__)
+
     def reset_index(self):
         raise NotImplementedError
 
@@ -232,6 +379,13 @@ class BaseSearchBackend(object):
     def delete(self, obj):
         raise NotImplementedError
 
+    def delete_stale_entries(self, model):
+        """
+        Remove the objects of the model that no longer exist (or are no longer
+        indexed) from the index
+        """
+        pass
+
     def search(self, query_string, model_or_queryset, fields=None, filters=None,
                prefetch_related=None, operator=None, order_by_relevance=True):
         # Find model/queryset
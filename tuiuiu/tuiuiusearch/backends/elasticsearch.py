@@ -2,6 +2,10 @@ from __future__ import absolute_import, unicode_literals
 
 import copy
 import json
+import logging
+from collections import deque
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 
 from django.db import DEFAULT_DB_ALIAS, models
 from django.db.models.sql import Query
@@ -9,7 +13,7 @@ from django.db.models.sql.constants import SINGLE
 from django.utils.crypto import get_random_string
 from django.utils.six.moves.urllib.parse import urlparse
 from elasticsearch import Elasticsearch, NotFoundError
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import BulkIndexError, bulk, scan, streaming_bulk
 
 from tuiuiu.utils.utils import deep_update
 from tuiuiu.tuiuiusearch.backends.base import (
@@ -17,6 +21,8 @@ from tuiuiu.tuiuiusearch.backends.base import (
 from tuiuiu.tuiuiusearch.index import (
     FilterField, Indexed, RelatedFields, SearchField, class_is_indexed)
 
+logger = logging.getLogger('tuiuiu.search.index')
+
 
 class ElasticsearchMapping(object):
     type_map = {
@@ -146,6 +152,25 @@ class ElasticsearchMapping(object):
     def get_document_id(self, obj):
         return obj.indexed_get_toplevel_content_type() + ':' + str(obj.pk)
 
+    def _get_related_value(self, field, value, partials):
+        # Related objects are read from the caches filled by the
+        # select_related/prefetch_related lookups planned by RelatedFields
+        if isinstance(value, models.Manager):
+            nested_docs = []
+
+            for nested_obj in value.all():
+                nested_doc, extra_partials = self._get_nested_document(field.fields, nested_obj)
+                nested_docs.append(nested_doc)
+                partials.extend(extra_partials)
+
+            return nested_docs
+        elif isinstance(value, models.Model):
+            nested_doc, extra_partials = self._get_nested_document(field.fields, value)
+            partials.extend(extra_partials)
+            return nested_doc
+
+        return value
+
     def _get_nested_document(self, fields, obj):
         doc = {}
         partials = []
@@ -154,6 +179,10 @@ class ElasticsearchMapping(object):
 
         for field in fields:
             value = field.get_value(obj)
+
+            if isinstance(field, RelatedFields):
+                value = self._get_related_value(field, value, partials)
+
             doc[mapping.get_field_column_name(field)] = value
 
             # Check if this field should be added into _partials
@@ -170,18 +199,7 @@ class ElasticsearchMapping(object):
             value = field.get_value(obj)
 
             if isinstance(field, RelatedFields):
-                if isinstance(value, models.Manager):
-                    nested_docs = []
-
-                    for nested_obj in value.all():
-                        nested_doc, extra_partials = self._get_nested_document(field.fields, nested_obj)
-                        nested_docs.append(nested_doc)
-                        partials.extend(extra_partials)
-
-                    value = nested_docs
-                elif isinstance(value, models.Model):
-                    value, extra_partials = self._get_nested_document(field.fields, value)
-                    partials.extend(extra_partials)
+                value = self._get_related_value(field, value, partials)
 
             doc[self.get_field_column_name(field)] = value
 
@@ -456,6 +474,7 @@ class ElasticsearchSearchResults(BaseSearchResults):
 
         # Send to Elasticsearch
         hits = self.backend.es.search(**params)
+        self._set_total_count(hits['hits']['total'])
 
         # Get pks from results
         pks = [hit['fields']['pk'][0] for hit in hits['hits']['hits']]
@@ -481,13 +500,53 @@ class ElasticsearchSearchResults(BaseSearchResults):
             index=self.backend.get_index_for_model(self.query.queryset.model).name,
             body=self._get_es_body(for_count=True),
         )['count']
+        self._set_total_count(hit_count)
 
         # Add limits
-        hit_count -= self.start
-        if self.stop is not None:
-            hit_count = min(hit_count, self.stop - self.start)
+        return self._apply_limits_to_count(hit_count)
+
 
-        return max(hit_count, 0)
+def get_batches(items, batch_size):
+    """
+    Yield lists of at most `batch_size` items from an iterable
+    """
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_bulk_chunks(actions, chunk_size, max_chunk_bytes, serializer):
+    """
+    Group (action, document) pairs into chunks to send to the bulk API, of at
+    most `chunk_size` documents and (unless one document is larger by itself)
+    about `max_chunk_bytes` of JSON. The documents are serialised on the way.
+    """
+    chunk = []
+    chunk_bytes = 0
+
+    for action, doc in actions:
+        data = serializer.dumps(doc)
+        size = len(serializer.dumps(action)) + len(data) + 2
+
+        if chunk and (len(chunk) >= chunk_size or chunk_bytes + size > max_chunk_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+
+        chunk.append((action, data))
+        chunk_bytes += size
+
+    if chunk:
+        yield chunk
+
+
+def get_bulk_error_details(result):
+    # Results look like {'index': {'_id': ..., 'status': ..., 'error': ...}}
+    details = list(result.values())[0] if result else {}
+    return details.get('_id'), details.get('error', details.get('exception'))
 
 
 class ElasticsearchIndex(object):
@@ -563,20 +622,72 @@ class ElasticsearchIndex(object):
         mapping = self.mapping_class(model)
         doc_type = mapping.get_document_type()
 
-        # Create list of actions
-        actions = []
-        for item in items:
-            # Create the action
-            action = {
-                '_index': self.name,
-                '_type': doc_type,
-                '_id': mapping.get_document_id(item),
-            }
-            action.update(mapping.get_document(item))
-            actions.append(action)
+        def get_actions():
+            for batch in get_batches(items, self.backend.bulk_chunk_size):
+                # Fetch the related objects of the whole batch at once (this
+                # does nothing for objects that came from get_indexed_objects)
+                model.prefetch_indexed_related_objects(batch)
+
+                for item in batch:
+                    action = {
+                        'index': {
+                            '_index': self.name,
+                            '_type': doc_type,
+                            '_id': mapping.get_document_id(item),
+                        }
+                    }
+                    yield action, mapping.get_document(item)
+
+        # Documents are built as the chunks are sent, so that only the chunks
+        # in flight are held in memory
+        chunks = get_bulk_chunks(
+            get_actions(), self.backend.bulk_chunk_size, self.backend.bulk_max_chunk_bytes,
+            self.es.transport.serializer)
+
+        errors = []
+        for ok, result in self.send_bulk_chunks(chunks, self.backend.bulk_threads):
+            if not ok:
+                errors.append(result)
+                doc_id, error = get_bulk_error_details(result)
+                logger.error("Failed to index document %s into '%s': %s", doc_id, self.name, error)
+
+        if errors:
+            raise BulkIndexError("%d document(s) failed to index." % len(errors), errors)
+
+    def send_bulk_chunk(self, chunk):
+        # The documents in the chunk have already been serialised, which the
+        # client's serializer passes through as they are
+        return list(streaming_bulk(
+            self.es, chunk, chunk_size=len(chunk), raise_on_error=False, expand_action_callback=lambda item: item))
+
+    def send_bulk_chunks(self, chunks, threads=1):
+        """
+        Send chunks of bulk actions, in `threads` threads at once, yielding
+        the (ok, result) pair for each action in turn. No more than `threads`
+        chunks are sent at once, and the next chunk is prepared while they are.
+        """
+        if threads <= 1:
+            for chunk in chunks:
+                for result in self.send_bulk_chunk(chunk):
+                    yield result
+            return
+
+        pool = ThreadPool(threads)
+        try:
+            in_flight = deque()
+            for chunk in chunks:
+                if len(in_flight) >= threads:
+                    for result in in_flight.popleft().get():
+                        yield result
+
+                in_flight.append(pool.apply_async(self.send_bulk_chunk, (chunk, )))
 
-        # Run the actions
-        bulk(self.es, actions)
+            while in_flight:
+                for result in in_flight.popleft().get():
+                    yield result
+        finally:
+            pool.close()
+            pool.join()
 
     def delete_item(self, item):
         # Make sure the object can be indexed
@@ -596,6 +707,34 @@ class ElasticsearchIndex(object):
         except NotFoundError:
             pass  # Document doesn't exist, ignore this exception
 
+    def delete_stale_entries(self, model):
+        if not class_is_indexed(model):
+            return
+
+        mapping = self.mapping_class(model)
+        doc_type = mapping.get_document_type()
+
+        # Documents are identified by the pk of their object, prefixed with its top level content type
+        id_prefix = model.indexed_get_toplevel_content_type() + ':'
+        indexed_ids = set(
+            id_prefix + str(pk)
+            for pk in model.get_indexed_objects().prefetch_related(None).values_list('pk', flat=True)
+        )
+
+        hits = scan(self.es, index=self.name, doc_type=doc_type, query={'query': {'match_all': {}}}, _source=False)
+        actions = (
+            {
+                '_op_type': 'delete',
+                '_index': self.name,
+                '_type': doc_type,
+                '_id': hit['_id'],
+            }
+            for hit in hits if hit['_id'] not in indexed_ids
+        )
+
+        # Documents that have been deleted since the scan started aren't an error
+        bulk(self.es, actions, raise_on_error=False)
+
     def refresh(self):
         self.es.indices.refresh(self.name)
 
@@ -741,6 +880,15 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
         self.index_name = params.pop('INDEX', 'tuiuiu')
         self.timeout = params.pop('TIMEOUT', 10)
 
+        # Limits on the requests sent to the bulk API when indexing objects
+        self.bulk_chunk_size = params.pop('BULK_CHUNK_SIZE', 500)
+        self.bulk_max_chunk_bytes = params.pop('BULK_MAX_CHUNK_BYTES', 10 * 1024 * 1024)
+        self.bulk_threads = params.pop('BULK_THREADS', 1)
+
+        # Changes become searchable when the index is next refreshed, which
+        # Elasticsearch does every second by default
+        self.refresh_delay = params.pop('REFRESH_DELAY', 1)
+
         if params.pop('ATOMIC_REBUILD', False):
             self.rebuilder_class = self.atomic_rebuilder_class
         else:
@@ -785,6 +933,10 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
     def get_index_for_model(self, model):
         return self.index_class(self, self.index_name)
 
+    def get_cache_key_prefix(self):
+        # Only ever used hashed, so the credentials in the hosts don't end up in the cache
+        return '%s:%r/%s' % (super(ElasticsearchSearchBackend, self).get_cache_key_prefix(), self.hosts, self.index_name)
+
     def get_index(self):
         return self.index_class(self, self.index_name)
 
@@ -810,5 +962,8 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
     def delete(self, obj):
         self.get_index_for_model(type(obj)).delete_item(obj)
 
+    def delete_stale_entries(self, model):
+        self.get_index_for_model(model).delete_stale_entries(model)
+
 
 SearchBackend = ElasticsearchSearchBackend
@@ -10,6 +10,7 @@ from django.db.models.fields import FieldDoesNotExist
 from django.db.models.fields.related import ForeignObjectRel, OneToOneRel, RelatedField
 
 from tuiuiu.tuiuiusearch.backends import get_search_backends_with_name
+from tuiuiu.tuiuiusearch.utils import bump_search_results_version
 
 
 logger = logging.getLogger('tuiuiu.search.index')
@@ -79,6 +80,40 @@ class Indexed(object):
 
         return queryset
 
+    @classmethod
+    def prefetch_indexed_related_objects(cls, objects):
+        """
+        Fetch the related objects needed to index a list of objects that
+        weren't fetched with get_indexed_objects, with one query per relation
+        rather than one per object. Relations that have already been fetched
+        are left alone.
+        """
+        lookups = []
+        for field in cls.get_search_fields():
+            if isinstance(field, RelatedFields):
+                select_related, prefetch_related = field.get_related_lookups(cls)
+                lookups.extend(select_related + prefetch_related)
+
+        if lookups:
+            models.prefetch_related_objects(objects, *lookups)
+
+    @classmethod
+    def get_indexed_objects_changed_since(cls, timestamp):
+        """
+        Return the indexed objects that may have changed since `timestamp`,
+        going by the date/time fields listed in `search_timestamp_fields`. All
+        of the indexed objects are returned if the model doesn't list any.
+        """
+        queryset = cls.get_indexed_objects()
+        if not cls.search_timestamp_fields:
+            return queryset
+
+        changed = models.Q()
+        for field_name in cls.search_timestamp_fields:
+            changed |= models.Q(**{field_name + '__gte': timestamp})
+
+        return queryset.filter(changed)
+
     def get_indexed_instance(self):
         """
         If the indexed model uses multi table inheritance, override this method
@@ -116,6 +151,9 @@ class Indexed(object):
 
     search_fields = []
 
+    # Fields recording when an object was last changed, used by update_index --since
+    search_timestamp_fields = []
+
 
 def get_indexed_models():
     return [
@@ -151,6 +189,8 @@ def insert_or_update_object(instance):
                 # Catch and log all errors
                 logger.exception("Exception raised while adding %r into the '%s' search backend", indexed_instance, backend_name)
 
+        bump_search_results_version(type(indexed_instance))
+
 
 def remove_object(instance):
     indexed_instance = get_indexed_instance(instance, check_exists=False)
@@ -163,6 +203,8 @@ def remove_object(instance):
                 # Catch and log all errors
                 logger.exception("Exception raised while deleting %r from the '%s' search backend", indexed_instance, backend_name)
 
+        bump_search_results_version(type(indexed_instance))
+
 
 class BaseField(object):
     def __init__(self, field_name, **kwargs):
@@ -245,33 +287,63 @@ class RelatedFields(object):
         if isinstance(field, (RelatedField, ForeignObjectRel)):
             return getattr(obj, self.field_name)
 
-    def select_on_queryset(self, queryset):
+    def get_related_lookups(self, model, prefix='', prefetch=False):
         """
-        This method runs either prefetch_related or select_related on the queryset
-        to improve indexing speed of the relation.
-
-        It decides which method to call based on the number of related objects:
-         - single (eg ForeignKey, OneToOne), it runs select_related
-         - multiple (eg ManyToMany, reverse ForeignKey) it runs prefetch_related
+        Return a pair of lists, of the select_related and the prefetch_related
+        lookups that fetch this relation and the relations of any RelatedFields
+        nested within it, starting from ``model``.
+
+        Single related objects (eg ForeignKey, OneToOne) are fetched with
+        select_related and multiple ones (eg ManyToMany, reverse ForeignKey)
+        with prefetch_related, as are any relations nested within a prefetched
+        relation (``prefetch`` is True for those).
         """
         try:
-            field = self.get_field(queryset.model)
+            field = self.get_field(model)
         except FieldDoesNotExist:
-            return queryset
+            return [], []
 
         if isinstance(field, RelatedField):
             if field.many_to_one or field.one_to_one:
-                queryset = queryset.select_related(self.field_name)
+                single = True
             elif field.one_to_many or field.many_to_many:
-                queryset = queryset.prefetch_related(self.field_name)
+                single = False
+            else:
+                return [], []
 
         elif isinstance(field, ForeignObjectRel):
-            # Reverse relation
-            if isinstance(field, OneToOneRel):
-                # select_related for reverse OneToOneField
-                queryset = queryset.select_related(self.field_name)
-            else:
-                # prefetch_related for anything else (reverse ForeignKey/ManyToManyField)
-                queryset = queryset.prefetch_related(self.field_name)
+            # Reverse relation, which is single for reverse OneToOneField and
+            # multiple for anything else (reverse ForeignKey/ManyToManyField)
+            single = isinstance(field, OneToOneRel)
+
+        else:
+            return [], []
+
+        lookup = prefix + self.field_name
+        prefetch = prefetch or not single
+        select_related = [] if prefetch else [lookup]
+        prefetch_related = [lookup] if prefetch else []
+
+        for sub_field in self.fields:
+            if isinstance(sub_field, RelatedFields):
+                sub_select_related, sub_prefetch_related = sub_field.get_related_lookups(
+                    field.related_model, prefix=lookup + '__', prefetch=prefetch)
+                select_related.extend(sub_select_related)
+                prefetch_related.extend(sub_prefetch_related)
+
+        return select_related, prefetch_related
+
+    def select_on_queryset(self, queryset):
+        """
+        This method runs either prefetch_related or select_related on the queryset
+        to improve indexing speed of the relation (and of any relations nested
+        within it), as given by get_related_lookups
+        """
+        select_related, prefetch_related = self.get_related_lookups(queryset.model)
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
 
         return queryset
@@ -0,0 +1,181 @@
+from __future__ import absolute_import, unicode_literals
+
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connections
+
+from tuiuiu.tuiuiusearch.backends import get_search_backends_with_name
+from tuiuiu.tuiuiusearch.index import get_indexed_instance, remove_object
+from tuiuiu.tuiuiusearch.utils import bump_search_results_version
+from tuiuiu.utils.transaction import CommitBatch
+
+logger = logging.getLogger('tuiuiu.search.index')
+
+
+def get_root_model(model):
+    parents = model._meta.get_parent_list()
+    if parents:
+        return list(parents)[-1]
+
+    return model
+
+
+class IndexBuffer(object):
+    """
+    Collects the objects saved and deleted during a transaction, and updates
+    the search index once it is committed, in a pool of WORKERS threads (or in
+    the committing thread if WORKERS is 0). Nothing is updated for a
+    transaction that is rolled back.
+
+    Each object is indexed once however many times it was saved, using its
+    state at the time of the commit. Objects of the same model are fetched in
+    one query and sent to each backend's `add_bulk` together.
+    """
+    def __init__(self, params):
+        self.workers = params.get('WORKERS', 0)
+
+        self._batch = CommitBatch(self.flush)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def add(self, instance):
+        """
+        Index (or reindex) the object when the current transaction is committed
+        """
+        model = type(instance)
+        key = (get_root_model(model), instance.pk)
+        pending = self._batch.get_pending()
+
+        # Keep the most specific model the object was saved as
+        if key in pending and pending[key][0] == 'add' and issubclass(pending[key][1], model):
+            model = pending[key][1]
+
+        pending[key] = ('add', model)
+        self._batch.schedule()
+
+    def delete(self, instance):
+        """
+        Remove the object from the index when the current transaction is committed
+        """
+        indexed_instance = get_indexed_instance(instance, check_exists=False)
+        if indexed_instance is None:
+            return
+
+        # Django clears the primary key of deleted objects once they have all
+        # been deleted, so keep a copy of the object as it was
+        key = (get_root_model(type(instance)), instance.pk)
+        self._batch.get_pending()[key] = ('delete', copy.copy(indexed_instance))
+        self._batch.schedule()
+
+    def flush(self, pending):
+        """
+        Update the index with the objects queued in a transaction that has been committed
+        """
+        items = [(action, model_or_instance, pk) for (_, pk), (action, model_or_instance) in pending.items()]
+
+        if self.workers:
+            self.get_pool().apply_async(self.update_index_in_thread, (items, ))
+        else:
+            self.update_index(items)
+
+    def get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+
+            return self._pool
+
+    def update_index_in_thread(self, items):
+        try:
+            self.update_index(items)
+        except Exception:
+            logger.exception("Exception raised while updating the search index")
+        finally:
+            # Database connections opened by the thread aren't closed at the end of a request
+            connections.close_all()
+
+    def update_index(self, items):
+        pks_by_model = OrderedDict()
+        for action, model_or_instance, pk in items:
+            if action == 'delete':
+                remove_object(model_or_instance)
+            else:
+                pks_by_model.setdefault(model_or_instance, []).append(pk)
+
+        for model, pks in pks_by_model.items():
+            objects_by_model = OrderedDict()
+            for obj in model.get_indexed_objects().filter(pk__in=pks):
+                indexed_instance = obj.get_indexed_instance()
+                if indexed_instance is None:
+                    continue
+
+                # Objects that are indexed as a more specific model have to be
+                # in that model's indexed objects too
+                indexed_model = type(indexed_instance)
+                if indexed_model is not model and not indexed_model.get_indexed_objects().filter(pk=obj.pk).exists():
+                    continue
+
+                objects_by_model.setdefault(indexed_model, []).append(indexed_instance)
+
+            for indexed_model, objects in objects_by_model.items():
+                for backend_name, backend in get_search_backends_with_name(with_auto_update=True):
+                    try:
+                        backend.add_bulk(indexed_model, objects)
+                    except Exception:
+                        # Catch and log all errors
+                        logger.exception(
+                            "Exception raised while adding %d %s objects into the '%s' search backend",
+                            len(objects), indexed_model.__name__, backend_name)
+
+                bump_search_results_version(indexed_model)
+
+
+_buffer = None
+_buffer_params = None
+_buffer_lock = threading.Lock()
+
+
+def get_index_buffer():
+    """
+    Return the index buffer configured by TUIUIUSEARCH_INDEX_BUFFER, or None
+    if objects are indexed as soon as they are saved (the default)
+    """
+    global _buffer, _buffer_params
+
+    params = getattr(settings, 'TUIUIUSEARCH_INDEX_BUFFER', None)
+    if params is None:
+        return None
+
+    with _buffer_lock:
+        if _buffer is None or _buffer_params != params:
+            _buffer = IndexBuffer(params)
+            _buffer_params = params
+
+        return _buffer
+
+
+_suspended = threading.local()
+
+
+def auto_update_suspended():
+    return getattr(_suspended, 'depth', 0) > 0
+
+
+@contextmanager
+def suspend_auto_update():
+    """
+    Stop objects saved or deleted in the current thread within the block from
+    being indexed automatically, e.g. during a bulk import that is followed by
+    running the update_index command
+    """
+    _suspended.depth = getattr(_suspended, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _suspended.depth -= 1
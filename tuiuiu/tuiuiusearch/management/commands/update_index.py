@@ -1,13 +1,24 @@
 from __future__ import absolute_import, unicode_literals
 
 import collections
+import datetime
+import json
+import multiprocessing
+import os
+import time
 
+from django.apps import apps
 from django.conf import settings
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from tuiuiu.tuiuiusearch.backends import get_search_backend
 from tuiuiu.tuiuiusearch.index import get_indexed_models
+from tuiuiu.tuiuiusearch.models import IndexUpdate
+from tuiuiu.tuiuiusearch.utils import bump_search_results_version
 
 
 def group_models_by_index(backend, models):
@@ -51,8 +62,163 @@ def group_models_by_index(backend, models):
     ])
 
 
+def get_pk_ranges(queryset, chunk_size):
+    """
+    Split a queryset into ranges of at most ``chunk_size`` objects by primary
+    key. Returns a list of ``(lower_pk, upper_pk)`` tuples, each range
+    including the objects with ``lower_pk < pk <= upper_pk``. The first range
+    has no lower bound and the last one no upper bound (``None``).
+    """
+    pks = queryset.prefetch_related(None).order_by('pk').values_list('pk', flat=True)
+
+    ranges = []
+    lower_pk = None
+    while True:
+        remaining_pks = pks if lower_pk is None else pks.filter(pk__gt=lower_pk)
+
+        upper_pks = list(remaining_pks[chunk_size - 1:chunk_size])
+        if not upper_pks:
+            if remaining_pks.exists():
+                ranges.append((lower_pk, None))
+            return ranges
+
+        ranges.append((lower_pk, upper_pks[0]))
+        lower_pk = upper_pks[0]
+
+
+def get_objects_to_index(model, since=None):
+    if since is None:
+        return model.get_indexed_objects()
+
+    return model.get_indexed_objects_changed_since(since)
+
+
+def get_objects_in_pk_range(model, lower_pk, upper_pk, since=None):
+    objects = get_objects_to_index(model, since).order_by('pk')
+    if lower_pk is not None:
+        objects = objects.filter(pk__gt=lower_pk)
+    if upper_pk is not None:
+        objects = objects.filter(pk__lte=upper_pk)
+
+    return list(objects)
+
+
+def get_index(backend, model, index_name):
+    index = backend.get_index_for_model(model)
+    if index.name != index_name:
+        # Atomic rebuilds fill a new index, with a generated name
+        index = backend.index_class(backend, index_name)
+
+    return index
+
+
+def index_pk_range(task):
+    """
+    Index the objects of a model in a range of primary keys. Run by the worker
+    processes of ``update_index --workers``.
+    """
+    backend_name, model_label, index_name, pk_range, since = task
+
+    backend = get_search_backend(backend_name)
+    model = apps.get_model(model_label)
+    objects = get_objects_in_pk_range(model, pk_range[0], pk_range[1], since)
+    get_index(backend, model, index_name).add_items(model, objects)
+
+    return pk_range, len(objects)
+
+
+class Checkpoint(object):
+    """
+    Records the ranges of objects that have been indexed so far, in a JSON
+    file, so that an interrupted rebuild can be resumed
+    """
+    def __init__(self, path):
+        self.path = path
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+        else:
+            self.data = {}
+
+    def get_index_state(self, backend_name, index_name):
+        return self.data.get(backend_name, {}).get(index_name)
+
+    def start_index(self, backend_name, index_name, rebuilt_index_name):
+        self.data.setdefault(backend_name, {})[index_name] = {
+            'index': rebuilt_index_name,
+            'done': {},
+        }
+        self.save()
+
+    def finish_index(self, backend_name, index_name):
+        self.data.get(backend_name, {}).pop(index_name, None)
+        if not self.data.get(backend_name):
+            self.data.pop(backend_name, None)
+        self.save()
+
+    def get_done_ranges(self, backend_name, index_name, model):
+        index_state = self.get_index_state(backend_name, index_name)
+        if index_state is None:
+            return []
+
+        to_python = model._meta.pk.to_python
+        return [
+            tuple(None if pk is None else to_python(pk) for pk in pk_range)
+            for pk_range in index_state['done'].get(model._meta.label, [])
+        ]
+
+    def mark_done(self, backend_name, index_name, model, pk_range):
+        index_state = self.get_index_state(backend_name, index_name)
+        if index_state is not None:
+            index_state['done'].setdefault(model._meta.label, []).append(list(pk_range))
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+
+        if not self.data:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+
+        # Write the new file alongside the old one, then swap them, so that
+        # the checkpoint isn't lost if the process is killed while writing it
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, cls=DjangoJSONEncoder)
+        os.rename(tmp_path, self.path)
+
+
+def pk_range_is_done(pk_range, done_ranges):
+    lower_pk, upper_pk = pk_range
+
+    for done_lower_pk, done_upper_pk in done_ranges:
+        covers_lower = done_lower_pk is None or (lower_pk is not None and done_lower_pk <= lower_pk)
+        covers_upper = done_upper_pk is None or (upper_pk is not None and upper_pk <= done_upper_pk)
+        if covers_lower and covers_upper:
+            return True
+
+    return False
+
+
+def parse_since(value):
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError("'%s' is not a valid date or date/time" % value)
+        since = datetime.datetime.combine(date, datetime.time())
+
+    if settings.USE_TZ and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+
+    return since
+
+
 class Command(BaseCommand):
-    def update_backend(self, backend_name, schema_only=False):
+    def update_backend(self, backend_name, schema_only=False, workers=1, chunk_size=1000, checkpoint=None):
         self.stdout.write("Updating backend: " + backend_name)
 
         backend = get_search_backend(backend_name)
@@ -61,16 +227,36 @@ class Command(BaseCommand):
             self.stdout.write("Backend '%s' doesn't require rebuilding" % backend_name)
             return
 
+        if checkpoint is None:
+            checkpoint = Checkpoint(None)
+
         models_grouped_by_index = group_models_by_index(backend, get_indexed_models()).items()
         if not models_grouped_by_index:
             self.stdout.write(backend_name + ": No indices to rebuild")
 
         for index, models in models_grouped_by_index:
-            self.stdout.write(backend_name + ": Rebuilding index %s" % index.name)
-
-            # Start rebuild
+            index_name = index.name
             rebuilder = backend.rebuilder_class(index)
-            index = rebuilder.start()
+
+            # Rebuilders that add all of the objects in one transaction can't
+            # share the work with other processes, or resume it later
+            single_transaction = getattr(rebuilder, 'single_transaction', False)
+            index_workers = 1 if single_transaction else workers
+
+            index_state = None if single_transaction else checkpoint.get_index_state(backend_name, index_name)
+            if index_state is not None and not schema_only:
+                # Carry on adding objects to the index the interrupted rebuild was filling
+                self.stdout.write(backend_name + ": Resuming rebuild of index %s" % index_name)
+                rebuilder.index = get_index(backend, models[0], index_state['index'])
+                index = rebuilder.index
+            else:
+                self.stdout.write(backend_name + ": Rebuilding index %s" % index_name)
+
+                # Start rebuild
+                index = rebuilder.start()
+
+                if not schema_only and not single_transaction:
+                    checkpoint.start_index(backend_name, index_name, index.name)
 
             # Add models
             for model in models:
@@ -80,21 +266,101 @@ class Command(BaseCommand):
             object_count = 0
             if not schema_only:
                 for model in models:
-                    self.stdout.write('{}: {}.{} '.format(backend_name, model._meta.app_label, model.__name__).ljust(35), ending='')
-
-                    # Add items (1000 at a time)
-                    for chunk in self.print_iter_progress(self.queryset_chunks(model.get_indexed_objects().order_by('pk'))):
-                        index.add_items(model, chunk)
-                        object_count += len(chunk)
-
-                    self.print_newline()
+                    object_count += self.add_objects(
+                        backend_name, index_name, index, model, index_workers, chunk_size, checkpoint)
 
             # Finish rebuild
             rebuilder.finish()
+            checkpoint.finish_index(backend_name, index_name)
+
+            for model in models:
+                bump_search_results_version(model)
+
+            self.stdout.write(backend_name + ": indexed %d objects" % object_count)
+            self.print_newline()
+
+    def update_backend_changes(self, backend_name, since, workers=1, chunk_size=1000):
+        """
+        Update the existing indexes of the backend with the objects that have
+        changed since `since`, and remove the objects that no longer exist from
+        them
+        """
+        self.stdout.write("Updating backend: " + backend_name)
+
+        backend = get_search_backend(backend_name)
+
+        if not backend.rebuilder_class:
+            self.stdout.write("Backend '%s' doesn't require rebuilding" % backend_name)
+            return
+
+        self.stdout.write(backend_name + ": Indexing objects changed since %s" % since.isoformat())
+
+        for index, models in group_models_by_index(backend, get_indexed_models()).items():
+            self.stdout.write(backend_name + ": Updating index %s" % index.name)
+
+            for model in models:
+                index.add_model(model)
+
+            object_count = 0
+            for model in models:
+                object_count += self.add_objects(
+                    backend_name, index.name, index, model, workers, chunk_size, Checkpoint(None), since=since)
+
+            for model in models:
+                backend.delete_stale_entries(model)
+
+            index.refresh()
+
+            for model in models:
+                bump_search_results_version(model)
 
             self.stdout.write(backend_name + ": indexed %d objects" % object_count)
             self.print_newline()
 
+    def add_objects(self, backend_name, index_name, index, model, workers, chunk_size, checkpoint, since=None):
+        self.stdout.write('{}: {}.{} '.format(backend_name, model._meta.app_label, model.__name__).ljust(35), ending='')
+
+        done_ranges = checkpoint.get_done_ranges(backend_name, index_name, model)
+        pk_ranges = [
+            pk_range for pk_range in get_pk_ranges(get_objects_to_index(model, since), chunk_size)
+            if not pk_range_is_done(pk_range, done_ranges)
+        ]
+
+        start_time = time.time()
+        object_count = 0
+
+        if workers > 1 and len(pk_ranges) > 1:
+            # Worker processes open their own connections; they mustn't share
+            # the ones this process has open
+            connections.close_all()
+
+            pool = multiprocessing.Pool(workers)
+            try:
+                tasks = [(backend_name, model._meta.label, index.name, pk_range, since) for pk_range in pk_ranges]
+
+                # Each worker fetches and builds the documents for its range
+                # while the others send theirs
+                for pk_range, count in self.print_iter_progress(pool.imap_unordered(index_pk_range, tasks)):
+                    checkpoint.mark_done(backend_name, index_name, model, pk_range)
+                    object_count += count
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for pk_range in self.print_iter_progress(pk_ranges):
+                objects = get_objects_in_pk_range(model, pk_range[0], pk_range[1], since)
+                index.add_items(model, objects)
+                checkpoint.mark_done(backend_name, index_name, model, pk_range)
+                object_count += len(objects)
+
+        self.print_newline()
+
+        duration = time.time() - start_time
+        self.stdout.write(' ' * 35 + "%d objects in %.1fs (%.0f docs/sec)" % (
+            object_count, duration, object_count / duration if duration else 0))
+
+        return object_count
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--backend', action='store', dest='backend_name', default=None,
@@ -102,6 +368,21 @@ class Command(BaseCommand):
         parser.add_argument(
             '--schema-only', action='store_true', dest='schema_only', default=False,
             help="Prevents loading any data into the index")
+        parser.add_argument(
+            '--workers', action='store', dest='workers', type=int, default=1,
+            help="Number of processes to index objects with")
+        parser.add_argument(
+            '--chunk-size', action='store', dest='chunk_size', type=int, default=1000,
+            help="Number of objects to index at a time")
+        parser.add_argument(
+            '--checkpoint', action='store', dest='checkpoint', default=None,
+            help="File to record progress in, so that an interrupted rebuild can be resumed")
+        parser.add_argument(
+            '--since', action='store', dest='since', default=None,
+            help="Update the existing index with the objects changed since this date/time, rather than rebuilding it")
+        parser.add_argument(
+            '--changed-only', action='store_true', dest='changed_only', default=False,
+            help="Update the existing index with the objects changed since the command last ran")
 
     def handle(self, **options):
         # Get list of backends to index
@@ -115,9 +396,52 @@ class Command(BaseCommand):
             # index the 'default' backend only
             backend_names = ['default']
 
+        schema_only = options.get('schema_only', False)
+        workers = options.get('workers') or 1
+        chunk_size = options.get('chunk_size') or 1000
+
+        since = options.get('since')
+        if since:
+            since = parse_since(since)
+        incremental = bool(since) or options.get('changed_only', False)
+
+        if incremental and options.get('checkpoint'):
+            raise CommandError("--checkpoint can't be used with --since or --changed-only")
+
+        checkpoint = Checkpoint(options.get('checkpoint'))
+
+        last_runs = {}
+        if incremental and not since:
+            for backend_name in backend_names:
+                last_runs[backend_name] = IndexUpdate.get_last_run(backend_name)
+                if last_runs[backend_name] is None:
+                    raise CommandError(
+                        "update_index hasn't run for the '%s' backend before, so there is nothing to "
+                        "compare changes with; rebuild the index first, or use --since" % backend_name)
+
         # Update backends
         for backend_name in backend_names:
-            self.update_backend(backend_name, schema_only=options.get('schema_only', False))
+            # Objects changed while the command runs are picked up by the next incremental update
+            start_time = timezone.now()
+
+            if incremental:
+                self.update_backend_changes(
+                    backend_name,
+                    since or last_runs[backend_name],
+                    workers=workers,
+                    chunk_size=chunk_size,
+                )
+            else:
+                self.update_backend(
+                    backend_name,
+                    schema_only=schema_only,
+                    workers=workers,
+                    chunk_size=chunk_size,
+                    checkpoint=checkpoint,
+                )
+
+            if not schema_only:
+                IndexUpdate.set_last_run(backend_name, start_time)
 
     def print_newline(self):
         self.stdout.write('')
@@ -144,20 +468,3 @@ class Command(BaseCommand):
                 self.stdout.write(' ', ending='')
 
             self.stdout.flush()
-
-    # Atomic so the count of models doesnt change as it is iterated
-    @transaction.atomic
-    def queryset_chunks(self, qs, chunk_size=1000):
-        """
-        Yield a queryset in chunks of at most ``chunk_size``. The chunk yielded
-        will be a list, not a queryset. Iterating over the chunks is done in a
-        transaction so that the order and count of items in the queryset
-        remains stable.
-        """
-        i = 0
-        while True:
-            items = list(qs[i * chunk_size:][:chunk_size])
-            if not items:
-                break
-            yield items
-            i += 1
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tuiuiusearch', '0003_remove_editors_pick'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('backend_name', models.CharField(max_length=255, unique=True)),
+                ('last_run', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'index update',
+            },
+        ),
+    ]
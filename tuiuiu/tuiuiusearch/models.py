@@ -77,3 +77,24 @@ class QueryDailyHits(models.Model):
             ('query', 'date'),
         )
         verbose_name = _('Query Daily Hits')
+
+
+class IndexUpdate(models.Model):
+    """
+    The time that update_index last started updating a search backend, which
+    ``update_index --changed-only`` indexes the objects changed since
+    """
+    backend_name = models.CharField(max_length=255, unique=True)
+    last_run = models.DateTimeField()
+
+    @classmethod
+    def get_last_run(cls, backend_name):
+        index_update = cls.objects.filter(backend_name=backend_name).first()
+        return index_update.last_run if index_update else None
+
+    @classmethod
+    def set_last_run(cls, backend_name, last_run):
+        cls.objects.update_or_create(backend_name=backend_name, defaults={'last_run': last_run})
+
+    class Meta:
+        verbose_name = _('index update')
@@ -3,9 +3,19 @@ from __future__ import absolute_import, unicode_literals
 from django.db.models.signals import post_delete, post_save
 
 from tuiuiu.tuiuiusearch import index
+from tuiuiu.tuiuiusearch.index_buffer import auto_update_suspended, get_index_buffer
 
 
 def post_save_signal_handler(instance, update_fields=None, **kwargs):
+    if auto_update_suspended():
+        return
+
+    index_buffer = get_index_buffer()
+    if index_buffer is not None:
+        # The object is fetched from the database again when the buffer is flushed
+        index_buffer.add(instance)
+        return
+
     if update_fields is not None:
         # fetch a fresh copy of instance from the database to ensure
         # that we're not indexing any of the unsaved data contained in
@@ -16,6 +26,14 @@ def post_save_signal_handler(instance, update_fields=None, **kwargs):
 
 
 def post_delete_signal_handler(instance, **kwargs):
+    if auto_update_suspended():
+        return
+
+    index_buffer = get_index_buffer()
+    if index_buffer is not None:
+        index_buffer.delete(instance)
+        return
+
     index.remove_object(instance)
 
 
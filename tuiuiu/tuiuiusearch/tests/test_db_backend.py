@@ -2,9 +2,14 @@ from __future__ import absolute_import, unicode_literals
 
 import unittest
 
-from django.test import TestCase
+import mock
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
 
 from tuiuiu.tests.search import models
+from tuiuiu.tuiuiusearch.backends import get_search_backend
+from tuiuiu.tuiuiusearch.backends.db import DatabaseSearchResults
+from tuiuiu.tuiuiusearch.utils import get_search_results_version_cache_key
 
 from .test_backends import BackendTests
 
@@ -30,3 +35,113 @@ class TestDBBackend(BackendTests, TestCase):
         for result in results:
             # DB backend doesn't do scoring, so annotate_score should just add None
             self.assertIsNone(result._score)
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    },
+    TUIUIUSEARCH_BACKENDS={
+        'default': {
+            'BACKEND': 'tuiuiu.tuiuiusearch.backends.db',
+        },
+    },
+    TUIUIUSEARCH_RESULTS_CACHE='default',
+)
+# The local memory cache stands in for a cache shared between processes
+@mock.patch('tuiuiu.tuiuiucore.utils.cache_is_shared', lambda cache: True)
+class TestSearchResultsCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.backend = get_search_backend()
+
+        # on_commit callbacks are never run inside a TestCase, so collect them instead
+        self.on_commit_callbacks = []
+        on_commit_patcher = mock.patch('tuiuiu.tuiuiucore.utils.on_commit', self.on_commit_callbacks.append)
+        on_commit_patcher.start()
+        self.addCleanup(on_commit_patcher.stop)
+
+        self.hello = models.SearchTest.objects.create(title="Hello World", live=True)
+        self.hello_again = models.SearchTest.objects.create(title="Hello again")
+        self.commit()
+
+    def commit(self):
+        for callback in self.on_commit_callbacks:
+            callback()
+        self.on_commit_callbacks[:] = []
+
+    def test_results_are_cached(self):
+        results = list(self.backend.search("Hello", models.SearchTest))
+        self.assertEqual(set(results), {self.hello, self.hello_again})
+
+        # Only the objects are fetched the second time round, and the query
+        # string is normalised
+        with mock.patch.object(DatabaseSearchResults, '_do_search', side_effect=AssertionError):
+            with self.assertNumQueries(1):
+                self.assertEqual(list(self.backend.search("  hello ", models.SearchTest)), results)
+
+    def test_count_is_cached(self):
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 2)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 2)
+
+    def test_filters_and_slices_are_cached_separately(self):
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 2)
+        self.assertEqual(self.backend.search("Hello", models.SearchTest.objects.filter(live=True)).count(), 1)
+        self.assertEqual(self.backend.search("Hello", models.SearchTest)[:1].count(), 1)
+        self.assertEqual(self.backend.search("World", models.SearchTest).count(), 1)
+
+    def test_indexing_invalidates_cache(self):
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 2)
+
+        models.SearchTest.objects.create(title="Hello once more")
+
+        # This thread sees its own changes before they are committed, but
+        # doesn't cache them
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 3)
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 3)
+
+        self.commit()
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 3)
+
+    def test_not_cached_until_changes_are_searchable(self):
+        # Such as Elasticsearch, which only refreshes its index every second
+        self.backend.refresh_delay = 60
+        models.SearchTest.objects.create(title="Hello once more")
+        self.commit()
+
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 3)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 3)
+
+    @override_settings(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+            'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'search'},
+        },
+        TUIUIUSEARCH_RESULTS_CACHE='search',
+    )
+    def test_version_kept_in_results_cache(self):
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 2)
+
+        models.SearchTest.objects.create(title="Hello once more")
+        self.commit()
+
+        version_key = get_search_results_version_cache_key(models.SearchTest)
+        self.assertIsNotNone(caches['search'].get(version_key))
+        self.assertIsNone(caches['default'].get(version_key))
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 3)
+
+    @override_settings(TUIUIUSEARCH_RESULTS_CACHE=None)
+    def test_not_cached_by_default(self):
+        self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.backend.search("Hello", models.SearchTest).count(), 2)
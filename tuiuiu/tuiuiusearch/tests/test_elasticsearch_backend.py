@@ -12,11 +12,13 @@ from django.core import management
 from django.db.models import Q
 from django.test import TestCase
 from django.utils.six import StringIO
+from elasticsearch.helpers import BulkIndexError
 from elasticsearch.serializer import JSONSerializer
 
 from tuiuiu.tests.search import models
 from tuiuiu.tuiuiusearch.backends import get_search_backend
-from tuiuiu.tuiuiusearch.backends.elasticsearch import ElasticsearchSearchBackend
+from tuiuiu.tuiuiusearch.backends.elasticsearch import ElasticsearchSearchBackend, get_bulk_chunks
+from tuiuiu.utils.pagination import paginate
 
 from .test_backends import BackendTests
 
@@ -582,7 +584,7 @@ class TestElasticsearchSearchResults(TestCase):
         query.get_sort.return_value = None
         return backend.results_class(backend, query)
 
-    def construct_search_response(self, results):
+    def construct_search_response(self, results, total=None):
         return {
             '_shards': {'failed': 0, 'successful': 5, 'total': 5},
             'hits': {
@@ -599,7 +601,7 @@ class TestElasticsearchSearchResults(TestCase):
                     for result in results
                 ],
                 'max_score': 1,
-                'total': len(results)
+                'total': len(results) if total is None else total
             },
             'timed_out': False,
             'took': 2
@@ -738,6 +740,36 @@ class TestElasticsearchSearchResults(TestCase):
         self.assertEqual(results[1], self.objects[1])
         self.assertEqual(results[2], self.objects[0])
 
+    @mock.patch('elasticsearch.Elasticsearch.count')
+    @mock.patch('elasticsearch.Elasticsearch.search')
+    def test_count_uses_total_from_search(self, search, count):
+        search.return_value = self.construct_search_response(
+            [self.objects[0].id, self.objects[1].id], total=25
+        )
+        results = self.get_results()
+
+        list(results[:2])  # Performs search
+
+        self.assertEqual(results.count(), 25)
+        self.assertEqual(results[20:].count(), 5)
+        self.assertEqual(results[30:].count(), 0)
+        count.assert_not_called()
+
+    @mock.patch('elasticsearch.Elasticsearch.count')
+    @mock.patch('elasticsearch.Elasticsearch.search')
+    def test_paginate_with_one_search(self, search, count):
+        search.return_value = self.construct_search_response(
+            [self.objects[0].id, self.objects[1].id], total=12
+        )
+        request = mock.Mock(GET={'p': '2'})
+
+        paginator, page = paginate(request, self.get_results(), per_page=10)
+
+        self.assertEqual(paginator.count, 12)
+        self.assertEqual(list(page), [self.objects[0], self.objects[1]])
+        self.assertEqual(search.call_count, 1)
+        count.assert_not_called()
+
 
 class TestElasticsearchMapping(TestCase):
     def assertDictEqual(self, a, b):
@@ -832,6 +864,116 @@ class TestElasticsearchMapping(TestCase):
 
         self.assertDictEqual(document, expected_result)
 
+    @mock.patch('elasticsearch.Elasticsearch.bulk')
+    def test_add_items_fetches_related_objects_once(self, bulk):
+        bulk.side_effect = BulkResponse()
+
+        for i in range(5):
+            obj = models.SearchTest.objects.create(title="Test %d" % i)
+            obj.tags.add("tag %d" % i)
+            obj.subobjects.create(name="Subobject %d" % i)
+
+        backend = ElasticsearchSearchBackend({})
+        index = backend.get_index_for_model(models.SearchTest)
+        objects = list(models.SearchTest.objects.all())
+
+        # One query for the tags and one for the subobjects, however many objects there are
+        with self.assertNumQueries(2):
+            index.add_items(models.SearchTest, objects)
+
+        docs = bulk.side_effect.docs
+        self.assertEqual(len(docs), 6)
+        self.assertEqual(docs[-1]['tags'], [{'name': 'tag 4', 'slug_filter': 'tag-4'}])
+
+
+class BulkResponse(object):
+    """
+    Stands in for Elasticsearch.bulk, recording the documents sent in each
+    request and failing to index those with the given titles
+    """
+    def __init__(self, failing_titles=()):
+        self.failing_titles = failing_titles
+        self.requests = []
+        self.docs = []
+
+    def __call__(self, body, **kwargs):
+        lines = body.strip().split('\n')
+        actions = [json.loads(line) for line in lines[0::2]]
+        docs = [json.loads(line) for line in lines[1::2]]
+        self.requests.append(docs)
+        self.docs.extend(docs)
+
+        items = []
+        for action, doc in zip(actions, docs):
+            if doc.get('title') in self.failing_titles:
+                items.append({'index': {'_id': action['index']['_id'], 'status': 400, 'error': 'MapperParsingException'}})
+            else:
+                items.append({'index': {'_id': action['index']['_id'], 'status': 201}})
+
+        return {'took': 1, 'errors': any(item['index']['status'] != 201 for item in items), 'items': items}
+
+
+@mock.patch('elasticsearch.Elasticsearch.bulk')
+class TestElasticsearchBulkIndexing(TestCase):
+    def setUp(self):
+        self.objects = [models.SearchTest.objects.create(title="Test %d" % i) for i in range(10)]
+
+    def add_items(self, **params):
+        backend = ElasticsearchSearchBackend(params)
+        backend.get_index_for_model(models.SearchTest).add_items(models.SearchTest, self.objects)
+
+    def test_get_bulk_chunks(self, bulk):
+        serializer = JSONSerializer()
+        actions = [({'index': {'_id': i}}, {'title': 'x' * 10}) for i in range(5)]
+
+        chunks = list(get_bulk_chunks(iter(actions), 2, 1000, serializer))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+
+        # Each action and document is about 40 bytes
+        chunks = list(get_bulk_chunks(iter(actions), 10, 100, serializer))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+
+        # Documents larger than the limit are sent by themselves
+        chunks = list(get_bulk_chunks(iter(actions), 10, 10, serializer))
+        self.assertEqual([len(chunk) for chunk in chunks], [1, 1, 1, 1, 1])
+
+    def test_chunk_size(self, bulk):
+        bulk.side_effect = BulkResponse()
+
+        self.add_items(BULK_CHUNK_SIZE=4)
+
+        self.assertEqual([len(docs) for docs in bulk.side_effect.requests], [4, 4, 2])
+
+    def test_max_chunk_bytes(self, bulk):
+        bulk.side_effect = BulkResponse()
+
+        self.add_items(BULK_MAX_CHUNK_BYTES=1000)
+
+        self.assertGreater(len(bulk.side_effect.requests), 1)
+        self.assertEqual(len(bulk.side_effect.docs), 10)
+
+    def test_threads(self, bulk):
+        bulk.side_effect = BulkResponse()
+
+        self.add_items(BULK_CHUNK_SIZE=2, BULK_THREADS=3)
+
+        self.assertEqual(len(bulk.side_effect.requests), 5)
+        self.assertEqual(
+            sorted(doc['pk'] for doc in bulk.side_effect.docs),
+            sorted(str(obj.pk) for obj in self.objects))
+
+    def test_failed_documents_reported(self, bulk):
+        bulk.side_effect = BulkResponse(failing_titles=["Test 1", "Test 8"])
+
+        with self.assertRaises(BulkIndexError) as e:
+            self.add_items(BULK_CHUNK_SIZE=4)
+
+        # All of the chunks are sent, and every failure reported
+        self.assertEqual(len(bulk.side_effect.requests), 3)
+        self.assertEqual(
+            [error['index']['_id'] for error in e.exception.errors],
+            ['searchtests_searchtest:%d' % self.objects[1].pk, 'searchtests_searchtest:%d' % self.objects[8].pk])
+
 
 class TestElasticsearchMappingInheritance(TestCase):
     def assertDictEqual(self, a, b):
@@ -2,13 +2,15 @@ from __future__ import absolute_import, unicode_literals
 
 import mock
 
-from django.test import TestCase, override_settings
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 
 from tuiuiu.tests.search import models
 from tuiuiu.tests.testapp.models import SimplePage
 from tuiuiu.tests.utils import TuiuiuTestUtils
 from tuiuiu.tuiuiucore.models import Page
 from tuiuiu.tuiuiusearch import index
+from tuiuiu.tuiuiusearch.index_buffer import suspend_auto_update
 
 
 class TestGetIndexedInstance(TestCase):
@@ -179,3 +181,116 @@ class TestSignalHandlers(TestCase, TuiuiuTestUtils):
         indexed_object = backend().add.call_args[0][0]
         self.assertEqual(indexed_object.title, "Updated test")
         self.assertEqual(indexed_object.content, "This is the original content")
+
+
+@mock.patch('tuiuiu.tuiuiusearch.tests.DummySearchBackend', create=True)
+@override_settings(
+    TUIUIUSEARCH_BACKENDS={
+        'default': {
+            'BACKEND': 'tuiuiu.tuiuiusearch.tests.DummySearchBackend'
+        }
+    },
+    TUIUIUSEARCH_INDEX_BUFFER={}
+)
+class TestIndexBuffer(TestCase, TuiuiuTestUtils):
+    def setUp(self):
+        # on_commit callbacks are never run inside a TestCase, so collect them instead
+        self.on_commit_callbacks = []
+        on_commit_patcher = mock.patch('tuiuiu.utils.transaction.on_commit', self.on_commit_callbacks.append)
+        on_commit_patcher.start()
+        self.addCleanup(on_commit_patcher.stop)
+
+    def commit(self):
+        for callback in self.on_commit_callbacks:
+            callback()
+        self.on_commit_callbacks[:] = []
+
+    def test_indexes_on_commit(self, backend):
+        backend().reset_mock()
+        obj = models.SearchTest.objects.create(title="Test")
+
+        self.assertFalse(backend().add_bulk.mock_calls)
+
+        self.commit()
+
+        backend().add_bulk.assert_called_once_with(models.SearchTest, [obj])
+        self.assertFalse(backend().add.mock_calls)
+
+    def test_deduplicates_objects(self, backend):
+        backend().reset_mock()
+        obj = models.SearchTest.objects.create(title="Test")
+        models.SearchTest.objects.create(title="Other test")
+        obj.title = "Updated test"
+        obj.save()
+        obj.save(update_fields=['title'])
+
+        self.commit()
+
+        backend().add_bulk.assert_called_once()
+        model, indexed_objects = backend().add_bulk.call_args[0]
+        self.assertEqual(model, models.SearchTest)
+        self.assertEqual(sorted(o.title for o in indexed_objects), ["Other test", "Updated test"])
+
+    def test_indexes_specific_class(self, backend):
+        obj = models.SearchTestChild.objects.create(title="Test", extra_content="Extra")
+        obj.searchtest_ptr.save()
+
+        self.commit()
+
+        backend().add_bulk.assert_called_once_with(models.SearchTestChild, [obj])
+
+    def test_delete_cancels_add(self, backend):
+        obj = models.SearchTest.objects.create(title="Test")
+        pk = obj.pk
+        obj.delete()
+
+        self.commit()
+
+        self.assertFalse(backend().add_bulk.mock_calls)
+        backend().delete.assert_called_once()
+        deleted_object = backend().delete.call_args[0][0]
+        self.assertEqual(deleted_object.pk, pk)
+
+    def test_suspend_auto_update(self, backend):
+        backend().reset_mock()
+
+        with suspend_auto_update():
+            models.SearchTest.objects.create(title="Test")
+
+        self.commit()
+
+        self.assertFalse(backend().add_bulk.mock_calls)
+
+    def test_schedules_one_update_per_transaction(self, backend):
+        models.SearchTest.objects.create(title="Test")
+        models.SearchTest.objects.create(title="Other test")
+
+        self.assertEqual(len(self.on_commit_callbacks), 1)
+
+
+@mock.patch('tuiuiu.tuiuiusearch.tests.DummySearchBackend', create=True)
+@override_settings(
+    TUIUIUSEARCH_BACKENDS={
+        'default': {
+            'BACKEND': 'tuiuiu.tuiuiusearch.tests.DummySearchBackend'
+        }
+    },
+    TUIUIUSEARCH_INDEX_BUFFER={}
+)
+class TestIndexBufferRollback(TransactionTestCase):
+    def test_rolled_back_delete_not_applied(self, backend):
+        obj = models.SearchTest.objects.create(title="Test")
+
+        backend().reset_mock()
+        try:
+            with transaction.atomic():
+                obj.delete()
+                raise RuntimeError("Roll back")
+        except RuntimeError:
+            pass
+
+        with transaction.atomic():
+            other_obj = models.SearchTest.objects.create(title="Other test")
+
+        self.assertFalse(backend().delete.mock_calls)
+        backend().add_bulk.assert_called_once_with(models.SearchTest, [other_obj])
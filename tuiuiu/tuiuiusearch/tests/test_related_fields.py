@@ -86,3 +86,54 @@ class TestSelectOnQuerySet(TestCase):
         # Tags should be prefetch_related
         self.assertIn('tags', queryset._prefetch_related_lookups)
         self.assertFalse(queryset.query.select_related)
+
+    def test_select_on_queryset_with_nested_foreign_key(self):
+        fields = index.RelatedFields('page', [
+            index.RelatedFields('owner', [
+                index.SearchField('username'),
+            ]),
+        ])
+
+        queryset = fields.select_on_queryset(SearchTestChild.objects.all())
+
+        # ForeignKeys within a ForeignKey should be select_related along with it
+        self.assertFalse(queryset._prefetch_related_lookups)
+        self.assertEqual(queryset.query.select_related, {'page': {'owner': {}}})
+
+    def test_select_on_queryset_with_foreign_key_in_reverse_foreign_key(self):
+        fields = index.RelatedFields('categories', [
+            index.RelatedFields('category', [
+                index.SearchField('name')
+            ])
+        ])
+
+        queryset = fields.select_on_queryset(ManyToManyBlogPage.objects.all())
+
+        # Relations within a prefetched relation should be prefetched too
+        self.assertEqual(list(queryset._prefetch_related_lookups), ['categories', 'categories__category'])
+        self.assertFalse(queryset.query.select_related)
+
+
+class TestPrefetchIndexedRelatedObjects(TestCase):
+    def setUp(self):
+        for i in range(3):
+            obj = SearchTest.objects.create(title="Test %d" % i)
+            obj.tags.add("tag %d" % i)
+            obj.subobjects.create(name="Subobject %d" % i)
+
+    def test_prefetch_indexed_related_objects(self):
+        objects = list(SearchTest.objects.all())
+
+        with self.assertNumQueries(2):
+            SearchTest.prefetch_indexed_related_objects(objects)
+
+        with self.assertNumQueries(0):
+            for obj in objects:
+                self.assertEqual(len(obj.tags.all()), 1)
+                self.assertEqual(len(obj.subobjects.all()), 1)
+
+    def test_prefetch_indexed_related_objects_already_fetched(self):
+        objects = list(SearchTest.get_indexed_objects())
+
+        with self.assertNumQueries(0):
+            SearchTest.prefetch_indexed_related_objects(objects)
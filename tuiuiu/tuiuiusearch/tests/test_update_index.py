@@ -0,0 +1,199 @@
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+from django.core import management
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+
+from tuiuiu.tests.search import models
+from tuiuiu.tuiuiusearch.backends.base import BaseSearchBackend
+from tuiuiu.tuiuiusearch.management.commands.update_index import (
+    get_pk_ranges, index_pk_range, pk_range_is_done)
+from tuiuiu.tuiuiusearch.models import IndexUpdate
+
+
+class RecordingIndex(object):
+    # Shared by all instances, as the command and its workers create their own
+    added_items = []
+    fail_after = None
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def add_model(self, model):
+        pass
+
+    def add_items(self, model, items):
+        if self.fail_after is not None and len(self.added_items) >= self.fail_after:
+            raise ValueError("Indexing failed")
+
+        self.added_items.extend((self.name, model, item.pk) for item in items)
+
+    def refresh(self):
+        pass
+
+
+class RecordingRebuilder(object):
+    started = 0
+
+    def __init__(self, index):
+        self.index = index
+
+    def start(self):
+        RecordingRebuilder.started += 1
+        self.index = self.index.backend.index_class(self.index.backend, 'rebuilt_%d' % self.started)
+        return self.index
+
+    def finish(self):
+        pass
+
+
+class RecordingSearchBackend(BaseSearchBackend):
+    index_class = RecordingIndex
+    rebuilder_class = RecordingRebuilder
+    stale_entries_deleted = []
+
+    def get_index_for_model(self, model):
+        if model is models.SearchTest:
+            return self.index_class(self, 'searchtest')
+
+    def delete_stale_entries(self, model):
+        self.stale_entries_deleted.append(model)
+
+
+SearchBackend = RecordingSearchBackend
+
+
+@override_settings(TUIUIUSEARCH_BACKENDS={
+    'default': {
+        'BACKEND': 'tuiuiu.tuiuiusearch.tests.test_update_index',
+    }
+})
+class TestUpdateIndex(TestCase):
+    def setUp(self):
+        RecordingIndex.added_items = []
+        RecordingIndex.fail_after = None
+        RecordingRebuilder.started = 0
+        RecordingSearchBackend.stale_entries_deleted = []
+
+        self.objects = [models.SearchTest.objects.create(title="Test %d" % i) for i in range(5)]
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.tmp_dir, 'checkpoint.json')
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def update_index(self, **options):
+        management.call_command('update_index', backend_name='default', stdout=StringIO(), **options)
+
+    def get_added_pks(self):
+        return sorted(pk for name, model, pk in RecordingIndex.added_items)
+
+    def test_get_pk_ranges(self):
+        pks = [obj.pk for obj in self.objects]
+
+        self.assertEqual(get_pk_ranges(models.SearchTest.get_indexed_objects(), 2), [
+            (None, pks[1]),
+            (pks[1], pks[3]),
+            (pks[3], None),
+        ])
+        self.assertEqual(get_pk_ranges(models.SearchTest.get_indexed_objects(), 5), [
+            (None, pks[4]),
+        ])
+        self.assertEqual(get_pk_ranges(models.SearchTest.objects.none(), 5), [])
+
+    def test_pk_range_is_done(self):
+        self.assertTrue(pk_range_is_done((2, 4), [(None, 4)]))
+        self.assertTrue(pk_range_is_done((2, None), [(1, None)]))
+        self.assertFalse(pk_range_is_done((2, None), [(1, 10)]))
+        self.assertFalse(pk_range_is_done((None, 4), [(1, 10)]))
+
+    def test_index_pk_range(self):
+        # Run by worker processes, which find the index being rebuilt by its name
+        pk_range = (self.objects[0].pk, self.objects[2].pk)
+        result = index_pk_range(('default', 'searchtests.SearchTest', 'rebuilt_1', pk_range, None))
+
+        self.assertEqual(result, (pk_range, 2))
+        self.assertEqual(RecordingIndex.added_items, [
+            ('rebuilt_1', models.SearchTest, self.objects[1].pk),
+            ('rebuilt_1', models.SearchTest, self.objects[2].pk),
+        ])
+
+    def test_update_index_in_chunks(self):
+        self.update_index(chunk_size=2, checkpoint=self.checkpoint_path)
+
+        self.assertEqual(self.get_added_pks(), sorted(obj.pk for obj in self.objects))
+        self.assertEqual({name for name, model, pk in RecordingIndex.added_items}, {'rebuilt_1'})
+
+        # The checkpoint is removed once the rebuild has finished
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_resume_interrupted_rebuild(self):
+        RecordingIndex.fail_after = 2
+
+        with self.assertRaises(ValueError):
+            self.update_index(chunk_size=2, checkpoint=self.checkpoint_path)
+
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        self.assertEqual(checkpoint['default']['searchtest']['index'], 'rebuilt_1')
+        self.assertEqual(checkpoint['default']['searchtest']['done'], {
+            'searchtests.SearchTest': [[None, self.objects[1].pk]],
+        })
+
+        RecordingIndex.fail_after = None
+        self.update_index(chunk_size=2, checkpoint=self.checkpoint_path)
+
+        # The rebuild carried on filling the same index, without indexing the first range again
+        self.assertEqual(RecordingRebuilder.started, 1)
+        self.assertEqual(self.get_added_pks(), sorted(obj.pk for obj in self.objects))
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    @mock.patch.object(models.SearchTest, 'search_timestamp_fields', ['published_date'])
+    def test_update_changes_since(self):
+        self.objects[1].published_date = datetime.date(2017, 6, 1)
+        self.objects[1].save()
+        self.objects[3].published_date = datetime.date(2017, 1, 1)
+        self.objects[3].save()
+
+        self.update_index(since='2017-03-01')
+
+        # The existing index is updated instead of being rebuilt
+        self.assertEqual(RecordingRebuilder.started, 0)
+        self.assertEqual(RecordingIndex.added_items, [('searchtest', models.SearchTest, self.objects[1].pk)])
+        self.assertEqual(RecordingSearchBackend.stale_entries_deleted, [models.SearchTest])
+
+    @mock.patch.object(models.SearchTest, 'search_timestamp_fields', ['published_date'])
+    def test_update_changes_since_last_run(self):
+        self.update_index()
+        self.assertTrue(IndexUpdate.objects.filter(backend_name='default').exists())
+
+        RecordingIndex.added_items = []
+        RecordingRebuilder.started = 0
+        self.objects[2].published_date = datetime.date.today() + datetime.timedelta(days=1)
+        self.objects[2].save()
+
+        self.update_index(changed_only=True)
+        self.assertEqual(self.get_added_pks(), [self.objects[2].pk])
+        self.assertEqual(RecordingRebuilder.started, 0)
+
+    def test_changed_only_needs_previous_run(self):
+        # Rather than silently indexing everything again
+        with self.assertRaises(management.CommandError):
+            self.update_index(changed_only=True)
+
+        self.assertEqual(RecordingIndex.added_items, [])
+
+    def test_checkpoint_only_for_rebuilds(self):
+        with self.assertRaises(management.CommandError):
+            self.update_index(since='2017-03-01', checkpoint=self.checkpoint_path)
+
+    def test_invalid_since(self):
+        with self.assertRaises(management.CommandError):
+            self.update_index(since='yesterday')
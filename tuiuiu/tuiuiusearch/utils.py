@@ -1,6 +1,13 @@
 from __future__ import absolute_import, unicode_literals
 
 import string
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from tuiuiu.tuiuiucore.utils import bump_cache_version_on_commit, get_cache_version
 
 MAX_QUERY_STRING_LENGTH = 255
 
@@ -19,3 +26,68 @@ def normalise_query_string(query_string):
     query_string = ' '.join(query_string.split())
 
     return query_string
+
+
+SEARCH_RESULTS_VERSION_CACHE_KEY_PREFIX = 'tuiuiusearch_results_version_'
+
+
+def get_search_results_cache():
+    """
+    Return the cache that search results are stored in, as configured by
+    TUIUIUSEARCH_RESULTS_CACHE, or None if they aren't cached (the default)
+    """
+    alias = getattr(settings, 'TUIUIUSEARCH_RESULTS_CACHE', None)
+    if alias is None:
+        return None
+
+    return caches[alias]
+
+
+def get_search_results_version_cache_key(model):
+    # Models using multi-table inheritance share their root model's version, as
+    # searching the root model also finds them
+    parents = model._meta.get_parent_list()
+    if parents:
+        model = list(parents)[-1]
+
+    return SEARCH_RESULTS_VERSION_CACHE_KEY_PREFIX + model._meta.label_lower
+
+
+def get_search_results_version(model):
+    """
+    Return the version stamp of the model's cached search results, kept in the
+    search results cache, and the time it was last replaced (None if not
+    known). Returns (None, None) if search results can't be cached.
+    """
+    cache = get_search_results_cache()
+    if cache is None:
+        return None, None
+
+    version = get_cache_version(get_search_results_version_cache_key(model), cache)
+    if version is None:
+        return None, None
+
+    changed_at = None
+    if ':' in version:
+        changed_at = float(version.split(':', 1)[1])
+
+    return version, changed_at
+
+
+def set_search_results_version(key, cache):
+    # The time of the change is kept with the version, as some backends take a
+    # moment to make changes searchable
+    cache.set(key, '%s:%r' % (uuid.uuid4().hex, time.time()), None)
+
+
+def bump_search_results_version(model):
+    """
+    Invalidate the cached search results for the model once its objects have
+    been changed in the index and the current transaction is committed.
+    Searches made before then could miss the changes, and be cached under the
+    new version.
+    """
+    cache = get_search_results_cache()
+    if cache is not None:
+        bump_cache_version_on_commit(
+            get_search_results_version_cache_key(model), cache, bump=set_search_results_version)
@@ -19,6 +19,7 @@ from tuiuiu.tuiuiucore import hooks
 from tuiuiu.tuiuiucore.models import (
     PAGE_PERMISSION_TYPE_CHOICES, PAGE_PERMISSION_TYPES, GroupPagePermission, Page,
     UserPagePermissionsProxy)
+from tuiuiu.tuiuiucore.page_permissions import bump_page_permissions_version
 from tuiuiu.tuiuiuusers.models import UserProfile
 
 
@@ -330,6 +331,10 @@ class BaseGroupPagePermissionFormSet(forms.BaseFormSet):
             for (page, permission_type) in permissions_to_add
         ])
 
+        # bulk_create doesn't send the post_save signal that invalidates the
+        # users' page permission indexes
+        bump_page_permissions_version()
+
     def as_admin_panel(self):
         return render_to_string('tuiuiuusers/groups/includes/page_permissions_formset.html', {
             'formset': self
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, unicode_literals
 
+import mock
 from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group, Permission
@@ -13,8 +14,8 @@ from tuiuiu.tests.utils import TuiuiuTestUtils
 from tuiuiu.tuiuiucore import hooks
 from tuiuiu.tuiuiucore.compat import AUTH_USER_APP_LABEL, AUTH_USER_MODEL_NAME
 from tuiuiu.tuiuiucore.models import (
-    Collection, GroupCollectionPermission, GroupPagePermission, Page)
-from tuiuiu.tuiuiuusers.forms import UserCreationForm, UserEditForm
+    Collection, GroupCollectionPermission, GroupPagePermission, Page, UserPagePermissionsProxy)
+from tuiuiu.tuiuiuusers.forms import GroupPagePermissionFormSet, UserCreationForm, UserEditForm
 from tuiuiu.tuiuiuusers.models import UserProfile
 from tuiuiu.tuiuiuusers.views.users import get_user_creation_form, get_user_edit_form
 
@@ -901,3 +902,46 @@ class TestGroupEditView(TestCase, TuiuiuTestUtils):
         # See that the non-registered permission is still there
         self.assertEqual(self.test_group.permissions.count(), 1)
         self.assertEqual(self.test_group.permissions.all()[0], self.non_registered_perm)
+
+
+class TestGroupPagePermissionFormSet(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        # on_commit callbacks are never run inside a TestCase, so collect them instead
+        self.on_commit_callbacks = []
+        on_commit_patcher = mock.patch('tuiuiu.tuiuiucore.utils.on_commit', self.on_commit_callbacks.append)
+        on_commit_patcher.start()
+        self.addCleanup(on_commit_patcher.stop)
+
+        self.group = Group.objects.create(name='Test group')
+        get_user_model().objects.get(username='eventeditor').groups.add(self.group)
+        self.commit()
+
+    def commit(self):
+        for callback in self.on_commit_callbacks:
+            callback()
+        self.on_commit_callbacks[:] = []
+
+    def can_publish(self, page):
+        user = get_user_model().objects.get(username='eventeditor')
+        return UserPagePermissionsProxy(user).for_page(page).can_publish()
+
+    def test_saving_formset_invalidates_permission_indexes(self):
+        christmas_page = Page.objects.get(url_path='/home/events/christmas/')
+        self.assertFalse(self.can_publish(christmas_page))
+
+        formset = GroupPagePermissionFormSet({
+            'page_permissions-0-page': christmas_page.pk,
+            'page_permissions-0-permission_types': ['publish'],
+            'page_permissions-TOTAL_FORMS': '1',
+            'page_permissions-INITIAL_FORMS': '0',
+        }, instance=self.group)
+        self.assertTrue(formset.is_valid())
+        formset.save()
+
+        # The permissions are added with bulk_create, which sends no signals
+        self.assertEqual(GroupPagePermission.objects.filter(group=self.group).count(), 1)
+
+        self.commit()
+        self.assertTrue(self.can_publish(christmas_page))
@@ -15,3 +15,15 @@ def user_is_anonymous(user):
         return user.is_anonymous
     else:
         return user.is_anonymous()
+
+
+def on_commit(func):
+    """
+    Call `func` once the current transaction is committed. Django 1.8 can't
+    defer it, so it is called straight away.
+    """
+    if django.VERSION >= (1, 9):
+        from django.db import transaction
+        transaction.on_commit(func)
+    else:
+        func()
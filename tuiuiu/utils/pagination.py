@@ -4,6 +4,8 @@ from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.utils.http import urlencode
 from django.utils.six.moves.urllib.parse import parse_qs
 
+from tuiuiu.tuiuiusearch.backends.base import BaseSearchResults
+
 
 DEFAULT_PAGE_KEY = 'p'
 
@@ -11,6 +13,17 @@ DEFAULT_PAGE_KEY = 'p'
 def paginate(request, items, page_key=DEFAULT_PAGE_KEY, per_page=20):
     page = request.GET.get(page_key, 1)
 
+    # Search results get the total count along with a page of results, so
+    # fetch the page first to save the paginator querying the count separately
+    if isinstance(items, BaseSearchResults):
+        try:
+            page_number = int(page)
+        except (TypeError, ValueError):
+            page_number = 1
+
+        if page_number >= 1:
+            list(items[(page_number - 1) * per_page:page_number * per_page])
+
     paginator = Paginator(items, per_page)
     try:
         page = paginator.page(page)
@@ -0,0 +1,67 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+from collections import OrderedDict
+
+from django.db import connection
+
+from tuiuiu.utils.compat import on_commit
+
+
+class CommitBatch(object):
+    """
+    Collects the items added in each transaction (or savepoint) of the default
+    database, and passes them to `callback` as an OrderedDict once it is
+    committed, or straight away outside of a transaction.
+
+    The items are kept for the transaction and savepoint they were added in,
+    and the callback that receives them is registered with on_commit there, so
+    rolling either back discards them along with the callback. (Django
+    replaces its list of on_commit callbacks whenever a transaction or
+    savepoint ends, which is how a batch that has gone is recognised.)
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self._local = threading.local()
+
+    def get_current(self):
+        run_on_commit = getattr(connection, 'run_on_commit', None)
+        savepoint_ids = list(getattr(connection, 'savepoint_ids', []))
+
+        batch = getattr(self._local, 'batch', None)
+        if batch is None or batch.run_on_commit is not run_on_commit or batch.savepoint_ids != savepoint_ids:
+            batch = self._local.batch = _Batch(run_on_commit, savepoint_ids)
+
+        return batch
+
+    def get_pending(self):
+        """
+        Return the items added in the current transaction so far, to be added to
+        """
+        return self.get_current().pending
+
+    def schedule(self):
+        """
+        Pass the current transaction's items to the callback once it is
+        committed. Call after adding to them; it is only registered once.
+        """
+        batch = self.get_current()
+        if not batch.scheduled:
+            batch.scheduled = True
+            on_commit(lambda: self.run(batch))
+
+    def run(self, batch):
+        if getattr(self._local, 'batch', None) is batch:
+            del self._local.batch
+
+        pending, batch.pending = batch.pending, OrderedDict()
+        if pending:
+            self.callback(pending)
+
+
+class _Batch(object):
+    def __init__(self, run_on_commit, savepoint_ids):
+        self.run_on_commit = run_on_commit
+        self.savepoint_ids = savepoint_ids
+        self.pending = OrderedDict()
+        self.scheduled = False